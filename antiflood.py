@@ -0,0 +1,249 @@
+# antiflood.py
+# Routerlar oldidagi himoya qatlami: bitta user yoki skript 📊 Balans /
+# 🏆 Top ni ketma-ket bosib DB ni band qilib qo'ymasligi uchun.
+#   - dublikat: bir xil tugma / callback FLOOD_DEDUP_WINDOW ichida – tashlanadi
+#     (birinchisining javobi yetarli)
+#   - per-user token bucket – "limited"
+#   - navbat chuqur bo'lsa og'ir route lar (expensive=True) – "shed"
+#   - global parallel handlerlar chegarasi – slot bo'lmasa "busy"
+# Adminlar bu cheklovlardan ozod. Rad etilgan userga tayyor (DB siz)
+# "sekinroq" matni FLOOD_WARN_INTERVAL da bir martadan ko'p yuborilmaydi.
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from config import (
+    ADMIN_IDS,
+    ASYNC_FLOOD_MAX_CONCURRENT,
+    FLOOD_DEDUP_WINDOW,
+    FLOOD_MAX_CONCURRENT,
+    FLOOD_MAX_TRACKED_USERS,
+    FLOOD_SHED_DEPTH,
+    FLOOD_USER_BURST,
+    FLOOD_USER_RATE,
+    FLOOD_WAIT_TIMEOUT,
+    FLOOD_WARN_INTERVAL,
+)
+
+
+# admit() natijalari
+ALLOWED = "allowed"      # slot olindi – keyin release() shart
+EXEMPT = "exempt"        # admin – hech narsa olinmadi
+DUPLICATE = "duplicate"
+LIMITED = "limited"
+SHED = "shed"
+BUSY = "busy"
+
+REJECTIONS = (DUPLICATE, LIMITED, SHED, BUSY)
+
+SLOW_DOWN_TEXT = "⏳ Juda tez! Bir necha soniyadan keyin qayta urinib ko'ring."
+BUSY_TEXT = "⚠️ Bot hozir band. Birozdan keyin qayta urinib ko'ring."
+
+
+class _UserState:
+    __slots__ = ("tokens", "updated", "last_key", "last_at", "warned_at")
+
+    def __init__(self, now: float, burst: float):
+        self.tokens = burst
+        self.updated = now
+        self.last_key: Optional[str] = None
+        self.last_at = 0.0
+        self.warned_at = 0.0
+
+
+class FloodGuard:
+    """
+    Ishlatish (router ichida):
+        verdict = guard.admit(user_id, message.text, expensive)
+        if verdict in REJECTIONS:
+            text = guard.reply_text(user_id, verdict)   # None – javob bermaymiz
+            ...
+            return
+        try:
+            handler(message)
+        finally:
+            if verdict == ALLOWED:
+                guard.release()
+    """
+
+    def __init__(
+        self,
+        rate: float = FLOOD_USER_RATE,
+        burst: float = FLOOD_USER_BURST,
+        dedup_window: float = FLOOD_DEDUP_WINDOW,
+        max_concurrent: int = FLOOD_MAX_CONCURRENT,
+        shed_depth: int = FLOOD_SHED_DEPTH,
+        max_users: int = FLOOD_MAX_TRACKED_USERS,
+        admin_ids: Iterable[int] = ADMIN_IDS,
+    ):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.dedup_window = dedup_window
+        self.max_concurrent = max_concurrent
+        self.shed_depth = shed_depth
+        self.max_users = max_users
+        self.admin_ids = frozenset(admin_ids)
+
+        self._users: "OrderedDict[int, _UserState]" = OrderedDict()
+        self._users_lock = threading.Lock()
+        self._slots = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        # tashqi navbat (TeleBot thread pool / webhook navbatlari) chuqurligi
+        self._backlog: List[Callable[[], int]] = []
+        self._metrics = {
+            "allowed": 0,
+            DUPLICATE: 0,
+            LIMITED: 0,
+            SHED: 0,
+            BUSY: 0,
+            "max_depth": 0,
+        }
+
+    # ---------------------------------------
+    # Sozlash
+    # ---------------------------------------
+    def add_backlog(self, fn: Callable[[], int]):
+        """Handlerga yetib kelmagan update lar sonini beruvchi funksiya."""
+        self._backlog.append(fn)
+
+    def depth(self) -> int:
+        with self._slots:
+            depth = self._in_flight + self._waiting
+        for fn in self._backlog:
+            try:
+                depth += fn()
+            except Exception:
+                pass
+        return depth
+
+    # ---------------------------------------
+    # Per-user tekshiruvlar
+    # ---------------------------------------
+    def _check_user(self, user_id: int, key: Optional[str], now: float) -> Optional[str]:
+        with self._users_lock:
+            state = self._users.get(user_id)
+            if state is None:
+                state = _UserState(now, self.burst)
+                self._users[user_id] = state
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            else:
+                self._users.move_to_end(user_id)
+
+            if key is not None and key == state.last_key and now - state.last_at < self.dedup_window:
+                return DUPLICATE
+            state.last_key = key
+            state.last_at = now
+
+            state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+            state.updated = now
+            if state.tokens < 1.0:
+                return LIMITED
+            state.tokens -= 1.0
+            return None
+
+    def _refund(self, user_id: int):
+        """SHED / BUSY – user aybdor emas, olingan tokenni qaytaramiz."""
+        with self._users_lock:
+            state = self._users.get(user_id)
+            if state is not None:
+                state.tokens = min(self.burst, state.tokens + 1.0)
+
+    # ---------------------------------------
+    # Global slotlar
+    # ---------------------------------------
+    def _acquire_slot(self, timeout: float) -> bool:
+        with self._slots:
+            if self._in_flight >= self.max_concurrent:
+                if timeout <= 0:
+                    return False
+                self._waiting += 1
+                try:
+                    ok = self._slots.wait_for(lambda: self._in_flight < self.max_concurrent, timeout)
+                finally:
+                    self._waiting -= 1
+                if not ok:
+                    return False
+            self._in_flight += 1
+            return True
+
+    def release(self):
+        with self._slots:
+            self._in_flight -= 1
+            self._slots.notify()
+
+    # ---------------------------------------
+    # Tashqi API
+    # ---------------------------------------
+    def admit(self, user_id: int, key: Optional[str], expensive: bool = False, wait: bool = True) -> str:
+        """
+        Update ni handlerga o'tkazish mumkinmi. wait=False – slot kutilmaydi
+        (asyncio event loop ichidan chaqirilganda).
+        """
+        if user_id in self.admin_ids:
+            return EXEMPT
+
+        verdict = self._check_user(user_id, key, time.monotonic())
+        if verdict is None:
+            depth = self.depth()
+            with self._users_lock:
+                self._metrics["max_depth"] = max(self._metrics["max_depth"], depth)
+            if expensive and depth >= self.shed_depth:
+                verdict = SHED
+            elif not self._acquire_slot(FLOOD_WAIT_TIMEOUT if wait else 0):
+                verdict = BUSY
+            if verdict is not None:
+                self._refund(user_id)
+
+        with self._users_lock:
+            self._metrics[verdict or "allowed"] += 1
+        return verdict or ALLOWED
+
+    def reply_text(self, user_id: int, verdict: str) -> Optional[str]:
+        """Rad etilgan userga javob matni; dublikat yoki yaqinda ogohlantirilgan bo'lsa None."""
+        if verdict == DUPLICATE:
+            return None
+        now = time.monotonic()
+        with self._users_lock:
+            state = self._users.get(user_id)
+            if state is not None:
+                if now - state.warned_at < FLOOD_WARN_INTERVAL:
+                    return None
+                state.warned_at = now
+        return SLOW_DOWN_TEXT if verdict == LIMITED else BUSY_TEXT
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._users_lock:
+            data = dict(self._metrics)
+            data["tracked_users"] = len(self._users)
+        with self._slots:
+            data["in_flight"] = self._in_flight
+            data["waiting"] = self._waiting
+        return data
+
+
+_guards: Dict[int, FloodGuard] = {}
+_guards_lock = threading.Lock()
+
+
+def get_flood_guard(bot, asynchronous: bool = False) -> FloodGuard:
+    """
+    Har bir bot uchun bitta guard – xabar va callback routerlari umumiy
+    slotlarni bo'lishadi. asynchronous=True (AsyncTeleBot) – parallel
+    handlerlar chegarasi ASYNC_FLOOD_MAX_CONCURRENT (thread pool hajmi emas).
+    """
+    with _guards_lock:
+        guard = _guards.get(id(bot))
+        if guard is None:
+            max_concurrent = ASYNC_FLOOD_MAX_CONCURRENT if asynchronous else FLOOD_MAX_CONCURRENT
+            guard = FloodGuard(max_concurrent=max_concurrent)
+            # threaded TeleBot: thread pool navbatida kutayotgan update lar
+            pool = getattr(bot, "worker_pool", None)
+            tasks = getattr(pool, "tasks", None)
+            if tasks is not None:
+                guard.add_backlog(tasks.qsize)
+            _guards[id(bot)] = guard
+        return guard
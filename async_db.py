@@ -0,0 +1,46 @@
+# async_db.py
+# AsyncTeleBot handlerlari uchun ma'lumotlar qatlami: database.py / views.py
+# dagi sinxron funksiyalar alohida thread poolda bajariladi, event loop
+# SQLite kutayotganda boshqa update larni qayta ishlashda davom etadi.
+#
+#     text, kb = await run_db(views.balance_dashboard, user.id)
+#
+# Yozuvlar baribir @writes orqali DatabaseWriter threadiga boradi; o'qishlar
+# pool threadlarining o'z ulanishlarida (per-thread connection) bajariladi.
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from config import ASYNC_DB_WORKERS
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_db_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=ASYNC_DB_WORKERS, thread_name_prefix="async-db"
+            )
+        return _executor
+
+
+async def run_db(fn: Callable, *args, **kwargs) -> Any:
+    """fn(*args, **kwargs) ni DB poolida bajarib, natijasini kutadi."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_db_executor(), functools.partial(fn, *args, **kwargs))
+
+
+def shutdown_db_executor():
+    """Pooldagi ishlarni tugatadi (ulanishlarni close_all_connections yopadi)."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
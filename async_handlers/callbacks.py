@@ -0,0 +1,117 @@
+# async_handlers/callbacks.py
+from telebot import TeleBot, types
+from telebot.async_telebot import AsyncTeleBot
+
+import views
+from async_db import run_db
+from callback_data import BACK_TO_BALANCE, CHECK_CHANNEL, SERVICE, SERVICE_LOCKED
+from config import SERVICES
+from database import reserve_service
+from handlers.service_callbacks import service_idempotency_key
+from keyboards import subscription_keyboard
+from pending import notify_admins_new_request
+from router import get_callback_router
+from .subscription import is_user_subscribed
+from .text_handlers import send_main_menu
+
+
+def register_callback_handlers(bot: AsyncTeleBot, sync_bot: TeleBot):
+    """handlers/callbacks.py + handlers/service_callbacks.py ning async varianti."""
+    callbacks = get_callback_router(bot)
+
+    @callbacks.route(CHECK_CHANNEL)
+    async def callback_check_channel(call: types.CallbackQuery, data: dict):
+        user_id = call.from_user.id
+        chat_id = call.message.chat.id
+
+        # user hozirgina obuna bo'lgan bo'lishi mumkin – keshdagi "a'zo emas" ni e'tiborsiz qoldiramiz
+        if not await is_user_subscribed(bot, user_id, force_refresh=True):
+            await bot.answer_callback_query(call.id, "Obuna bo'lmaganga o'xshaysiz.", show_alert=True)
+            try:
+                await bot.edit_message_text(
+                    "❌ Obuna bo'lmaganga o'xshaysiz. Iltimos, kanalga obuna bo'ling va qaytadan urining.",
+                    chat_id,
+                    call.message.message_id,
+                    reply_markup=subscription_keyboard(),
+                )
+            except Exception:
+                pass
+            return
+
+        await bot.answer_callback_query(call.id, "Obuna tasdiqlandi!")
+        try:
+            await bot.edit_message_text(
+                "✅ Obuna tasdiqlandi! Endi botdan bemalol foydalanishingiz mumkin.",
+                chat_id,
+                call.message.message_id,
+            )
+        except Exception:
+            pass
+
+        await send_main_menu(bot, chat_id, user_id)
+
+    @callbacks.route(SERVICE_LOCKED)
+    async def callback_service_locked(call: types.CallbackQuery, data: dict):
+        await bot.answer_callback_query(call.id, "Bu xizmat uchun balans yetarli emas.", show_alert=True)
+
+    @callbacks.route(BACK_TO_BALANCE)
+    async def callback_back_to_balance(call: types.CallbackQuery, data: dict):
+        await bot.answer_callback_query(call.id)
+        text, kb = await run_db(views.balance_dashboard, call.from_user.id)
+        await bot.send_message(call.message.chat.id, text, reply_markup=kb, parse_mode=None)
+
+    @callbacks.route(SERVICE)
+    async def handle_service_choice(call: types.CallbackQuery, data: dict):
+        user = call.from_user
+        chat_id = call.message.chat.id
+
+        service_key = data["key"]
+        svc = SERVICES.get(service_key)
+        if not svc:
+            await bot.answer_callback_query(call.id, "Xizmat topilmadi.", show_alert=True)
+            return
+
+        result = await run_db(
+            reserve_service,
+            user.id,
+            service_key,
+            idempotency_key=service_idempotency_key(call, service_key),
+        )
+        cost = result.get("cost", int(svc["cost"]))
+
+        if result["status"] == "duplicate":
+            await bot.answer_callback_query(call.id, "So'rovingiz allaqachon yuborilgan ✅", show_alert=False)
+            return
+
+        if result["status"] != "ok":
+            await bot.answer_callback_query(
+                call.id,
+                f"Balansingiz yetarli emas. Kerak: {cost}, sizda: {result.get('available_before', 0)}.",
+                show_alert=True,
+            )
+            return
+
+        # so'rov bazada – spinnerni darhol to'xtatamiz (loop bloklanmaydi,
+        # shuning uchun BackgroundExecutor kerak emas)
+        await bot.answer_callback_query(call.id, "So'rovingiz adminga yuborildi ✅", show_alert=False)
+
+        total = result["total_points"]
+        await run_db(
+            notify_admins_new_request,
+            sync_bot,
+            user.id,
+            service_key,
+            user={
+                "username": user.username,
+                "first_name": user.first_name,
+                "last_name": user.last_name,
+            },
+            stats={"total_points": total, "available_points": result["available_after"]},
+        )
+
+        text = views.service_accepted_text(svc, cost, total, result["available_before"] - cost)
+        try:
+            await bot.edit_message_text(chat_id=chat_id, message_id=call.message.message_id, text=text)
+        except Exception:
+            # Agar edit xato bersa (masalan, o'chib ketgan bo'lsa) – alohida xabar yuboramiz
+            await bot.send_message(chat_id, text)
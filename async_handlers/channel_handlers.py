@@ -0,0 +1,26 @@
+# async_handlers/channel_handlers.py
+from telebot import types
+from telebot.async_telebot import AsyncTeleBot
+
+from async_db import run_db
+from utils import find_channel_key, is_member_status, record_channel_member
+
+
+def register_channel_handlers(bot: AsyncTeleBot):
+    """handlers/channel_handlers.py ning async varianti (channel_members jadvali)."""
+
+    @bot.chat_member_handler()
+    async def on_chat_member(update: types.ChatMemberUpdated):
+        channel = find_channel_key(update.chat)
+        if channel is None:
+            return
+
+        member = update.new_chat_member
+        await run_db(
+            record_channel_member,
+            channel,
+            member.user.id,
+            member.status,
+            is_member_status(member),
+            "event",
+        )
@@ -0,0 +1,62 @@
+# async_handlers/subscription.py
+# utils.is_user_subscribed ning AsyncTeleBot varianti. Kesh / channel_members
+# o'qish va natijani yozish run_db orqali, get_chat_member esa async botning
+# o'zida (asyncio.wait_for bilan) – API kutilayotganda ASYNC_DB_WORKERS
+# threadlari band bo'lmaydi.
+import asyncio
+import logging
+
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+
+from async_db import run_db
+from config import SUBSCRIPTION_CHECK_TIMEOUT
+from utils import (
+    channel_target,
+    is_member_status,
+    plan_subscription_check,
+    record_channel_member,
+    stale_membership_ok,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+async def _fetch_membership(bot: AsyncTeleBot, channel: str, user_id: int) -> bool:
+    """utils._fetch_membership bilan bir xil: aniq API xatosi – "a'zo emas"."""
+    try:
+        member = await bot.get_chat_member(channel_target(channel), user_id)
+        status, is_member = member.status, is_member_status(member)
+    except ApiTelegramException:
+        status, is_member = "error", False
+    await run_db(record_channel_member, channel, user_id, status, is_member, "api")
+    return is_member
+
+
+async def is_user_subscribed(bot: AsyncTeleBot, user_id: int, force_refresh: bool = False) -> bool:
+    """Qoidalar utils.is_user_subscribed dagidek; kanallar parallel tekshiriladi."""
+    verdict, to_check = await run_db(plan_subscription_check, user_id, force_refresh)
+    if verdict is not None:
+        return verdict
+
+    results = await asyncio.gather(
+        *(
+            asyncio.wait_for(_fetch_membership(bot, channel, user_id), SUBSCRIPTION_CHECK_TIMEOUT)
+            for channel in to_check
+        ),
+        return_exceptions=True,
+    )
+
+    for channel, result in zip(to_check, results):
+        if not isinstance(result, BaseException):
+            if not result:
+                return False
+            continue
+
+        # timeout / tarmoq xatosi – yaqinda a'zo bo'lgan bo'lsa o'tkazamiz
+        if not await run_db(stale_membership_ok, channel, user_id):
+            return False
+        logger.warning("Obuna tekshiruvi javob bermadi (%s), eski natija ishlatildi", channel)
+
+    return True
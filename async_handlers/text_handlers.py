@@ -0,0 +1,135 @@
+# async_handlers/text_handlers.py
+# handlers/text_handlers.py ning AsyncTeleBot varianti: matnlar views.py dan,
+# DB / sinxron chaqiruvlar run_db orqali – event loop hech qachon bloklanmaydi.
+from typing import Dict
+
+from telebot import types
+from telebot.async_telebot import AsyncTeleBot
+
+import views
+from async_db import run_db
+from database import register_start, touch_user_activity
+from handlers.text_handlers import parse_ref_token
+from outbox import enqueue_message
+from router import get_message_router
+from .subscription import is_user_subscribed
+
+
+async def send_main_menu(bot: AsyncTeleBot, chat_id: int, user_id: int):
+    text, kb = views.main_menu(user_id)
+    await bot.send_message(chat_id, text, reply_markup=kb, parse_mode=None)
+
+
+def register_text_handlers(bot: AsyncTeleBot):
+    """Obuna tekshiruvi async_handlers.subscription orqali (get_chat_member async botda)."""
+    router = get_message_router(bot)
+    # touch_user_activity faqat xotiradagi buferni yangilaydi – loop da chaqirsa bo'ladi
+    me: Dict[str, str] = {}
+
+    async def ref_link(user_id: int) -> str:
+        # username o'zgarmaydi – get_me ni har bosishda emas, bir marta so'raymiz
+        if "username" not in me:
+            me["username"] = (await bot.get_me()).username
+        return views.ref_link_for(me["username"], user_id)
+
+    # /start
+    @router.command("start")
+    async def handle_start(message: types.Message):
+        user = message.from_user
+        chat_id = message.chat.id
+
+        args = ""
+        if " " in (message.text or ""):
+            args = message.text.split(" ", 1)[1].strip()
+        ref_id = parse_ref_token(args)
+
+        is_new = await run_db(
+            register_start,
+            user_id=user.id,
+            username=user.username,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            referrer_id=ref_id,
+        )
+
+        if is_new and ref_id:
+            # outbox orqali – bloklagan inviterga yozilmaydi, xato bo'lsa qayta uriniladi
+            inviter_text = views.new_referral_text(user.first_name, user.username)
+            await run_db(enqueue_message, ref_id, inviter_text)
+
+        if not await is_user_subscribed(bot, user.id):
+            text, kb = views.subscription_prompt()
+            await bot.send_message(chat_id, text, reply_markup=kb, parse_mode=None)
+            return
+
+        await send_main_menu(bot, chat_id, user.id)
+
+    # 🚀 Boshlash – referal dashboard
+    @router.text("🚀 Boshlash")
+    async def handle_boshlash(message: types.Message):
+        user = message.from_user
+        touch_user_activity(user.id)
+
+        text, kb = await run_db(views.referral_dashboard, user.id, await ref_link(user.id))
+        await bot.send_message(message.chat.id, text, reply_markup=kb, parse_mode=None)
+
+    # 📱 Share
+    @router.text("📱 Share")
+    async def handle_share(message: types.Message):
+        user = message.from_user
+        touch_user_activity(user.id)
+
+        text, kb = views.share_screen(user.id, await ref_link(user.id))
+        await bot.send_message(message.chat.id, text, reply_markup=kb, parse_mode=None)
+
+    # DB dan o'qib, (matn, klaviatura) qaytaradigan ekranlar
+    screens = {
+        "📊 Balans": views.balance_dashboard,
+        "🎁 Xizmat olish": views.services_screen,
+        "🌐 Network": views.network_screen,
+        "🏆 Top": views.top_screen,
+    }
+
+    @router.text("🌐 Network", "🏆 Top", expensive=True)
+    @router.text("📊 Balans", "🎁 Xizmat olish")
+    async def handle_screen(message: types.Message):
+        user = message.from_user
+        touch_user_activity(user.id)
+
+        text, kb = await run_db(screens[message.text], user.id)
+        await bot.send_message(message.chat.id, text, reply_markup=kb, parse_mode=None)
+
+    # ❓ Yordam menyu
+    @router.text("❓ Yordam")
+    async def handle_help(message: types.Message):
+        touch_user_activity(message.from_user.id)
+
+        text, kb = views.help_screen()
+        await bot.send_message(message.chat.id, text, reply_markup=kb, parse_mode=None)
+
+    static_help = {
+        "📖 Qanday ishlaydi?": views.HELP_HOW_TEXT,
+        "🔥 2-Level bonus?": views.HELP_BONUS_TEXT,
+        "💎 Mukofot olish?": views.rewards_text(),
+        "👥 Do'stlar faol?": views.HELP_FRIENDS_TEXT,
+    }
+
+    @router.text(*static_help)
+    async def handle_static_help(message: types.Message):
+        touch_user_activity(message.from_user.id)
+        await bot.send_message(message.chat.id, static_help[message.text], parse_mode=None)
+
+    @router.text("⏰ Retention check?", expensive=True)
+    async def help_retention(message: types.Message):
+        user = message.from_user
+        touch_user_activity(user.id)
+
+        text = await run_db(views.retention_text, user.id)
+        await bot.send_message(message.chat.id, text, parse_mode=None)
+
+    # 🔙 Asosiy
+    @router.text("🔙 Asosiy")
+    async def handle_back_to_main(message: types.Message):
+        user = message.from_user
+        touch_user_activity(user.id)
+        await send_main_menu(bot, message.chat.id, user.id)
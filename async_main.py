@@ -0,0 +1,131 @@
+# async_main.py
+# main.py ning asyncio varianti: AsyncTeleBot + async handlerlar (async_handlers/).
+#
+#     python async_main.py
+#
+# Foydalanuvchi oqimlari (menyu, balans, xizmat tanlash, obuna) coroutine
+# handlerlarda; SQLite chaqiruvlari async_db.run_db orqali thread poolda.
+# Admin komandalari, /givepoint va dialog qadamlari hali sinxron – ular
+# sinxron "ko'prik" botda ro'yxatdan o'tadi va async routerga mos kelmagan
+# xabarlar unga uzatiladi. Outbox va broadcast ham shu sinxron bot orqali
+# ishlaydi (o'z threadlarida); kanal obunasi esa async botning o'zida
+# tekshiriladi (async_handlers/subscription.py).
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot import TeleBot, types
+from telebot.async_telebot import AsyncTeleBot
+
+from config import (
+    ALLOWED_UPDATES,
+    ASYNC_BRIDGE_WORKERS,
+    BOT_TOKEN,
+    DB_WRITER_BATCH_WAIT_MS,
+    DB_WRITER_MAX_BATCH,
+)
+from database import (
+    close_all_connections,
+    set_database_writer,
+    start_activity_flusher,
+    stop_activity_flusher,
+)
+from db_writer import DatabaseWriter
+from async_db import shutdown_db_executor
+from background import get_background_executor
+from outbox import get_outbox_sender
+from broadcast import get_broadcast_manager
+from migrations import run_migrations
+from async_handlers.text_handlers import register_text_handlers
+from async_handlers.callbacks import register_callback_handlers
+from async_handlers.channel_handlers import register_channel_handlers
+from handlers.admin_handlers import register_admin_handlers
+from points import register_points_handlers
+from router import get_message_router
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+bot = AsyncTeleBot(BOT_TOKEN)   # hech qanday parse_mode bermaymiz
+bot.parse_mode = None
+
+# sinxron ko'prik: update larni o'zi olmaydi, faqat process_new_messages orqali
+sync_bot = TeleBot(BOT_TOKEN, threaded=False)
+sync_bot.parse_mode = None
+
+
+def register_bridge(bot: AsyncTeleBot, sync_bot: TeleBot, executor: ThreadPoolExecutor):
+    """
+    Oxirgi handler: async routerga mos kelmagan har qanday xabar sinxron botga
+    uzatiladi (admin routelari, /givepoint, router.step dialog qadamlari).
+    Async handlerlardan KEYIN ro'yxatdan o'tishi kerak. Ochiq dialog qadami
+    bo'lsa async routega mos xabar ham sinxron botga uzatiladi.
+    """
+
+    async def forward(message: types.Message):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(executor, sync_bot.process_new_messages, [message])
+
+    # ochiq dialog (users:search, approve:comment, givepoint...) paytida menyu
+    # tugmasi matni yozilsa ham xabar sinxron botdagi qadamga borishi kerak
+    get_message_router(bot).delegate_steps(get_message_router(sync_bot), forward)
+
+    @bot.message_handler(func=lambda m: True, content_types=["text"])
+    async def forward_to_sync(message: types.Message):
+        await forward(message)
+
+
+async def run():
+    # DB yaratish / migrate
+    run_migrations()
+
+    # barcha yozuvlar bitta thread orqali (group commit)
+    writer = DatabaseWriter(
+        max_batch=DB_WRITER_MAX_BATCH,
+        batch_wait_ms=DB_WRITER_BATCH_WAIT_MS,
+    )
+    writer.start()
+    set_database_writer(writer)
+    start_activity_flusher()
+
+    # sinxron admin handlerlari ishlatadigan fon ishlari
+    background = get_background_executor()
+    background.start()
+
+    outbox = get_outbox_sender(sync_bot)
+    outbox.start()
+
+    bridge = ThreadPoolExecutor(max_workers=ASYNC_BRIDGE_WORKERS, thread_name_prefix="sync-bridge")
+
+    # Handlers ro'yxatdan o'tkazish
+    register_text_handlers(bot)
+    register_callback_handlers(bot, sync_bot)
+    register_channel_handlers(bot)
+    register_admin_handlers(sync_bot)
+    register_points_handlers(sync_bot)
+    register_bridge(bot, sync_bot, bridge)
+
+    # restart oldidan tugamay qolgan broadcastlar
+    get_broadcast_manager(sync_bot).start_watchdog()
+
+    logger.info("Selloriy bot (AsyncTeleBot) ishga tushdi...")
+    try:
+        # polling uchun webhook o'chirilgan bo'lishi shart
+        await bot.remove_webhook()
+        await bot.infinity_polling(skip_pending=True, allowed_updates=ALLOWED_UPDATES)
+    finally:
+        await bot.close_session()
+        bridge.shutdown(wait=True)
+        background.stop()
+        outbox.stop()
+        shutdown_db_executor()
+        stop_activity_flusher()
+        writer.stop()
+        set_database_writer(None)
+        close_all_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
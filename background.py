@@ -0,0 +1,138 @@
+# background.py
+# Handler threadidan tashqariga chiqariladigan ishlar (adminlarga xabar,
+# xabarni tahrirlash va h.k.) uchun cheklangan navbatli worker pool.
+# Navbat to'lsa ish chaqiruvchi threadda bajariladi (yo'qolmaydi, lekin
+# handler sekinlashadi – tabiiy backpressure).
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from config import BACKGROUND_QUEUE_SIZE, BACKGROUND_WORKERS
+
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class BackgroundExecutor:
+    """
+    Ishlatish:
+        executor = get_background_executor()
+        executor.submit(notify_admins_new_request, bot, user_id, key)
+
+    Ishlar fire-and-forget: natija qaytarilmaydi, xato faqat logga yoziladi
+    va metrikada hisoblanadi.
+    """
+
+    def __init__(self, workers: int = 4, max_queue: int = 1000):
+        self.workers = workers
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue)
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._metrics = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "inline_runs": 0,
+            "max_queue_depth": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+        }
+
+    # ---------------------------------------
+    # Tashqi API
+    # ---------------------------------------
+    def start(self):
+        with self._lock:
+            if any(t.is_alive() for t in self._threads):
+                return
+            self._threads = [
+                threading.Thread(target=self._run, name=f"background-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Navbatdagi ishlarni tugatib, workerlarni to'xtatadi."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(_STOP)
+        for thread in threads:
+            thread.join(timeout)
+
+    def is_running(self) -> bool:
+        return any(t.is_alive() for t in self._threads)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> bool:
+        """
+        Navbatga qo'yadi. True – fonda bajariladi; False – navbat to'la yoki
+        workerlar ishlamayapti, ish shu threadda bajarildi.
+        """
+        with self._lock:
+            self._metrics["submitted"] += 1
+
+        if self.is_running():
+            try:
+                self._queue.put_nowait((fn, args, kwargs, time.monotonic()))
+                depth = self._queue.qsize()
+                with self._lock:
+                    self._metrics["max_queue_depth"] = max(self._metrics["max_queue_depth"], depth)
+                return True
+            except queue.Full:
+                pass
+
+        with self._lock:
+            self._metrics["inline_runs"] += 1
+        self._execute(fn, args, kwargs, time.monotonic())
+        return False
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self._metrics)
+        data["queue_depth"] = self._queue.qsize()
+        finished = data["completed"] + data["failed"]
+        data["avg_wait_ms"] = round(data.pop("total_wait_ms") / finished, 1) if finished else 0
+        data["max_wait_ms"] = round(data["max_wait_ms"], 1)
+        return data
+
+    # ---------------------------------------
+    # Ichki ish
+    # ---------------------------------------
+    def _execute(self, fn: Callable, args: tuple, kwargs: dict, queued_at: float):
+        wait_ms = (time.monotonic() - queued_at) * 1000
+        try:
+            fn(*args, **kwargs)
+            ok = True
+        except Exception:
+            logger.exception("Fon ishi xatosi: %s", getattr(fn, "__name__", fn))
+            ok = False
+
+        with self._lock:
+            self._metrics["completed" if ok else "failed"] += 1
+            self._metrics["total_wait_ms"] += wait_ms
+            self._metrics["max_wait_ms"] = max(self._metrics["max_wait_ms"], wait_ms)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            self._execute(*item)
+
+
+_executor: Optional[BackgroundExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_background_executor() -> BackgroundExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = BackgroundExecutor(BACKGROUND_WORKERS, BACKGROUND_QUEUE_SIZE)
+        return _executor
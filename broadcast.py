@@ -0,0 +1,389 @@
+# broadcast.py
+# Fon broadcast: vazifa broadcast_jobs jadvalida saqlanadi (kursor + hisoblagichlar),
+# xabarlar token bucket orqali worker pool da yuboriladi, 429 da kutiladi,
+# restartdan keyin to'xtagan joyidan davom etadi.
+
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException
+
+from config import (
+    BROADCAST_CHUNK_SIZE,
+    BROADCAST_LEASE_TTL,
+    BROADCAST_MAX_RETRIES,
+    BROADCAST_RATE_PER_SEC,
+    BROADCAST_WORKERS,
+)
+from database import (
+    BROADCAST_ACTIVE_STATUSES,
+    claim_broadcast_lease,
+    close_thread_connection,
+    count_recipients,
+    create_broadcast_job,
+    get_active_broadcast_jobs,
+    get_broadcast_job,
+    get_recipient_page,
+    mark_undeliverable,
+    release_broadcast_lease,
+    save_broadcast_progress,
+    set_broadcast_status,
+    set_broadcast_status_message,
+)
+from utils import TokenBucket, is_unreachable_error, retry_after_seconds
+
+
+logger = logging.getLogger(__name__)
+
+# natijalar
+DELIVERED = "delivered"
+BLOCKED = "blocked"
+FAILED = "failed"
+
+# progress xabarini necha soniyada bir yangilash
+PROGRESS_EVERY_SEC = 5
+# pauza holatida DB dan holatni qayta tekshirish oralig'i
+PAUSE_POLL_SEC = 2
+
+
+def parse_segment(spec: str) -> Tuple[Dict[str, Any], Optional[str]]:
+    """
+    "active:7 points:10 pending never" -> segment dict.
+    Xato bo'lsa (segment, xato_matni).
+    """
+    segment: Dict[str, Any] = {}
+    for token in spec.split():
+        name, _, value = token.partition(":")
+        name = name.lower()
+        if name == "active" and value.isdigit():
+            segment["active_days"] = int(value)
+        elif name == "points" and value.lstrip("-").isdigit():
+            segment["min_points"] = int(value)
+        elif name == "pending" and not value:
+            segment["has_pending"] = True
+        elif name == "never" and not value:
+            segment["never_redeemed"] = True
+        else:
+            return segment, f"Noma'lum filtr: {token}"
+    return segment, None
+
+
+def describe_segment(segment: Dict[str, Any]) -> str:
+    if not segment:
+        return "barcha foydalanuvchilar"
+    parts = []
+    if segment.get("active_days"):
+        parts.append(f"so'nggi {segment['active_days']} kunda faol")
+    if segment.get("min_points") is not None:
+        parts.append(f"{segment['min_points']}+ ball")
+    if segment.get("has_pending"):
+        parts.append("pending so'rovi bor")
+    if segment.get("never_redeemed"):
+        parts.append("hali xizmat olmagan")
+    return ", ".join(parts)
+
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(max(seconds, 0))
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours} soat {minutes} daq"
+    if minutes:
+        return f"{minutes} daq {secs} s"
+    return f"{secs} s"
+
+
+class BroadcastManager:
+    """
+    Bitta jarayonda bitta menejer (get_broadcast_manager). Bir vaqtda bitta
+    faol (running/paused) vazifa. Pauza/davom/bekor qilish DB holati orqali –
+    runner har bo'lak oralig'ida holatni qayta o'qiydi. Bir nechta jarayon
+    bo'lsa (supervisor), vazifani faqat DB dagi lease egasi yurgizadi –
+    /bc_resume boshqa workerda bajarilsa ham ikkinchi runner ishlamaydi.
+    """
+
+    def __init__(self, bot: TeleBot):
+        self.bot = bot
+        self.bucket = TokenBucket(BROADCAST_RATE_PER_SEC)
+        self.pool = ThreadPoolExecutor(
+            max_workers=BROADCAST_WORKERS, thread_name_prefix="broadcast"
+        )
+        self._runners: Dict[int, threading.Thread] = {}
+        self._lock = threading.Lock()
+        # lease egasi: jarayon + menejer (pid lar qayta ishlatilishi mumkin)
+        self.runner_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._watchdog: Optional[threading.Thread] = None
+
+    # ---------------------------------------
+    # Boshqaruv
+    # ---------------------------------------
+    def start(
+        self,
+        admin_id: int,
+        chat_id: int,
+        text: str,
+        segment: Optional[Dict[str, Any]] = None,
+    ) -> Optional[int]:
+        """Yangi vazifa (segment – database.SEGMENT_KEYS filtrlari). Boshqa faol vazifa bo'lsa None."""
+        if get_active_broadcast_jobs():
+            return None
+
+        segment = segment or {}
+        total = count_recipients(segment)
+        job_id = create_broadcast_job(admin_id, chat_id, text, total, segment)
+        try:
+            msg = self.bot.send_message(
+                chat_id,
+                f"📢 Broadcast #{job_id} boshlandi: {total} ta foydalanuvchi "
+                f"({describe_segment(segment)}).\n"
+                f"Boshqarish: /bc_pause {job_id}  /bc_resume {job_id}  /bc_cancel {job_id}",
+                parse_mode=None,
+            )
+        except Exception:
+            # runnersiz 'running' vazifa qolmasin (keyingi /broadcast ni ham to'sadi)
+            set_broadcast_status(job_id, "cancelled", only_from=("running",))
+            raise
+        set_broadcast_status_message(job_id, msg.message_id)
+        self._spawn(job_id)
+        return job_id
+
+    def pause(self, job_id: int) -> bool:
+        return set_broadcast_status(job_id, "paused", only_from=("running",))
+
+    def resume(self, job_id: int) -> bool:
+        changed = set_broadcast_status(job_id, "running", only_from=("paused",))
+        if changed:
+            self._spawn(job_id)
+        return changed
+
+    def cancel(self, job_id: int) -> bool:
+        return set_broadcast_status(job_id, "cancelled", only_from=BROADCAST_ACTIVE_STATUSES)
+
+    def resume_pending(self):
+        """'running' bo'lib, lease i bo'sh / muddati o'tgan vazifalarni davom ettiramiz."""
+        now = time.time()
+        for job in get_active_broadcast_jobs():
+            if job["status"] != "running":
+                continue
+            if job["runner_id"] not in (None, self.runner_id) and job["lease_until"] >= now:
+                continue
+            with self._lock:
+                if job["id"] in self._runners:
+                    continue
+            logger.info("Broadcast #%s davom ettirilmoqda (cursor=%s)", job["id"], job["cursor_user_id"])
+            self._spawn(job["id"])
+
+    def start_watchdog(self):
+        """
+        Startupda: resume_pending() darhol va keyin har BROADCAST_LEASE_TTL/2
+        da – egasi (boshqa jarayon) o'lgan vazifalar ham davom etadi.
+        """
+        with self._lock:
+            if self._watchdog is not None and self._watchdog.is_alive():
+                return
+            self._watchdog = threading.Thread(
+                target=self._watch, name="broadcast-watchdog", daemon=True
+            )
+            self._watchdog.start()
+
+    def _watch(self):
+        while True:
+            try:
+                self.resume_pending()
+            except Exception:
+                logger.exception("Broadcast watchdog xatosi")
+            time.sleep(BROADCAST_LEASE_TTL / 2)
+
+    def _claim(self, job_id: int) -> bool:
+        return claim_broadcast_lease(job_id, self.runner_id, time.time(), BROADCAST_LEASE_TTL)
+
+    def _spawn(self, job_id: int):
+        with self._lock:
+            runner = self._runners.get(job_id)
+            if runner is not None and runner.is_alive():
+                return
+            runner = threading.Thread(
+                target=self._run,
+                args=(job_id,),
+                name=f"broadcast-job-{job_id}",
+                daemon=True,
+            )
+            self._runners[job_id] = runner
+            runner.start()
+
+    # ---------------------------------------
+    # Yuborish
+    # ---------------------------------------
+    def send_one(self, user_id: int, text: str) -> str:
+        """
+        Bitta xabar: token bucket + 429 / tarmoq xatolarida qayta urinish.
+        429 (retry_after) urinish hisoblanmaydi – Telegram shunchaki kutishni so'radi.
+        """
+        attempt = 0
+        while attempt <= BROADCAST_MAX_RETRIES:
+            self.bucket.acquire()
+            try:
+                self.bot.send_message(user_id, text, parse_mode=None)
+                return DELIVERED
+            except ApiTelegramException as exc:
+                wait = retry_after_seconds(exc)
+                if wait is not None:
+                    # Telegram butun bot uchun kutishni so'radi
+                    self.bucket.pause(wait)
+                    continue
+                if is_unreachable_error(exc):
+                    return BLOCKED
+                if exc.error_code >= 500 and attempt < BROADCAST_MAX_RETRIES:
+                    time.sleep(2 ** attempt)
+                    attempt += 1
+                    continue
+                return FAILED
+            except Exception:
+                if attempt < BROADCAST_MAX_RETRIES:
+                    time.sleep(2 ** attempt)
+                    attempt += 1
+                    continue
+                return FAILED
+        return FAILED
+
+    def _wait_while_paused(self, job_id: int) -> Optional[dict]:
+        """
+        Holatni qayta o'qiydi va lease ni uzaytiradi; pauzada kutadi. Davom
+        etish kerak bo'lsa job, aks holda (tugagan / lease boshqada) None.
+        """
+        while True:
+            job = get_broadcast_job(job_id)
+            if job is None or job["status"] not in BROADCAST_ACTIVE_STATUSES:
+                return None
+            if not self._claim(job_id):
+                logger.warning("Broadcast #%s: lease boshqa runnerda, to'xtatildi", job_id)
+                return None
+            if job["status"] == "running":
+                return job
+            time.sleep(PAUSE_POLL_SEC)
+
+    def _run(self, job_id: int):
+        try:
+            if not self._claim(job_id):
+                # boshqa jarayon (yoki hali muddati o'tmagan eski lease) yurgizyapti
+                logger.info("Broadcast #%s: lease band, runner boshlanmadi", job_id)
+                return
+            try:
+                self._run_job(job_id)
+            finally:
+                release_broadcast_lease(job_id, self.runner_id)
+        except Exception:
+            logger.exception("Broadcast #%s xatosi", job_id)
+        finally:
+            with self._lock:
+                self._runners.pop(job_id, None)
+            close_thread_connection()
+
+    def _run_job(self, job_id: int):
+        started = time.monotonic()
+        sent_this_run = 0
+        last_progress = 0.0
+
+        while True:
+            job = self._wait_while_paused(job_id)
+            if job is None:
+                break
+
+            ids = get_recipient_page(job["segment"], job["cursor_user_id"], BROADCAST_CHUNK_SIZE)
+            if not ids:
+                set_broadcast_status(job_id, "done", only_from=("running",))
+                break
+
+            results = list(self.pool.map(lambda uid: self.send_one(uid, job["text"]), ids))
+            # keyingi broadcastlar va bildirishnomalar ularni o'tkazib yuboradi
+            mark_undeliverable([uid for uid, r in zip(ids, results) if r == BLOCKED])
+            save_broadcast_progress(
+                job_id,
+                ids[-1],
+                results.count(DELIVERED),
+                results.count(BLOCKED),
+                results.count(FAILED),
+            )
+            sent_this_run += len(ids)
+
+            now = time.monotonic()
+            if now - last_progress >= PROGRESS_EVERY_SEC:
+                last_progress = now
+                self._update_progress(job_id, sent_this_run, now - started)
+
+        self._final_report(job_id)
+
+    # ---------------------------------------
+    # Adminga hisobot
+    # ---------------------------------------
+    def _progress_text(self, job: dict, eta: Optional[str]) -> str:
+        processed = job["delivered"] + job["blocked"] + job["failed"]
+        total = max(job["total"], processed)
+        percent = int(processed * 100 / total) if total else 100
+        lines = [
+            f"📢 Broadcast #{job['id']} — {job['status']}",
+            f"Jarayon: {processed}/{total} ({percent}%)",
+            f"✅ Yetkazildi: {job['delivered']}",
+            f"🚫 Bloklagan: {job['blocked']}",
+            f"⚠️ Xato: {job['failed']}",
+        ]
+        if eta:
+            lines.append(f"⏱ Qolgan vaqt: ~{eta}")
+        return "\n".join(lines)
+
+    def _update_progress(self, job_id: int, sent_this_run: int, elapsed: float):
+        job = get_broadcast_job(job_id)
+        if job is None or not job["status_message_id"]:
+            return
+        processed = job["delivered"] + job["blocked"] + job["failed"]
+        rate = sent_this_run / elapsed if elapsed > 0 else 0
+        eta = _format_duration((job["total"] - processed) / rate) if rate > 0 else None
+        try:
+            self.bot.edit_message_text(
+                self._progress_text(job, eta),
+                job["chat_id"],
+                job["status_message_id"],
+            )
+        except Exception:
+            pass
+
+    def _final_report(self, job_id: int):
+        job = get_broadcast_job(job_id)
+        if job is None or job["status"] in BROADCAST_ACTIVE_STATUSES:
+            return
+        title = "yakunlandi ✅" if job["status"] == "done" else "bekor qilindi ❌"
+        text = (
+            f"📢 Broadcast #{job_id} {title}\n\n"
+            f"✅ Yetkazildi: {job['delivered']}\n"
+            f"🚫 Bloklagan: {job['blocked']}\n"
+            f"⚠️ Xato: {job['failed']}"
+        )
+        try:
+            self.bot.send_message(job["chat_id"], text, parse_mode=None)
+        except Exception:
+            logger.exception("Broadcast #%s hisobotini yuborib bo'lmadi", job_id)
+
+    def status_text(self, job_id: int) -> Optional[str]:
+        job = get_broadcast_job(job_id)
+        if job is None:
+            return None
+        return self._progress_text(job, None)
+
+
+_manager: Optional[BroadcastManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_broadcast_manager(bot: TeleBot) -> BroadcastManager:
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = BroadcastManager(bot)
+        return _manager
@@ -0,0 +1,59 @@
+# callback_data.py
+# Inline tugmalar uchun callback_data kodeki: "<yo'l>[:<maydon>...]".
+# Tugma yasash (keyboards.py) va uni o'qish (router.CallbackRouter) bitta
+# ta'rifdan foydalanadi – format ikki joyda qo'lda yozilmaydi.
+#
+#     SERVICE = CallbackData("service", key=str)
+#     SERVICE.new(key="canva")        -> "service:canva"
+#     SERVICE.parse_args(["canva"])   -> {"key": "canva"}
+
+from typing import Any, Dict, List, Sequence
+
+
+SEP = ":"
+# Telegram cheklovi: callback_data 1-64 bayt
+MAX_BYTES = 64
+
+
+class CallbackData:
+    def __init__(self, *path: str, **fields: type):
+        if not path or any(not p or SEP in p for p in path):
+            raise ValueError(f"Noto'g'ri callback yo'li: {path!r}")
+        self.path = path
+        self.fields = list(fields.items())
+
+    def __repr__(self) -> str:
+        return f"CallbackData({SEP.join(self.path)!r}, fields={[n for n, _ in self.fields]})"
+
+    def new(self, **values: Any) -> str:
+        parts = list(self.path)
+        for name, _ in self.fields:
+            value = str(values[name])
+            if not value or SEP in value:
+                raise ValueError(f"{name}={value!r} callback_data ga yaroqsiz")
+            parts.append(value)
+
+        data = SEP.join(parts)
+        if len(data.encode("utf-8")) > MAX_BYTES:
+            raise ValueError(f"callback_data {MAX_BYTES} baytdan uzun: {data!r}")
+        return data
+
+    def parse_args(self, args: Sequence[str]) -> Dict[str, Any]:
+        """Yo'ldan keyingi qismlarni maydonlarga aylantiradi. Mos kelmasa ValueError."""
+        if len(args) != len(self.fields):
+            raise ValueError(f"{self!r}: {len(args)} ta qiymat")
+        return {name: kind(value) for (name, kind), value in zip(self.fields, args)}
+
+
+def split(data: str) -> List[str]:
+    return data.split(SEP)
+
+
+# ---------------------------------------
+# Botdagi barcha callback turlari (eski tugmalar ishlashda davom etishi
+# uchun mavjud formatlar o'zgartirilmagan)
+# ---------------------------------------
+CHECK_CHANNEL = CallbackData("check_channel")
+SERVICE = CallbackData("service", key=str)
+SERVICE_LOCKED = CallbackData("service_locked")
+BACK_TO_BALANCE = CallbackData("back_to_balance")
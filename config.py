@@ -18,21 +18,161 @@ CHANNELS = [
         "title": "Selloriy kanal",
         "username": None,  # public bo'lsa masalan "@selloriy_official", hozir private bo'lgani uchun None qoldiramiz
         "url": "https://t.me/+kHb0wbA7oIwxZTAy",
+        # private kanalni ham tekshirish uchun: bot kanalda admin bo'lsa,
+        # chat_id (-100...) ni yozing – chat_member update lari shu bo'yicha keladi
+        "chat_id": None,
     },
     # xohlasang keyin shu yerga yana kanal qo'shasan:
     # {
     #     "title": "Yana bir kanal",
     #     "username": "@yana_bir_kanal",
     #     "url": "https://t.me/yana_bir_kanal",
+    #     "chat_id": None,
     # },
 ]
 
+# Update qabul qilish rejimi: "polling" (standart), "webhook" yoki
+# "supervisor" (bir nechta worker jarayon, supervisor.py).
+# `python main.py --mode webhook` bilan ham tanlanadi.
+BOT_MODE = "polling"
+
+# chat_member Telegram tomonidan faqat so'ralganda yuboriladi
+ALLOWED_UPDATES = ["message", "callback_query", "chat_member"]
+
+# Supervisor rejimi: nechta worker jarayon (user_id % N bo'yicha), har bir
+# worker navbatining hajmi, worker metrikalarini yuborish / log qilish
+# oralig'i (soniya) va qulagan workerni qayta ishga tushirishdagi eng uzun kutish
+SUPERVISOR_WORKERS = 4
+SUPERVISOR_QUEUE_SIZE = 1000
+SUPERVISOR_METRICS_INTERVAL = 30
+SUPERVISOR_RESTART_BACKOFF_MAX = 30
+
+# Webhook: WEBHOOK_URL – tashqi https manzil (reverse proxy / TLS shu yerda);
+# bo'sh bo'lsa set_webhook chaqirilmaydi (lokal sinov uchun).
+# WEBHOOK_SECRET – Telegram X-Telegram-Bot-Api-Secret-Token sarlavhasida yuboradi.
+WEBHOOK_URL = ""
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_SECRET = "change-me-webhook-secret"
+WEBHOOK_WORKERS = 8
+WEBHOOK_QUEUE_SIZE = 2000
+WEBHOOK_DEDUP_SIZE = 10000
+WEBHOOK_MAX_BODY_BYTES = 1024 * 1024
+
+# TeleBot handler thread pool hajmi (xizmat so'rovlari atomar – parallel xavfsiz)
+BOT_NUM_THREADS = 8
+
+# async_main.py (AsyncTeleBot) uchun: sinxron SQLite chaqiruvlari event loop ni
+# to'sib qo'ymasligi uchun alohida thread pool hajmi, va AsyncTeleBot ga
+# ko'chirilmagan (admin, /givepoint, dialog qadamlari) xabarlarni sinxron botga
+# uzatuvchi workerlar soni
+ASYNC_DB_WORKERS = 8
+ASYNC_BRIDGE_WORKERS = 4
+
 # SQLite fayl nomi
 DB_PATH = "sellory.db"
 
+# SQLite ulanish sozlamalari (har bir thread ulanishiga bir marta qo'llanadi)
+DB_BUSY_TIMEOUT_MS = 5000        # lock bo'lsa shuncha kutamiz
+DB_CACHE_SIZE_KB = 64 * 1024     # page cache (har bir ulanish uchun), KiB
+DB_MMAP_SIZE = 256 * 1024 * 1024  # mmap hajmi, bayt
+
 # Level2 bonus foizi (0.25 = 25%)
 REFERRAL_BONUS_LEVEL2 = 0.25
 
+# Yagona yozuvchi thread: bitta tranzaksiyadagi maksimal buyruqlar soni
+# va birinchi buyruqdan keyin qo'shimcha buyruqlarni kutish vaqti (ms)
+DB_WRITER_MAX_BATCH = 200
+DB_WRITER_BATCH_WAIT_MS = 2
+# @writes chaqiruvchisi natijani eng ko'pi bilan shuncha soniya kutadi
+# (writer osilib qolsa handler threadlari abadiy bloklanmasin)
+DB_WRITER_RESULT_TIMEOUT = 30
+
+# last_active_at ni to'plab yozish: har N soniyada yoki M ta user yig'ilganda
+ACTIVITY_FLUSH_INTERVAL = 5
+ACTIVITY_FLUSH_MAX_ENTRIES = 500
+
+# Leaderboard: xotirada keshlanadigan top-K hajmi
+LEADERBOARD_CACHE_SIZE = 100
+
+# Eksport: kursordan bir martada o'qiladigan qatorlar va xotirada saqlanadigan
+# fayl chegarasi (undan katta bo'lsa vaqtinchalik faylga o'tadi)
+EXPORT_CHUNK_SIZE = 5000
+EXPORT_SPOOL_MAX_BYTES = 16 * 1024 * 1024
+# delta eksportda vaqt chegarasini shuncha soniya orqaga suramiz
+# (last_active_at kechiktirib yoziladi – qatorlar yo'qolmasin)
+EXPORT_DELTA_OVERLAP_SECONDS = 60
+
+# Broadcast: Telegram umumiy limiti ~30 xabar/s; bo'lak hajmi = kursor saqlanish qadami
+BROADCAST_RATE_PER_SEC = 25
+BROADCAST_WORKERS = 8
+BROADCAST_CHUNK_SIZE = 200
+BROADCAST_MAX_RETRIES = 3
+# Vazifani faqat lease egasi yurgizadi (supervisor rejimida bir nechta
+# jarayon): runner har bo'lak / pauza tekshiruvida uzaytiradi; egasi o'lsa
+# lease shuncha soniyada bo'shaydi va istalgan jarayon (har TTL/2 da
+# tekshiradi) vazifani kursordan davom ettiradi.
+BROADCAST_LEASE_TTL = 120
+
+# Kanal obunasi tekshiruvi (get_chat_member) keshi: a'zo bo'lsa uzoqroq,
+# a'zo bo'lmasa qisqa (obuna bo'lgach tezda o'tishi uchun) saqlanadi.
+# Xuddi shu TTL lar channel_members dagi API natijalariga ham qo'llanadi.
+# chat_member update laridan kelgan yozuvlar STALE_MAX_AGE gacha ishonchli
+# (bot o'chiq paytidagi update lar yo'qoladi – cheksiz ishonib bo'lmaydi).
+# API javob bermasa (timeout) – STALE_MAX_AGE dan yangi ijobiy natija bilan o'tkazamiz.
+SUBSCRIPTION_TTL_POSITIVE = 10 * 60
+SUBSCRIPTION_TTL_NEGATIVE = 30
+SUBSCRIPTION_STALE_MAX_AGE = 24 * 60 * 60
+SUBSCRIPTION_CACHE_MAX_ENTRIES = 50000
+SUBSCRIPTION_CHECK_TIMEOUT = 3.0
+SUBSCRIPTION_CHECK_WORKERS = 4
+
+# Fon ishlari (adminlarga xabar, xabarni tahrirlash): workerlar soni va navbat
+# chegarasi. CALLBACK_FAST_ACK – callbackga DB yozuvidan so'ng darhol javob
+# berib, qolganini fonda bajarish (False – hammasi handler ichida, eski tartib).
+BACKGROUND_WORKERS = 4
+BACKGROUND_QUEUE_SIZE = 1000
+CALLBACK_FAST_ACK = True
+
+# Outbox (navbat orqali yuboriladigan xabarlar): umumiy limit (broadcastdan
+# tashqari), bitta chatga xabarlar orasidagi minimal vaqt, urinishlar soni
+# (keyin dead), bir martada olinadigan xabarlar va workerlar soni
+OUTBOX_RATE_PER_SEC = 20
+OUTBOX_PER_CHAT_INTERVAL = 1.0
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_WORKERS = 4
+OUTBOX_POLL_INTERVAL = 1.0
+
+# Ko'p bosqichli dialoglar (/givepoint, broadcast matni, user qidirish,
+# /approve izohi): holat SQLite da saqlanadi – restart / boshqa worker
+# jarayonda ham davom etadi. Javob shu vaqt (soniya) ichida kelmasa dialog
+# bekor bo'ladi; jadvalda eng ko'pi bilan shuncha ochiq dialog turadi.
+CONVERSATION_TTL = 15 * 60
+CONVERSATION_MAX_ROWS = 10000
+
+# Anti-flood (antiflood.py, routerlar oldida): har bir user uchun sekundiga
+# FLOOD_USER_RATE ta so'rov (FLOOD_USER_BURST gacha to'planadi); bir xil
+# tugma / callback FLOOD_DEDUP_WINDOW soniya ichida qayta kelsa tashlanadi.
+# Bir vaqtda ko'pi bilan FLOOD_MAX_CONCURRENT ta handler (BOT_NUM_THREADS dan
+# kichik – bir nechta thread rad javobi uchun doim bo'sh), slot kutish
+# FLOOD_WAIT_TIMEOUT gacha. Navbat (ishlayotgan + kutayotgan update lar)
+# FLOOD_SHED_DEPTH dan oshsa og'ir route lar (Top, Network, Retention)
+# darhol rad etiladi. "Sekinroq" javobi userga FLOOD_WARN_INTERVAL da bir marta.
+FLOOD_USER_RATE = 1.0
+FLOOD_USER_BURST = 5
+FLOOD_DEDUP_WINDOW = 1.5
+FLOOD_MAX_CONCURRENT = 6
+FLOOD_WAIT_TIMEOUT = 2.0
+FLOOD_SHED_DEPTH = 20
+FLOOD_WARN_INTERVAL = 10
+FLOOD_MAX_TRACKED_USERS = 50000
+# AsyncTeleBot (async_main.py) uchun alohida, ancha katta chegara: coroutine lar
+# thread band qilmaydi, DB chaqiruvlari esa ASYNC_DB_WORKERS pool ida navbatda
+# turadi. Event loop slot kutmaydi – chegaradan oshsa darhol "band".
+ASYNC_FLOOD_MAX_CONCURRENT = 200
+
 # Retention tekshirish kunlari
 RETENTION_DAYS = 30
 
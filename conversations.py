@@ -0,0 +1,36 @@
+# conversations.py
+# Ko'p bosqichli dialoglar (register_next_step_handler o'rniga). Holat –
+# (state, JSON data) – conversations jadvalida chat_id bo'yicha, muddat
+# bilan saqlanadi: restartdan keyin ham, boshqa worker jarayonda ham dialog
+# davom etadi, tashlab ketilgan dialoglar esa xotirada to'planmaydi.
+#
+#     set_state(chat_id, admin_id, "givepoint:points", user=user_data)
+#
+#     @router.step("givepoint:points", admin=True)
+#     def givepoint_get_points(message, data): ...   # data == {"user": {...}}
+#
+# Router chatdan kelgan keyingi matnni oddiy route lardan OLDIN shu holat
+# bo'yicha yo'naltiradi. Handler chaqirilishidan oldin holat o'chiriladi
+# (next_step kabi bir martalik) – keyingi qadam uchun handler set_state ni
+# yana chaqiradi.
+
+import time
+from typing import Any, Dict, Optional
+
+from config import CONVERSATION_MAX_ROWS, CONVERSATION_TTL
+from database import clear_conversation, get_conversation, save_conversation
+
+
+def set_state(chat_id: int, user_id: int, state: str, ttl: float = CONVERSATION_TTL, **data: Any):
+    """Chatni `state` holatiga o'tkazadi; data JSON ga aylanadigan bo'lishi kerak."""
+    now = time.time()
+    save_conversation(chat_id, user_id, state, data, now, now + ttl, CONVERSATION_MAX_ROWS)
+
+
+def get_state(chat_id: int) -> Optional[Dict[str, Any]]:
+    """{"state", "data", "user_id", ...} yoki None (dialog yo'q / muddati o'tgan)."""
+    return get_conversation(chat_id, time.time())
+
+
+def clear_state(chat_id: int) -> bool:
+    return clear_conversation(chat_id)
@@ -1,93 +1,521 @@
 # database.py
+import functools
+import json
+import logging
 import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, Iterator, List, Tuple
 
-from config import DB_PATH, SERVICES, REFERRAL_BONUS_LEVEL2
+from config import (
+    DB_PATH,
+    SERVICES,
+    REFERRAL_BONUS_LEVEL2,
+    DB_BUSY_TIMEOUT_MS,
+    DB_CACHE_SIZE_KB,
+    DB_MMAP_SIZE,
+    DB_WRITER_RESULT_TIMEOUT,
+    LEADERBOARD_CACHE_SIZE,
+    ACTIVITY_FLUSH_INTERVAL,
+    ACTIVITY_FLUSH_MAX_ENTRIES,
+)
+
+
+logger = logging.getLogger(__name__)
 
 
 # ---------------------------------------
-# Bazaga ulanish
+# Bazaga ulanish (har bir thread uchun bitta uzoq yashovchi ulanish)
 # ---------------------------------------
-def get_connection():
-    conn = sqlite3.connect(DB_PATH)
+_local = threading.local()
+_pool_lock = threading.Lock()
+# (egasi bo'lgan thread, ulanish) – tugagan threadlarning ulanishlari yopiladi
+_pool: List[Tuple[threading.Thread, sqlite3.Connection]] = []
+
+
+def _open_connection() -> sqlite3.Connection:
+    """
+    Yangi ulanish ochib, PRAGMA sozlamalarini bir marta qo'llaymiz.
+    isolation_level=None – tranzaksiyalarni transaction() o'zi boshqaradi.
+    """
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,
+        check_same_thread=False,
+    )
     conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    # manfiy qiymat – KiB da
+    conn.execute(f"PRAGMA cache_size = -{int(DB_CACHE_SIZE_KB)}")
+    conn.execute(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE)}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+
+def _close_quietly(conn: sqlite3.Connection):
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Joriy thread ulanishini qaytaradi (yo'q bo'lsa – ochadi).
+    Ulanishni YOPMANG: u pool ga tegishli. Qisqa yashovchi threadlar oxirida
+    close_thread_connection() chaqiradi; unutilgan bo'lsa ham tugagan
+    threadlarning ulanishlari keyingi yangi ulanish ochilganda yopiladi.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _open_connection()
+        _local.conn = conn
+        with _pool_lock:
+            dead = [c for t, c in _pool if not t.is_alive()]
+            _pool[:] = [(t, c) for t, c in _pool if t.is_alive()]
+            _pool.append((threading.current_thread(), conn))
+        for old in dead:
+            _close_quietly(old)
     return conn
 
 
+def close_thread_connection():
+    """Joriy thread ulanishini yopib, pool dan olib tashlaydi (thread oxirida)."""
+    conn = _local.__dict__.pop("conn", None)
+    if conn is None:
+        return
+    with _pool_lock:
+        _pool[:] = [(t, c) for t, c in _pool if c is not conn]
+    _close_quietly(conn)
+
+
+def close_all_connections():
+    """Shutdown paytida barcha thread ulanishlarini yopamiz."""
+    with _pool_lock:
+        conns = [c for _, c in _pool]
+        _pool.clear()
+    for conn in conns:
+        _close_quietly(conn)
+    _local.__dict__.pop("conn", None)
+
+
+@contextmanager
+def transaction(immediate: bool = False):
+    """
+    Tranzaksiya konteksti:
+
+        with transaction() as cur:
+            cur.execute(...)
+
+    Xato bo'lsa – ROLLBACK, aks holda COMMIT.
+    Ichma-ich chaqirilsa SAVEPOINT ishlatiladi (tashqi tranzaksiya buzilmaydi).
+    immediate=True – yozish lockini darhol olamiz (BEGIN IMMEDIATE).
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+
+    if conn.in_transaction:
+        depth = getattr(_local, "sp_depth", 0) + 1
+        _local.sp_depth = depth
+        name = f"sp_{depth}"
+        cur.execute(f"SAVEPOINT {name}")
+        try:
+            yield cur
+        except BaseException:
+            cur.execute(f"ROLLBACK TO {name}")
+            cur.execute(f"RELEASE {name}")
+            raise
+        else:
+            cur.execute(f"RELEASE {name}")
+        finally:
+            _local.sp_depth = depth - 1
+        return
+
+    cur.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield cur
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+
 # ---------------------------------------
-# DB INIT – barcha jadvalar
+# Yagona yozuvchi (db_writer.DatabaseWriter) ga yo'naltirish
 # ---------------------------------------
-def init_db():
+_writer = None
+
+
+def set_database_writer(writer):
+    """main.py writer ni ishga tushirgach ro'yxatdan o'tkazadi (None – o'chirish)."""
+    global _writer
+    _writer = writer
+
+
+def get_writer_metrics() -> Optional[Dict[str, Any]]:
+    writer = _writer
+    if writer is None or not writer.is_running():
+        return None
+    return writer.metrics()
+
+
+def writes(fn):
+    """
+    O'zgartiruvchi funksiyalar uchun dekorator: writer ishlayotgan bo'lsa
+    chaqiruv uning navbatiga tushadi va natija COMMIT dan keyin qaytadi.
+    Writer threadining o'zida yoki ochiq tranzaksiya ichida – to'g'ridan-to'g'ri.
+    Natija DB_WRITER_RESULT_TIMEOUT dan ko'p kutilmaydi (TimeoutError).
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        writer = _writer
+        if (
+            writer is None
+            or not writer.is_running()
+            or writer.is_writer_thread()
+            or get_connection().in_transaction
+        ):
+            return fn(*args, **kwargs)
+        return writer.submit(fn, *args, **kwargs).result(timeout=DB_WRITER_RESULT_TIMEOUT)
+
+    return wrapper
+
+
+def configure_database():
+    """
+    Startupda bir marta: WAL rejimi (fayl darajasida saqlanib qoladi).
+    """
     conn = get_connection()
-    cur = conn.cursor()
+    conn.execute("PRAGMA journal_mode = WAL")
 
-    # foydalanuvchilar
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            referrer_id INTEGER,
-            created_at TEXT,
-            last_active_at TEXT
+
+# ---------------------------------------
+# user_balances – triggerlar, rebuild / verify
+# ---------------------------------------
+def _total_points_sql(prefix: str = "") -> str:
+    """
+    total_points formulasi (get_referral_stats dagi bilan bir xil).
+    REFERRAL_BONUS_LEVEL2 trigger ichiga qiymat sifatida yoziladi –
+    config o'zgarsa startupda rebuild_user_balances() triggerlarni qayta o'rnatadi
+    (app_meta.level2_bonus_ppm bilan solishtiriladi).
+    """
+    bonus = repr(float(REFERRAL_BONUS_LEVEL2))
+    return (
+        f"{prefix}level1_count"
+        f" + CAST({prefix}level2_raw * {bonus} AS INTEGER)"
+        f" + CAST({prefix}manual_total AS INTEGER)"
+    )
+
+
+_RESERVED_STATUSES = "('pending', 'approved')"
+
+
+def _install_balance_triggers(cur: sqlite3.Cursor):
+    """
+    referrals / manual_points / service_requests ga yozilganda
+    user_balances ni shu tranzaksiya ichida yangilab boruvchi triggerlar.
+    """
+    def ensure(expr: str) -> str:
+        return (
+            f"INSERT OR IGNORE INTO user_balances (user_id) "
+            f"SELECT {expr} WHERE {expr} IS NOT NULL;"
         )
-        """
+
+    def histogram(points_expr: str, delta: str) -> str:
+        return (
+            f"INSERT INTO points_histogram (total_points, users) "
+            f"VALUES ({points_expr}, {delta}) "
+            f"ON CONFLICT (total_points) DO UPDATE SET users = users + ({delta});"
+        )
+
+    # gistogramma faqat users jadvalida bor userlarni sanaydi (leaderboard kabi)
+    user_exists = "EXISTS (SELECT 1 FROM users WHERE user_id = {}.user_id)"
+
+    triggers = {
+        # --- users: har bir userga bo'sh balans qatori ---
+        "trg_users_ins_balance": """
+            AFTER INSERT ON users BEGIN
+                INSERT INTO points_histogram (total_points, users)
+                SELECT total_points, 1 FROM user_balances WHERE user_id = NEW.user_id
+                ON CONFLICT (total_points) DO UPDATE SET users = users + 1;
+                INSERT OR IGNORE INTO user_balances (user_id) VALUES (NEW.user_id);
+            END
+        """,
+        # --- referrals ---
+        "trg_referrals_ins_balance": f"""
+            AFTER INSERT ON referrals BEGIN
+                {ensure("NEW.referrer_id")}
+                UPDATE user_balances
+                SET level1_count = level1_count + (NEW.level = 1),
+                    level2_raw = level2_raw + (NEW.level = 2)
+                WHERE user_id = NEW.referrer_id;
+            END
+        """,
+        "trg_referrals_del_balance": """
+            AFTER DELETE ON referrals BEGIN
+                UPDATE user_balances
+                SET level1_count = level1_count - (OLD.level = 1),
+                    level2_raw = level2_raw - (OLD.level = 2)
+                WHERE user_id = OLD.referrer_id;
+            END
+        """,
+        "trg_referrals_upd_balance": f"""
+            AFTER UPDATE OF referrer_id, level ON referrals BEGIN
+                UPDATE user_balances
+                SET level1_count = level1_count - (OLD.level = 1),
+                    level2_raw = level2_raw - (OLD.level = 2)
+                WHERE user_id = OLD.referrer_id;
+                {ensure("NEW.referrer_id")}
+                UPDATE user_balances
+                SET level1_count = level1_count + (NEW.level = 1),
+                    level2_raw = level2_raw + (NEW.level = 2)
+                WHERE user_id = NEW.referrer_id;
+            END
+        """,
+        # --- manual_points ---
+        "trg_manual_points_ins_balance": f"""
+            AFTER INSERT ON manual_points BEGIN
+                {ensure("NEW.user_id")}
+                UPDATE user_balances
+                SET manual_total = manual_total + COALESCE(NEW.points, 0)
+                WHERE user_id = NEW.user_id;
+            END
+        """,
+        "trg_manual_points_del_balance": """
+            AFTER DELETE ON manual_points BEGIN
+                UPDATE user_balances
+                SET manual_total = manual_total - COALESCE(OLD.points, 0)
+                WHERE user_id = OLD.user_id;
+            END
+        """,
+        "trg_manual_points_upd_balance": f"""
+            AFTER UPDATE OF user_id, points ON manual_points BEGIN
+                UPDATE user_balances
+                SET manual_total = manual_total - COALESCE(OLD.points, 0)
+                WHERE user_id = OLD.user_id;
+                {ensure("NEW.user_id")}
+                UPDATE user_balances
+                SET manual_total = manual_total + COALESCE(NEW.points, 0)
+                WHERE user_id = NEW.user_id;
+            END
+        """,
+        # --- service_requests (pending + approved = band qilingan) ---
+        "trg_service_requests_ins_balance": f"""
+            AFTER INSERT ON service_requests
+            WHEN NEW.status IN {_RESERVED_STATUSES} BEGIN
+                {ensure("NEW.user_id")}
+                UPDATE user_balances
+                SET reserved = reserved + COALESCE(NEW.cost, 0)
+                WHERE user_id = NEW.user_id;
+            END
+        """,
+        "trg_service_requests_del_balance": f"""
+            AFTER DELETE ON service_requests
+            WHEN OLD.status IN {_RESERVED_STATUSES} BEGIN
+                UPDATE user_balances
+                SET reserved = reserved - COALESCE(OLD.cost, 0)
+                WHERE user_id = OLD.user_id;
+            END
+        """,
+        "trg_service_requests_upd_balance": f"""
+            AFTER UPDATE OF user_id, cost, status ON service_requests BEGIN
+                UPDATE user_balances
+                SET reserved = reserved - COALESCE(OLD.cost, 0)
+                WHERE user_id = OLD.user_id AND OLD.status IN {_RESERVED_STATUSES};
+                {ensure("NEW.user_id")}
+                UPDATE user_balances
+                SET reserved = reserved + COALESCE(NEW.cost, 0)
+                WHERE user_id = NEW.user_id AND NEW.status IN {_RESERVED_STATUSES};
+            END
+        """,
+        # --- total_points doim hisoblagichlar bilan mos ---
+        "trg_user_balances_total": f"""
+            AFTER UPDATE OF level1_count, level2_raw, manual_total ON user_balances BEGIN
+                UPDATE user_balances
+                SET total_points = {_total_points_sql()}
+                WHERE user_id = NEW.user_id;
+            END
+        """,
+        # --- points_histogram (get_user_rank uchun) ---
+        "trg_user_balances_ins_histogram": f"""
+            AFTER INSERT ON user_balances
+            WHEN {user_exists.format("NEW")} BEGIN
+                {histogram("NEW.total_points", "1")}
+            END
+        """,
+        "trg_user_balances_del_histogram": f"""
+            AFTER DELETE ON user_balances
+            WHEN {user_exists.format("OLD")} BEGIN
+                {histogram("OLD.total_points", "-1")}
+            END
+        """,
+        "trg_user_balances_upd_histogram": f"""
+            AFTER UPDATE OF total_points ON user_balances
+            WHEN OLD.total_points != NEW.total_points
+             AND {user_exists.format("NEW")} BEGIN
+                {histogram("OLD.total_points", "-1")}
+                {histogram("NEW.total_points", "1")}
+            END
+        """,
+        # --- reyting o'zgarganini boshqa jarayonlar/keshlar bilishi uchun ---
+        "trg_user_balances_points_version": """
+            AFTER UPDATE OF total_points ON user_balances
+            WHEN OLD.total_points != NEW.total_points BEGIN
+                UPDATE app_meta SET value = value + 1 WHERE key = 'points_version';
+            END
+        """,
+    }
+
+    for name, body in triggers.items():
+        cur.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cur.execute(f"CREATE TRIGGER {name} {body}")
+
+
+# xom jadvallardan qayta hisoblangan balanslar (rebuild va verify uchun)
+_EXPECTED_BALANCES_SQL = f"""
+    WITH parts AS (
+        SELECT referrer_id AS user_id,
+               SUM(level = 1) AS l1, SUM(level = 2) AS l2, 0 AS m, 0 AS r
+        FROM referrals
+        GROUP BY referrer_id
+        UNION ALL
+        SELECT user_id, 0, 0, SUM(COALESCE(points, 0)), 0
+        FROM manual_points
+        GROUP BY user_id
+        UNION ALL
+        SELECT user_id, 0, 0, 0, SUM(COALESCE(cost, 0))
+        FROM service_requests
+        WHERE status IN {_RESERVED_STATUSES}
+        GROUP BY user_id
+        UNION ALL
+        SELECT user_id, 0, 0, 0, 0
+        FROM users
     )
+    SELECT user_id,
+           SUM(l1) AS level1_count,
+           SUM(l2) AS level2_raw,
+           SUM(m) AS manual_total,
+           SUM(r) AS reserved
+    FROM parts
+    WHERE user_id IS NOT NULL
+    GROUP BY user_id
+"""
+
+
+@writes
+def rebuild_user_balances() -> int:
+    """
+    user_balances ni xom jadvallardan to'liq qayta hisoblaymiz
+    (triggerlar ham qayta o'rnatiladi). Yozilgan qatorlar sonini qaytaradi.
+    """
+    with transaction(immediate=True) as cur:
+        _install_balance_triggers(cur)
+        cur.execute("DELETE FROM user_balances")
+        cur.execute(
+            f"""
+            INSERT INTO user_balances
+                (user_id, level1_count, level2_raw, manual_total, reserved, total_points)
+            SELECT user_id, level1_count, level2_raw, manual_total, reserved,
+                   {_total_points_sql()}
+            FROM ({_EXPECTED_BALANCES_SQL})
+            """
+        )
+        rows = cur.rowcount
+        _rebuild_points_histogram(cur)
+        cur.execute("UPDATE app_meta SET value = value + 1 WHERE key = 'points_version'")
+        cur.execute(
+            "INSERT OR REPLACE INTO app_meta (key, value) VALUES ('level2_bonus_ppm', ?)",
+            (bonus_ppm(),),
+        )
+        return rows
+
 
-    # referallar
+def bonus_ppm() -> int:
+    """REFERRAL_BONUS_LEVEL2 milliondan bir ulushda (app_meta da butun son sifatida saqlanadi)."""
+    return round(REFERRAL_BONUS_LEVEL2 * 1_000_000)
+
+
+def _rebuild_points_histogram(cur: sqlite3.Cursor):
+    cur.execute("DELETE FROM points_histogram")
     cur.execute(
         """
-        CREATE TABLE IF NOT EXISTS referrals (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            referrer_id INTEGER,
-            referred_id INTEGER,
-            level INTEGER,
-            created_at TEXT
-        )
+        INSERT INTO points_histogram (total_points, users)
+        SELECT b.total_points, COUNT(*)
+        FROM user_balances b
+        JOIN users u ON u.user_id = b.user_id
+        GROUP BY b.total_points
         """
     )
 
-    # xizmat so'rovlari
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS service_requests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            service_key TEXT,
-            cost REAL,
-            status TEXT,
-            created_at TEXT,
-            approved_at TEXT,
-            admin_id INTEGER
-        )
+
+def verify_user_balances(sample: int = 20) -> Dict[str, Any]:
+    """
+    user_balances (va points_histogram) xom jadvallarga mosligini tekshiradi.
+    {"mismatched": N, "user_ids": [...birinchi sample tasi],
+     "histogram_mismatched": M} qaytaradi.
+    """
+    cur = get_connection().execute(
+        f"""
+        WITH expected AS ({_EXPECTED_BALANCES_SQL})
+        SELECT e.user_id
+        FROM expected e
+        LEFT JOIN user_balances b ON b.user_id = e.user_id
+        WHERE b.user_id IS NULL
+           OR b.level1_count != e.level1_count
+           OR b.level2_raw != e.level2_raw
+           OR ABS(b.manual_total - e.manual_total) > 1e-9
+           OR ABS(b.reserved - e.reserved) > 1e-9
+           OR b.total_points != ({_total_points_sql("e.")})
+        UNION ALL
+        SELECT b.user_id
+        FROM user_balances b
+        WHERE b.user_id NOT IN (SELECT user_id FROM expected)
+          AND (b.level1_count != 0 OR b.level2_raw != 0
+               OR b.manual_total != 0 OR b.reserved != 0 OR b.total_points != 0)
         """
     )
+    ids = [r["user_id"] for r in cur.fetchall()]
 
-    # admin /givepoint orqali qo‘shgan qo‘lda ballar
-    cur.execute(
+    # points_histogram ham user_balances ga mosmi
+    row = get_connection().execute(
         """
-        CREATE TABLE IF NOT EXISTS manual_points (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            points REAL,
-            comment TEXT,
-            admin_id INTEGER,
-            created_at TEXT
+        WITH expected AS (
+            SELECT b.total_points, COUNT(*) AS users
+            FROM user_balances b
+            JOIN users u ON u.user_id = b.user_id
+            GROUP BY b.total_points
+        )
+        SELECT COUNT(*) AS c FROM (
+            SELECT e.total_points
+            FROM expected e
+            LEFT JOIN points_histogram h ON h.total_points = e.total_points
+            WHERE h.users IS NULL OR h.users != e.users
+            UNION ALL
+            SELECT h.total_points
+            FROM points_histogram h
+            WHERE h.users != 0
+              AND h.total_points NOT IN (SELECT total_points FROM expected)
         )
         """
-    )
+    ).fetchone()
 
-    conn.commit()
-    conn.close()
+    return {
+        "mismatched": len(ids),
+        "user_ids": ids[:sample],
+        "histogram_mismatched": row["c"],
+    }
 
 
 # ---------------------------------------
 # Users
 # ---------------------------------------
-def add_or_update_user(
+@writes
+def register_start(
     user_id: int,
     username: Optional[str],
     first_name: Optional[str],
@@ -95,111 +523,218 @@ def add_or_update_user(
     referrer_id: Optional[int],
 ) -> bool:
     """
+    /start uchun bitta tranzaksiya: user UPSERT + (yangi bo'lsa) referal zanjiri.
     True qaytaradi agar user yangi bo'lsa, False agar eski bo'lsa.
     """
     now = datetime.utcnow().isoformat()
-    conn = get_connection()
-    cur = conn.cursor()
 
-    cur.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-    row = cur.fetchone()
-    if row is None:
+    with transaction() as cur:
         cur.execute(
             """
             INSERT INTO users (user_id, username, first_name, last_name, referrer_id, created_at, last_active_at)
             VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                username = excluded.username,
+                first_name = excluded.first_name,
+                last_name = excluded.last_name,
+                last_active_at = excluded.last_active_at,
+                deliverable = 1,
+                blocked_at = NULL
+            RETURNING created_at
             """,
             (user_id, username, first_name, last_name, referrer_id, now, now),
         )
-        conn.commit()
-        conn.close()
-        if referrer_id:
-            register_referral_chain(referrer_id, user_id)
-        return True
-    else:
-        cur.execute(
+        # eski userda created_at avvalgi vaqt bo'lib qoladi; /start – bot
+        # blokdan chiqarilgan degani, shuning uchun deliverable qayta 1
+        is_new = cur.fetchone()["created_at"] == now
+
+        if is_new and referrer_id:
+            # Level 1
+            cur.execute(
+                """
+                INSERT INTO referrals (referrer_id, referred_id, level, created_at)
+                VALUES (?, ?, 1, ?)
+                """,
+                (referrer_id, user_id, now),
+            )
+            # Level 2 – referrerning referreri (bitta INSERT ... SELECT)
+            cur.execute(
+                """
+                INSERT INTO referrals (referrer_id, referred_id, level, created_at)
+                SELECT referrer_id, ?, 2, ?
+                FROM users
+                WHERE user_id = ? AND referrer_id IS NOT NULL AND referrer_id != 0
+                """,
+                (user_id, now, referrer_id),
+            )
+
+        return is_new
+
+
+def add_or_update_user(
+    user_id: int,
+    username: Optional[str],
+    first_name: Optional[str],
+    last_name: Optional[str],
+    referrer_id: Optional[int],
+) -> bool:
+    """
+    True qaytaradi agar user yangi bo'lsa, False agar eski bo'lsa.
+    (register_start bilan bir xil – eski nom saqlanib qolgan.)
+    """
+    return register_start(user_id, username, first_name, last_name, referrer_id)
+
+
+# ---------------------------------------
+# last_active_at – xotirada to'plab, davriy bitta tranzaksiyada yozamiz
+# ---------------------------------------
+_activity_lock = threading.Lock()
+_activity_buffer: Dict[int, str] = {}
+_activity_wakeup = threading.Event()
+_activity_stop = threading.Event()
+_activity_thread: Optional[threading.Thread] = None
+
+
+def touch_user_activity(user_id: int):
+    """
+    Diskka darhol yozmaydi: faqat bufferdagi eng so'nggi vaqtni yangilaydi.
+    Flusher har ACTIVITY_FLUSH_INTERVAL soniyada yoki buffer
+    ACTIVITY_FLUSH_MAX_ENTRIES ga yetganda yozadi.
+    """
+    now = datetime.utcnow().isoformat()
+    with _activity_lock:
+        _activity_buffer[user_id] = now
+        size = len(_activity_buffer)
+
+    if size >= ACTIVITY_FLUSH_MAX_ENTRIES:
+        if _activity_thread is not None and _activity_thread.is_alive():
+            _activity_wakeup.set()
+        else:
+            flush_user_activity()
+
+
+def flush_user_activity() -> int:
+    """Bufferdagi vaqtlarni bitta executemany tranzaksiyada yozadi. Yozilganlar sonini qaytaradi."""
+    global _activity_buffer
+
+    with _activity_lock:
+        pending = _activity_buffer
+        _activity_buffer = {}
+
+    if not pending:
+        return 0
+
+    try:
+        _write_activity([(ts, uid, ts) for uid, ts in pending.items()])
+    except sqlite3.Error:
+        # yozilmadi – keyingi flushda qayta urinamiz (yangiroq vaqtlar ustun)
+        with _activity_lock:
+            for uid, ts in pending.items():
+                if _activity_buffer.get(uid, "") < ts:
+                    _activity_buffer[uid] = ts
+        raise
+
+    return len(pending)
+
+
+@writes
+def _write_activity(rows: List[tuple]):
+    with transaction() as cur:
+        # eski vaqt yangisini bosib ketmasin (masalan /start allaqachon yozgan bo'lsa)
+        cur.executemany(
             """
-            UPDATE users SET username = ?, first_name = ?, last_name = ?, last_active_at = ?
-            WHERE user_id = ?
+            UPDATE users SET last_active_at = ?
+            WHERE user_id = ? AND (last_active_at IS NULL OR last_active_at < ?)
             """,
-            (username, first_name, last_name, now, user_id),
+            rows,
         )
-        conn.commit()
-        conn.close()
-        return False
 
 
-def touch_user_activity(user_id: int):
-    now = datetime.utcnow().isoformat()
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE users SET last_active_at = ? WHERE user_id = ?",
-        (now, user_id),
+def _activity_flush_loop():
+    while not _activity_stop.is_set():
+        _activity_wakeup.wait(ACTIVITY_FLUSH_INTERVAL)
+        _activity_wakeup.clear()
+        try:
+            flush_user_activity()
+        except sqlite3.Error:
+            logger.exception("last_active_at flush xatosi")
+
+
+def start_activity_flusher():
+    """Fon thread: bufferni davriy yozib boradi (main.py startupda chaqiradi)."""
+    global _activity_thread
+
+    if _activity_thread is not None and _activity_thread.is_alive():
+        return
+    _activity_stop.clear()
+    _activity_thread = threading.Thread(
+        target=_activity_flush_loop, name="activity-flusher", daemon=True
     )
-    conn.commit()
-    conn.close()
+    _activity_thread.start()
+
+
+def stop_activity_flusher():
+    """Shutdown: threadni to'xtatib, qolgan yozuvlarni oxirgi marta yozamiz."""
+    global _activity_thread
+
+    _activity_stop.set()
+    _activity_wakeup.set()
+    if _activity_thread is not None:
+        _activity_thread.join(timeout=ACTIVITY_FLUSH_INTERVAL + 5)
+        _activity_thread = None
+    flush_user_activity()
 
 
 def get_user(user_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+    cur = get_connection().execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
     row = cur.fetchone()
-    conn.close()
     return dict(row) if row else None
 
 
 def get_user_by_username(username: str):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
+    cur = get_connection().execute(
         "SELECT * FROM users WHERE username = ? COLLATE NOCASE",
         (username,),
     )
     row = cur.fetchone()
-    conn.close()
     return dict(row) if row else None
 
 
 # ---------------------------------------
 # Referrals & points
 # ---------------------------------------
+@writes
 def register_referral_chain(referrer_id: int, new_user_id: int):
     """
     1-daraja referal + agar referrerning ham referreri bo‘lsa – 2-daraja referal.
     """
     now = datetime.utcnow().isoformat()
-    conn = get_connection()
-    cur = conn.cursor()
 
-    # Level 1
-    cur.execute(
-        """
-        INSERT INTO referrals (referrer_id, referred_id, level, created_at)
-        VALUES (?, ?, 1, ?)
-        """,
-        (referrer_id, new_user_id, now),
-    )
-
-    # Level 2 (referrerning referreri)
-    cur.execute(
-        "SELECT referrer_id FROM users WHERE user_id = ?",
-        (referrer_id,),
-    )
-    row = cur.fetchone()
-    if row and row["referrer_id"]:
-        lvl2 = row["referrer_id"]
+    with transaction() as cur:
+        # Level 1
         cur.execute(
             """
             INSERT INTO referrals (referrer_id, referred_id, level, created_at)
-            VALUES (?, ?, 2, ?)
+            VALUES (?, ?, 1, ?)
             """,
-            (lvl2, new_user_id, now),
+            (referrer_id, new_user_id, now),
         )
 
-    conn.commit()
-    conn.close()
+        # Level 2 (referrerning referreri)
+        cur.execute(
+            "SELECT referrer_id FROM users WHERE user_id = ?",
+            (referrer_id,),
+        )
+        row = cur.fetchone()
+        if row and row["referrer_id"]:
+            lvl2 = row["referrer_id"]
+            cur.execute(
+                """
+                INSERT INTO referrals (referrer_id, referred_id, level, created_at)
+                VALUES (?, ?, 2, ?)
+                """,
+                (lvl2, new_user_id, now),
+            )
 
 
 def get_referral_stats(user_id: int) -> Dict[str, Any]:
@@ -209,50 +744,33 @@ def get_referral_stats(user_id: int) -> Dict[str, Any]:
     - Level 2: REFERRAL_BONUS_LEVEL2 (masalan 0.25) * soni
     + manual_points dan qo‘shilgan ballar
     - service_requests dan ishlatilgan ballar (pending + approved)
-    """
-    conn = get_connection()
-    cur = conn.cursor()
 
-    # Level 1 soni
-    cur.execute(
-        "SELECT COUNT(*) AS c FROM referrals WHERE referrer_id = ? AND level = 1",
+    Hisoblagichlar user_balances dan bitta indeksli o'qish bilan olinadi.
+    """
+    row = get_connection().execute(
+        """
+        SELECT level1_count, level2_raw, manual_total, reserved
+        FROM user_balances
+        WHERE user_id = ?
+        """,
         (user_id,),
-    )
-    l1 = cur.fetchone()["c"]
+    ).fetchone()
 
-    # Level 2 raw soni
-    cur.execute(
-        "SELECT COUNT(*) AS c FROM referrals WHERE referrer_id = ? AND level = 2",
-        (user_id,),
-    )
-    l2_raw = cur.fetchone()["c"]
+    if row is None:
+        l1, l2_raw, manual_total, reserved = 0, 0, 0, 0
+    else:
+        l1 = row["level1_count"]
+        l2_raw = row["level2_raw"]
+        manual_total = row["manual_total"] or 0
+        reserved = row["reserved"] or 0
 
     l2_bonus = int(l2_raw * REFERRAL_BONUS_LEVEL2)
 
-    # Qo‘lda qo‘shilgan (manual) ballar
-    cur.execute(
-        "SELECT COALESCE(SUM(points), 0) AS total FROM manual_points WHERE user_id = ?",
-        (user_id,),
-    )
-    manual_total = cur.fetchone()["total"] or 0
-
     # Umumiy ball = referal + manual
     total_points = l1 + l2_bonus + int(manual_total)
 
-    # Pending + approved so'rovlarga ketgan balllar
-    cur.execute(
-        """
-        SELECT IFNULL(SUM(cost), 0) AS s
-        FROM service_requests
-        WHERE user_id = ? AND status IN ('pending', 'approved')
-        """,
-        (user_id,),
-    )
-    reserved = cur.fetchone()["s"] or 0
-
     available_points = max(total_points - reserved, 0)
 
-    conn.close()
     return {
         "level1_count": l1,
         "level2_raw": l2_raw,
@@ -264,10 +782,7 @@ def get_referral_stats(user_id: int) -> Dict[str, Any]:
 
 
 def get_level1_users_with_stats(user_id: int) -> List[Dict[str, Any]]:
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute(
+    cur = get_connection().execute(
         """
         SELECT u.user_id, u.username, COUNT(r2.id) AS level1_count
         FROM referrals r
@@ -279,14 +794,16 @@ def get_level1_users_with_stats(user_id: int) -> List[Dict[str, Any]]:
         (user_id,),
     )
     rows = cur.fetchall()
-    conn.close()
 
     return [dict(r) for r in rows]
 
 
 def get_active_referral_stats(user_id: int, days: int) -> Dict[str, Any]:
-    conn = get_connection()
-    cur = conn.cursor()
+    """
+    last_active_at touch_user_activity bufferi orqali yoziladi,
+    shuning uchun natija ACTIVITY_FLUSH_INTERVAL aniqligida to'g'ri.
+    """
+    cur = get_connection().cursor()
 
     since = (datetime.utcnow() - timedelta(days=days)).isoformat()
 
@@ -315,7 +832,6 @@ def get_active_referral_stats(user_id: int, days: int) -> Dict[str, Any]:
     l2_bonus = int(l2_raw * REFERRAL_BONUS_LEVEL2)
     total_points = l1 + l2_bonus
 
-    conn.close()
     return {
         "level1_count": l1,
         "level2_raw": l2_raw,
@@ -324,38 +840,158 @@ def get_active_referral_stats(user_id: int, days: int) -> Dict[str, Any]:
     }
 
 
+# top-K kesh: points_version o'zgarmaguncha qayta so'rov yubormaymiz
+_leaderboard_lock = threading.Lock()
+_leaderboard_cache: Dict[str, Any] = {"version": None, "rows": []}
+
+
+def get_points_version() -> int:
+    """Har safar kimningdir total_points o'zgarganda oshadigan hisoblagich."""
+    row = get_connection().execute(
+        "SELECT value FROM app_meta WHERE key = 'points_version'"
+    ).fetchone()
+    return row["value"] if row else 0
+
+
+def _query_leaderboard(limit: int) -> List[Dict[str, Any]]:
+    cur = get_connection().execute(
+        """
+        SELECT b.user_id, u.username, b.total_points
+        FROM user_balances b
+        JOIN users u ON u.user_id = b.user_id
+        ORDER BY b.total_points DESC, b.user_id
+        LIMIT ?
+        """,
+        (limit,),
+    )
+    return [dict(r) for r in cur.fetchall()]
+
+
 def get_leaderboard(limit: int = 100) -> List[Dict[str, Any]]:
     """
-    Leaderboard: hamma userlar bo‘yicha total_points hisoblaymiz.
+    Leaderboard: user_balances.total_points indeksi bo'yicha bitta so'rov.
+    LEADERBOARD_CACHE_SIZE gacha bo'lgan top-K xotirada keshlanadi
+    va ballar o'zgarganda (points_version) yangilanadi.
+    """
+    if limit > LEADERBOARD_CACHE_SIZE:
+        return _query_leaderboard(limit)
+
+    version = get_points_version()
+    with _leaderboard_lock:
+        if _leaderboard_cache["version"] == version:
+            return [dict(r) for r in _leaderboard_cache["rows"][:limit]]
+
+    rows = _query_leaderboard(LEADERBOARD_CACHE_SIZE)
+    with _leaderboard_lock:
+        _leaderboard_cache["version"] = version
+        _leaderboard_cache["rows"] = rows
+    return [dict(r) for r in rows[:limit]]
+
+
+def _rank_for_points(total_points: int) -> int:
+    """O'rin = 1 + shundan ko'p balli userlar soni (teng ballilar bir o'rinda)."""
+    row = get_connection().execute(
+        "SELECT COALESCE(SUM(users), 0) AS above FROM points_histogram WHERE total_points > ?",
+        (total_points,),
+    ).fetchone()
+    return row["above"] + 1
+
+
+def get_user_rank(user_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Userning reytingdagi aniq o'rni (top-100 dan tashqarida ham).
+    points_histogram bo'yicha – leaderboard hisoblanmaydi.
+    User topilmasa None.
+    """
+    row = get_connection().execute(
+        """
+        SELECT b.total_points
+        FROM user_balances b
+        JOIN users u ON u.user_id = b.user_id
+        WHERE b.user_id = ?
+        """,
+        (user_id,),
+    ).fetchone()
+    if row is None:
+        return None
+
+    points = row["total_points"]
+    return {
+        "user_id": user_id,
+        "rank": _rank_for_points(points),
+        "total_points": points,
+    }
+
+
+def get_rank_neighbours(user_id: int, count: int = 1) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Reytingda userdan bevosita yuqori va past turgan `count` tadan user.
+    Leaderboard tartibi: total_points DESC, user_id ASC – indeks bo'yicha o'qiladi.
     """
+    me = get_user_rank(user_id)
+    if me is None:
+        return {"above": [], "below": []}
+
+    points = me["total_points"]
     conn = get_connection()
-    cur = conn.cursor()
+    select = """
+        SELECT b.user_id, u.username, b.total_points
+        FROM user_balances b
+        JOIN users u ON u.user_id = b.user_id
+    """
 
-    cur.execute("SELECT user_id, username FROM users")
-    users = cur.fetchall()
-    conn.close()
-
-    result = []
-    for u in users:
-        stats = get_referral_stats(u["user_id"])
-        result.append(
-            {
-                "user_id": u["user_id"],
-                "username": u["username"],
-                "total_points": stats["total_points"],
-            }
+    # yuqoridagilar: avval teng ballilar (kichik ID), keyin ko'proq ballilar
+    above = [
+        dict(r)
+        for r in conn.execute(
+            select + "WHERE b.total_points = ? AND b.user_id < ? ORDER BY b.user_id DESC LIMIT ?",
+            (points, user_id, count),
         )
-
-    result.sort(key=lambda x: x["total_points"], reverse=True)
-    return result[:limit]
+    ]
+    if len(above) < count:
+        above += [
+            dict(r)
+            for r in conn.execute(
+                select + "WHERE b.total_points > ? "
+                "ORDER BY b.total_points, b.user_id DESC LIMIT ?",
+                (points, count - len(above)),
+            )
+        ]
+    above.reverse()
+
+    # pastdagilar: avval teng ballilar (katta ID), keyin kamroq ballilar
+    below = [
+        dict(r)
+        for r in conn.execute(
+            select + "WHERE b.total_points = ? AND b.user_id > ? ORDER BY b.user_id LIMIT ?",
+            (points, user_id, count),
+        )
+    ]
+    if len(below) < count:
+        below += [
+            dict(r)
+            for r in conn.execute(
+                select + "WHERE b.total_points < ? "
+                "ORDER BY b.total_points DESC, b.user_id LIMIT ?",
+                (points, count - len(below)),
+            )
+        ]
+
+    ranks: Dict[int, int] = {}
+    for item in above + below:
+        p = item["total_points"]
+        if p not in ranks:
+            ranks[p] = _rank_for_points(p)
+        item["rank"] = ranks[p]
+
+    return {"above": above, "below": below}
 
 
 # ---------------------------------------
 # Service requests
 # ---------------------------------------
 def get_stats() -> Dict[str, Any]:
-    conn = get_connection()
-    cur = conn.cursor()
+    cur = get_connection().cursor()
 
     cur.execute("SELECT COUNT(*) AS c FROM users")
     users = cur.fetchone()["c"]
@@ -366,14 +1002,42 @@ def get_stats() -> Dict[str, Any]:
     cur.execute("SELECT COUNT(*) AS c FROM service_requests WHERE status = 'approved'")
     approved = cur.fetchone()["c"]
 
-    conn.close()
-    return {"users": users, "pending": pending, "approved": approved}
+    cur.execute("SELECT COUNT(*) AS c FROM users WHERE deliverable = 0")
+    blocked = cur.fetchone()["c"]
+
+    return {"users": users, "pending": pending, "approved": approved, "blocked": blocked}
+
+
+# ---------------------------------------
+# Yetkazib berish holati (403 / chat not found)
+# ---------------------------------------
+def is_deliverable(user_id: int) -> bool:
+    """Bazada yo'q user (masalan, /start bosmagan admin) – yetkaziladi deb hisoblanadi."""
+    row = get_connection().execute(
+        "SELECT deliverable FROM users WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    return row is None or bool(row["deliverable"])
+
+
+@writes
+def mark_undeliverable(user_ids: List[int]) -> int:
+    """Botni bloklagan / chat topilmagan userlarni belgilaydi. Belgilanganlar sonini qaytaradi."""
+    if not user_ids:
+        return 0
+    now = datetime.utcnow().isoformat()
+    with transaction() as cur:
+        cur.executemany(
+            """
+            UPDATE users SET deliverable = 0, blocked_at = ?
+            WHERE user_id = ? AND deliverable = 1
+            """,
+            [(now, uid) for uid in user_ids],
+        )
+        return cur.rowcount
 
 
 def get_pending_requests():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
+    cur = get_connection().execute(
         """
         SELECT * FROM service_requests
         WHERE status = 'pending'
@@ -381,31 +1045,83 @@ def get_pending_requests():
         """
     )
     rows = cur.fetchall()
-    conn.close()
     return [dict(r) for r in rows]
 
 
+@writes
 def create_service_request(user_id: int, service_key: str, cost: float) -> int:
     now = datetime.utcnow().isoformat()
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO service_requests (user_id, service_key, cost, status, created_at)
-        VALUES (?, ?, ?, 'pending', ?)
-        """,
-        (user_id, service_key, cost, now),
-    )
-    req_id = cur.lastrowid
-    conn.commit()
-    conn.close()
-    return req_id
+    with transaction() as cur:
+        cur.execute(
+            """
+            INSERT INTO service_requests (user_id, service_key, cost, status, created_at)
+            VALUES (?, ?, ?, 'pending', ?)
+            """,
+            (user_id, service_key, cost, now),
+        )
+        return cur.lastrowid
+
+
+@writes
+def reserve_service(
+    user_id: int,
+    service_key: str,
+    idempotency_key: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Balansni tekshirish + pending so'rov yozish – bitta BEGIN IMMEDIATE
+    tranzaksiyada, shuning uchun parallel bosishlar ortiqcha sarflay olmaydi.
+
+    status: "ok" | "duplicate" (shu kalit bilan allaqachon yozilgan)
+            | "insufficient" | "unknown_service"
+    """
+    svc = SERVICES.get(service_key)
+    if not svc:
+        return {"status": "unknown_service"}
+
+    cost = int(svc["cost"])
+    now = datetime.utcnow().isoformat()
+
+    with transaction(immediate=True) as cur:
+        if idempotency_key:
+            cur.execute(
+                "SELECT id FROM service_requests WHERE idempotency_key = ?",
+                (idempotency_key,),
+            )
+            row = cur.fetchone()
+            if row:
+                return {"status": "duplicate", "request_id": row["id"], "cost": cost}
+
+        stats = get_referral_stats(user_id)
+        available = stats["available_points"]
+        if available < cost:
+            return {
+                "status": "insufficient",
+                "cost": cost,
+                "total_points": stats["total_points"],
+                "available_before": available,
+                "available_after": available,
+            }
+
+        cur.execute(
+            """
+            INSERT INTO service_requests (user_id, service_key, cost, status, created_at, idempotency_key)
+            VALUES (?, ?, ?, 'pending', ?, ?)
+            """,
+            (user_id, service_key, cost, now, idempotency_key),
+        )
+        return {
+            "status": "ok",
+            "request_id": cur.lastrowid,
+            "cost": cost,
+            "total_points": stats["total_points"],
+            "available_before": available,
+            "available_after": available - cost,
+        }
 
 
 def get_user_services(user_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
+    cur = get_connection().execute(
         """
         SELECT * FROM service_requests
         WHERE user_id = ?
@@ -414,104 +1130,550 @@ def get_user_services(user_id: int):
         (user_id,),
     )
     rows = cur.fetchall()
-    conn.close()
     return [dict(r) for r in rows]
 
 
+@writes
 def approve_latest_request_for_user(user_id: int, admin_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        SELECT * FROM service_requests
-        WHERE user_id = ? AND status = 'pending'
-        ORDER BY created_at DESC
-        LIMIT 1
-        """,
-        (user_id,),
-    )
-    row = cur.fetchone()
-    if not row:
-        conn.close()
-        return None
+    with transaction(immediate=True) as cur:
+        cur.execute(
+            """
+            SELECT * FROM service_requests
+            WHERE user_id = ? AND status = 'pending'
+            ORDER BY created_at DESC
+            LIMIT 1
+            """,
+            (user_id,),
+        )
+        row = cur.fetchone()
+        if not row:
+            return None
 
-    now = datetime.utcnow().isoformat()
-    cur.execute(
-        """
-        UPDATE service_requests
-        SET status = 'approved', approved_at = ?, admin_id = ?
-        WHERE id = ?
-        """,
-        (now, admin_id, row["id"]),
-    )
-    conn.commit()
-    conn.close()
-    return dict(row)
+        now = datetime.utcnow().isoformat()
+        cur.execute(
+            """
+            UPDATE service_requests
+            SET status = 'approved', approved_at = ?, admin_id = ?
+            WHERE id = ?
+            """,
+            (now, admin_id, row["id"]),
+        )
+        return dict(row)
 
 
 # ---------------------------------------
 # Manual points ( /givepoint )
 # ---------------------------------------
-def add_manual_points(user_id: int, points: float, comment: str, admin_id: int):
+@writes
+def add_manual_points(user_id: int, points: float, comment: str, admin_id: Optional[int]):
     now = datetime.utcnow().isoformat()
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO manual_points (user_id, points, comment, admin_id, created_at)
-        VALUES (?, ?, ?, ?, ?)
-        """,
-        (user_id, points, comment, admin_id, now),
-    )
-    conn.commit()
-    conn.close()
+    with transaction() as cur:
+        cur.execute(
+            """
+            INSERT INTO manual_points (user_id, points, comment, admin_id, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (user_id, points, comment, admin_id, now),
+        )
 
 
 def get_manual_points_sum(user_id: int) -> float:
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
+    cur = get_connection().execute(
         "SELECT COALESCE(SUM(points), 0) AS total FROM manual_points WHERE user_id = ?",
         (user_id,),
     )
     row = cur.fetchone()
-    conn.close()
     return float(row["total"] or 0)
 
 
 # ---------------------------------------
-# Excel export
+# Kanal a'zoligi (utils.is_user_subscribed uchun lokal nusxa)
+# ---------------------------------------
+# source: "event" – chat_member update dan (ishonchli, eskirmaydi),
+#         "api"   – get_chat_member natijasi (TTL bilan ishlatiladi)
+def get_channel_member(channel: str, user_id: int) -> Optional[Dict[str, Any]]:
+    row = get_connection().execute(
+        """
+        SELECT status, is_member, source, updated_at
+        FROM channel_members
+        WHERE channel = ? AND user_id = ?
+        """,
+        (channel, user_id),
+    ).fetchone()
+    return dict(row) if row else None
+
+
+@writes
+def save_channel_member(channel: str, user_id: int, status: str, is_member: bool, source: str):
+    now = datetime.utcnow().isoformat()
+    with transaction() as cur:
+        cur.execute(
+            """
+            INSERT INTO channel_members (channel, user_id, status, is_member, source, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (channel, user_id) DO UPDATE SET
+                status = excluded.status,
+                is_member = excluded.is_member,
+                source = excluded.source,
+                updated_at = excluded.updated_at
+            """,
+            (channel, user_id, status, int(is_member), source, now),
+        )
+
+
+# ---------------------------------------
+# Outbox – yuboriladigan xabarlar (outbox.py)
+# ---------------------------------------
+# status: pending -> sending -> sent | (pending, qayta urinish) | dead
+@writes
+def enqueue_outbox(chat_id: int, method: str, payload: Dict[str, Any], not_before: float = 0.0) -> int:
+    now = datetime.utcnow()
+    with transaction() as cur:
+        cur.execute(
+            """
+            INSERT INTO outbox (chat_id, method, payload, next_attempt_at, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (chat_id, method, json.dumps(payload, ensure_ascii=False), not_before, now.isoformat()),
+        )
+        return cur.lastrowid
+
+
+@writes
+def claim_outbox_batch(now: float, limit: int) -> List[Dict[str, Any]]:
+    """
+    Har bir chatdan faqat navbat boshidagi (eng kichik id) xabarni oladi va
+    'sending' qiladi – shu chatning keyingi xabari bu tugamaguncha olinmaydi
+    (per-chat FIFO). Navbat boshi retry kutayotgan bo'lsa, chat kutadi.
+    """
+    with transaction(immediate=True) as cur:
+        cur.execute(
+            """
+            SELECT o.id, o.chat_id, o.method, o.payload, o.attempts
+            FROM outbox o
+            WHERE o.status = 'pending'
+              AND o.next_attempt_at <= ?
+              AND o.id = (
+                  SELECT MIN(p.id) FROM outbox p
+                  WHERE p.chat_id = o.chat_id AND p.status IN ('pending', 'sending')
+              )
+            ORDER BY o.next_attempt_at, o.id
+            LIMIT ?
+            """,
+            (now, limit),
+        )
+        rows = [dict(r) for r in cur.fetchall()]
+        cur.executemany(
+            "UPDATE outbox SET status = 'sending' WHERE id = ?",
+            [(r["id"],) for r in rows],
+        )
+    for row in rows:
+        row["payload"] = json.loads(row["payload"])
+    return rows
+
+
+@writes
+def finish_outbox(
+    outbox_id: int,
+    status: str,
+    attempts: int,
+    next_attempt_at: float = 0.0,
+    error: Optional[str] = None,
+):
+    """status: 'sent' | 'pending' (qayta urinish next_attempt_at da) | 'dead'."""
+    sent_at = datetime.utcnow().isoformat() if status == "sent" else None
+    with transaction() as cur:
+        cur.execute(
+            """
+            UPDATE outbox
+            SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, sent_at = ?
+            WHERE id = ?
+            """,
+            (status, attempts, next_attempt_at, error, sent_at, outbox_id),
+        )
+
+
+@writes
+def requeue_stuck_outbox() -> int:
+    """Startupda: jarayon o'lganda 'sending' da qolgan xabarlarni qayta navbatga."""
+    with transaction() as cur:
+        cur.execute("UPDATE outbox SET status = 'pending' WHERE status = 'sending'")
+        return cur.rowcount
+
+
+def get_outbox_stats() -> Dict[str, int]:
+    rows = get_connection().execute(
+        "SELECT status, COUNT(*) AS c FROM outbox GROUP BY status"
+    ).fetchall()
+    stats = {"pending": 0, "sending": 0, "sent": 0, "dead": 0}
+    stats.update({r["status"]: r["c"] for r in rows})
+    return stats
+
+
+def get_next_outbox_attempt() -> Optional[float]:
+    """
+    Keyingi olinadigan xabar vaqti – faqat chat navbati boshidagilar
+    (claim_outbox_batch bilan bir xil shart). Boshi 'sending' bo'lgan chatning
+    keyingi xabari hisobga olinmaydi: u yuborilgach _wakeup uyg'otadi.
+    """
+    row = get_connection().execute(
+        """
+        SELECT MIN(o.next_attempt_at) AS t
+        FROM outbox o
+        WHERE o.status = 'pending'
+          AND o.id = (
+              SELECT MIN(p.id) FROM outbox p
+              WHERE p.chat_id = o.chat_id AND p.status IN ('pending', 'sending')
+          )
+        """
+    ).fetchone()
+    return row["t"]
+
+
+# ---------------------------------------
+# Dialog holati (conversations.py): chat -> (state, data), muddati bilan
 # ---------------------------------------
-def export_users_to_excel(path: str):
+def get_conversation(chat_id: int, now: float) -> Optional[Dict[str, Any]]:
+    """Chatning joriy dialog holati; yo'q yoki muddati o'tgan bo'lsa None."""
+    row = get_connection().execute(
+        "SELECT chat_id, user_id, state, data, expires_at FROM conversations "
+        "WHERE chat_id = ? AND expires_at > ?",
+        (chat_id, now),
+    ).fetchone()
+    if row is None:
+        return None
+    item = dict(row)
+    item["data"] = json.loads(item["data"])
+    return item
+
+
+@writes
+def save_conversation(
+    chat_id: int,
+    user_id: int,
+    state: str,
+    data: Dict[str, Any],
+    now: float,
+    expires_at: float,
+    max_rows: int,
+):
+    """
+    Holatni yozadi (chatda oldingisi bo'lsa – almashtiradi). Shu tranzaksiyada
+    muddati o'tganlar o'chiriladi va jadval max_rows dan oshsa eng eski
+    yangilanganlari tashlanadi – tashlab ketilgan dialoglar to'planib qolmaydi.
+    """
+    with transaction() as cur:
+        cur.execute(
+            """
+            INSERT INTO conversations (chat_id, user_id, state, data, updated_at, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (chat_id) DO UPDATE SET
+                user_id = excluded.user_id,
+                state = excluded.state,
+                data = excluded.data,
+                updated_at = excluded.updated_at,
+                expires_at = excluded.expires_at
+            """,
+            (chat_id, user_id, state, json.dumps(data, ensure_ascii=False), now, expires_at),
+        )
+        cur.execute("DELETE FROM conversations WHERE expires_at <= ?", (now,))
+        cur.execute(
+            """
+            DELETE FROM conversations WHERE chat_id IN (
+                SELECT chat_id FROM conversations
+                ORDER BY updated_at
+                LIMIT MAX((SELECT COUNT(*) FROM conversations) - ?, 0)
+            )
+            """,
+            (max_rows,),
+        )
+
+
+@writes
+def clear_conversation(chat_id: int) -> bool:
+    with transaction() as cur:
+        cur.execute("DELETE FROM conversations WHERE chat_id = ?", (chat_id,))
+        return cur.rowcount > 0
+
+
+# ---------------------------------------
+# Broadcast vazifalari
+# ---------------------------------------
+BROADCAST_ACTIVE_STATUSES = ("running", "paused")
+
+
+# segment filtrlari (hammasi ixtiyoriy, SQL da bajariladi):
+#   active_days    – so'nggi N kunda faol bo'lganlar
+#   min_points     – total_points >= N
+#   has_pending    – pending so'rovi borlar
+#   never_redeemed – hech qachon xizmat olmaganlar (pending/approved yo'q)
+SEGMENT_KEYS = ("active_days", "min_points", "has_pending", "never_redeemed")
+
+
+def _segment_where(segment: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+    # botni bloklaganlar hech qaysi segmentga kirmaydi
+    clauses = ["u.deliverable = 1"]
+    params: List[Any] = []
+    segment = segment or {}
+
+    if segment.get("active_days"):
+        since = (datetime.utcnow() - timedelta(days=int(segment["active_days"]))).isoformat()
+        clauses.append("u.last_active_at >= ?")
+        params.append(since)
+    if segment.get("min_points") is not None:
+        clauses.append(
+            "EXISTS (SELECT 1 FROM user_balances b "
+            "WHERE b.user_id = u.user_id AND b.total_points >= ?)"
+        )
+        params.append(int(segment["min_points"]))
+    if segment.get("has_pending"):
+        clauses.append(
+            "EXISTS (SELECT 1 FROM service_requests s "
+            "WHERE s.user_id = u.user_id AND s.status = 'pending')"
+        )
+    if segment.get("never_redeemed"):
+        clauses.append(
+            "NOT EXISTS (SELECT 1 FROM service_requests s "
+            "WHERE s.user_id = u.user_id AND s.status IN ('pending', 'approved'))"
+        )
+
+    return " AND ".join(clauses), params
+
+
+def get_recipient_page(
+    segment: Optional[Dict[str, Any]],
+    after_user_id: int,
+    limit: int,
+) -> List[int]:
+    """Keyset pagination: segmentga mos, user_id > after_user_id bo'lgan keyingi `limit` ta ID."""
+    where, params = _segment_where(segment)
+    rows = get_connection().execute(
+        f"""
+        SELECT u.user_id FROM users u
+        WHERE u.user_id > ? AND {where}
+        ORDER BY u.user_id
+        LIMIT ?
+        """,
+        [after_user_id, *params, limit],
+    ).fetchall()
+    return [r["user_id"] for r in rows]
+
+
+def iter_recipients(
+    segment: Optional[Dict[str, Any]] = None,
+    after_user_id: int = 0,
+    page_size: int = 1000,
+) -> Iterator[int]:
+    """
+    Broadcast oluvchilari: user_id larni sahifalab (keyset) oqim qilib beradi –
+    xotira hajmi page_size bilan cheklangan, butun jadval yuklanmaydi.
+    """
+    cursor = after_user_id
+    while True:
+        ids = get_recipient_page(segment, cursor, page_size)
+        if not ids:
+            return
+        yield from ids
+        cursor = ids[-1]
+
+
+def count_recipients(segment: Optional[Dict[str, Any]] = None) -> int:
+    where, params = _segment_where(segment)
+    row = get_connection().execute(
+        f"SELECT COUNT(*) AS c FROM users u WHERE {where}", params
+    ).fetchone()
+    return row["c"]
+
+
+def _broadcast_job_row(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+    if row is None:
+        return None
+    job = dict(row)
+    job["segment"] = json.loads(job["segment"]) if job.get("segment") else {}
+    return job
+
+
+@writes
+def create_broadcast_job(
+    admin_id: int,
+    chat_id: int,
+    text: str,
+    total: int,
+    segment: Optional[Dict[str, Any]] = None,
+) -> int:
+    now = datetime.utcnow().isoformat()
+    with transaction() as cur:
+        cur.execute(
+            """
+            INSERT INTO broadcast_jobs
+                (admin_id, chat_id, text, segment, status, total, created_at, started_at, updated_at)
+            VALUES (?, ?, ?, ?, 'running', ?, ?, ?, ?)
+            """,
+            (admin_id, chat_id, text, json.dumps(segment or {}), total, now, now, now),
+        )
+        return cur.lastrowid
+
+
+def get_broadcast_job(job_id: int) -> Optional[Dict[str, Any]]:
+    row = get_connection().execute(
+        "SELECT * FROM broadcast_jobs WHERE id = ?", (job_id,)
+    ).fetchone()
+    return _broadcast_job_row(row)
+
+
+def get_active_broadcast_jobs() -> List[Dict[str, Any]]:
+    rows = get_connection().execute(
+        "SELECT * FROM broadcast_jobs WHERE status IN (?, ?) ORDER BY id",
+        BROADCAST_ACTIVE_STATUSES,
+    ).fetchall()
+    return [_broadcast_job_row(r) for r in rows]
+
+
+def get_recent_broadcast_jobs(limit: int = 5) -> List[Dict[str, Any]]:
+    rows = get_connection().execute(
+        "SELECT * FROM broadcast_jobs ORDER BY id DESC LIMIT ?", (limit,)
+    ).fetchall()
+    return [_broadcast_job_row(r) for r in rows]
+
+
+@writes
+def set_broadcast_status_message(job_id: int, message_id: int):
+    with transaction() as cur:
+        cur.execute(
+            "UPDATE broadcast_jobs SET status_message_id = ? WHERE id = ?",
+            (message_id, job_id),
+        )
+
+
+@writes
+def save_broadcast_progress(
+    job_id: int,
+    cursor_user_id: int,
+    delivered: int,
+    blocked: int,
+    failed: int,
+):
+    """Bo'lak tugagach: kursor va hisoblagichlarni (qo'shib) saqlaymiz."""
+    now = datetime.utcnow().isoformat()
+    with transaction() as cur:
+        cur.execute(
+            """
+            UPDATE broadcast_jobs
+            SET cursor_user_id = ?,
+                delivered = delivered + ?,
+                blocked = blocked + ?,
+                failed = failed + ?,
+                updated_at = ?
+            WHERE id = ?
+            """,
+            (cursor_user_id, delivered, blocked, failed, now, job_id),
+        )
+
+
+@writes
+def set_broadcast_status(job_id: int, status: str, only_from: Optional[tuple] = None) -> bool:
+    """
+    Vazifa holatini o'zgartiradi. only_from berilsa – faqat shu holatlardan.
+    O'zgargan bo'lsa True.
+    """
+    now = datetime.utcnow().isoformat()
+    finished = now if status in ("done", "cancelled") else None
+    where = "id = ?"
+    params: List[Any] = [status, finished, now, job_id]
+    if only_from:
+        where += f" AND status IN ({', '.join('?' for _ in only_from)})"
+        params.extend(only_from)
+
+    with transaction() as cur:
+        cur.execute(
+            f"""
+            UPDATE broadcast_jobs
+            SET status = ?, finished_at = COALESCE(?, finished_at), updated_at = ?
+            WHERE {where}
+            """,
+            params,
+        )
+        return cur.rowcount > 0
+
+
+@writes
+def claim_broadcast_lease(job_id: int, runner_id: str, now: float, ttl: float) -> bool:
+    """
+    Vazifani yurgizish huquqi (lease): bo'sh, muddati o'tgan yoki allaqachon
+    shu runnerniki bo'lsa – olinadi / uzaytiriladi. Faqat faol vazifalar.
+    Shartli UPDATE – bir nechta jarayondan faqat bittasi yutadi.
+    """
+    with transaction() as cur:
+        cur.execute(
+            """
+            UPDATE broadcast_jobs
+            SET runner_id = ?, lease_until = ?
+            WHERE id = ?
+              AND status IN (?, ?)
+              AND (runner_id IS NULL OR runner_id = ? OR lease_until < ?)
+            """,
+            (runner_id, now + ttl, job_id, *BROADCAST_ACTIVE_STATUSES, runner_id, now),
+        )
+        return cur.rowcount > 0
+
+
+@writes
+def release_broadcast_lease(job_id: int, runner_id: str):
+    with transaction() as cur:
+        cur.execute(
+            "UPDATE broadcast_jobs SET runner_id = NULL, lease_until = 0 "
+            "WHERE id = ? AND runner_id = ?",
+            (job_id, runner_id),
+        )
+
+
+# ---------------------------------------
+# Eksport uchun bo'laklab o'qish
+# ---------------------------------------
+def iter_query(sql: str, params: Any = (), chunk_size: int = 1000) -> Iterator[sqlite3.Row]:
+    """
+    Katta so'rov natijasini fetchmany bilan bo'laklab beradi –
+    xotirada bir vaqtda faqat chunk_size ta qator bo'ladi.
+    Alohida kursor – thread ulanishidagi boshqa so'rovlarga xalaqit bermaydi.
+    """
+    cur = get_connection().cursor()
     try:
-        import openpyxl
-    except ImportError:
-        return False
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        cur.close()
+
+
+def count_rows(table: str, where: str = "1", params: Any = ()) -> int:
+    row = get_connection().execute(
+        f"SELECT COUNT(*) AS c FROM {table} WHERE {where}", params
+    ).fetchone()
+    return row["c"]
 
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users")
-    rows = cur.fetchall()
-    conn.close()
-
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Users"
-
-    headers = [
-        "user_id",
-        "username",
-        "first_name",
-        "last_name",
-        "referrer_id",
-        "created_at",
-        "last_active_at",
-    ]
-    ws.append(headers)
 
-    for r in rows:
-        ws.append([r[h] for h in headers])
+def get_max_id(table: str) -> int:
+    row = get_connection().execute(f"SELECT COALESCE(MAX(id), 0) AS m FROM {table}").fetchone()
+    return row["m"]
 
-    wb.save(path)
-    return True
+
+def get_export_watermarks() -> Dict[str, str]:
+    """Oxirgi muvaffaqiyatli eksport chegaralari: {nom: qiymat}."""
+    rows = get_connection().execute("SELECT name, value FROM export_watermarks").fetchall()
+    return {r["name"]: r["value"] for r in rows}
+
+
+@writes
+def save_export_watermarks(watermarks: Dict[str, Any]):
+    now = datetime.utcnow().isoformat()
+    with transaction() as cur:
+        cur.executemany(
+            """
+            INSERT INTO export_watermarks (name, value, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+            """,
+            [(name, str(value), now) for name, value in watermarks.items()],
+        )
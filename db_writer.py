@@ -0,0 +1,160 @@
+# db_writer.py
+# Yagona yozuvchi thread: barcha o'zgartiruvchi DB chaqiruvlari navbatga tushadi
+# va har bir "tick"da bitta tranzaksiyada (group commit) bajariladi.
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from database import transaction
+
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class DatabaseWriter:
+    """
+    Ishlatish:
+        writer = DatabaseWriter()
+        writer.start()
+        database.set_database_writer(writer)
+
+    Har bir buyruq o'z SAVEPOINT ida bajariladi – bittasining xatosi
+    boshqalarini buzmaydi. Natija (Future) faqat COMMIT dan keyin beriladi.
+    """
+
+    def __init__(self, max_batch: int = 200, batch_wait_ms: float = 2.0):
+        self.max_batch = max_batch
+        self.batch_wait = batch_wait_ms / 1000
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "commits": 0,
+            "commands": 0,
+            "failed_commands": 0,
+            "failed_commits": 0,
+            "last_batch_size": 0,
+            "max_batch_size": 0,
+        }
+
+    # ---------------------------------------
+    # Tashqi API
+    # ---------------------------------------
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Navbatdagi hamma buyruqlarni bajarib, threadni to'xtatadi."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def is_writer_thread(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        future: Future = Future()
+        self._queue.put((fn, args, kwargs, future))
+        return future
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._metrics_lock:
+            data = dict(self._metrics)
+        data["queue_depth"] = self._queue.qsize()
+        data["avg_batch_size"] = (
+            round(data["commands"] / data["commits"], 2) if data["commits"] else 0
+        )
+        return data
+
+    # ---------------------------------------
+    # Ichki ish
+    # ---------------------------------------
+    def _collect_batch(self, first) -> Tuple[List[tuple], bool]:
+        batch = [first]
+        stop = False
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop = True
+                break
+            batch.append(item)
+        return batch, stop
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                self._drain_after_stop()
+                return
+
+            batch, stop = self._collect_batch(first)
+            self._execute(batch)
+            if stop:
+                self._drain_after_stop()
+                return
+
+    def _drain_after_stop(self):
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP:
+                self._execute([item])
+
+    def _execute(self, batch: List[tuple]):
+        results = []
+        failed = 0
+        try:
+            with transaction(immediate=True):
+                for fn, args, kwargs, future in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with transaction():
+                            value = fn(*args, **kwargs)
+                    except Exception as exc:
+                        failed += 1
+                        future.set_exception(exc)
+                    else:
+                        results.append((future, value))
+        except Exception as exc:
+            logger.exception("DB writer: batch commit xatosi (%s ta buyruq)", len(batch))
+            with self._metrics_lock:
+                self._metrics["failed_commits"] += 1
+            # BEGIN / COMMIT ning o'zi yiqilsa ham hech bir chaqiruvchi
+            # kutib qolmasligi kerak – boshlanmagan buyruqlar ham xato oladi
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        for future, value in results:
+            future.set_result(value)
+
+        with self._metrics_lock:
+            m = self._metrics
+            m["commits"] += 1
+            m["commands"] += len(batch)
+            m["failed_commands"] += failed
+            m["last_batch_size"] = len(batch)
+            m["max_batch_size"] = max(m["max_batch_size"], len(batch))
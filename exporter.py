@@ -0,0 +1,335 @@
+# exporter.py
+# Eksport: kursordan bo'laklab o'qib, openpyxl write-only rejimida (yoki CSV)
+# to'g'ridan-to'g'ri fayl-obyektga yozamiz.
+#
+# - export_users()  – faqat users (xlsx / csv / csv.gz)
+# - export_tables() – barcha jadvallar + hisoblangan balanslar (xlsx varaqlar
+#   yoki zip ichida CSV lar), delta rejimida faqat oxirgi eksportdan keyin
+#   qo'shilgan/o'zgargan qatorlar.
+
+import csv
+import gzip
+import io
+import zipfile
+from datetime import datetime, timedelta
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional
+
+from config import EXPORT_CHUNK_SIZE, EXPORT_DELTA_OVERLAP_SECONDS, REFERRAL_BONUS_LEVEL2
+from database import count_rows, get_export_watermarks, get_max_id, iter_query
+
+
+USER_COLUMNS = [
+    "user_id",
+    "username",
+    "first_name",
+    "last_name",
+    "referrer_id",
+    "created_at",
+    "last_active_at",
+    "deliverable",
+    "blocked_at",
+]
+
+# format -> (fayl kengaytmasi, MIME turi)
+EXPORT_FORMATS = {
+    "xlsx": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("csv", "text/csv"),
+    "csv.gz": ("csv.gz", "application/gzip"),
+}
+
+# export_tables formatlari: xlsx – bitta kitob, har jadval alohida varaq;
+# zip – har jadval alohida CSV
+TABLE_EXPORT_FORMATS = {
+    "xlsx": "xlsx",
+    "zip": "zip",
+}
+
+ProgressCallback = Callable[[int, int], None]
+
+
+# ---------------------------------------
+# Varaqlar ta'rifi
+# ---------------------------------------
+# delta – :ts_from/:ts_to va :<jadval>_from/:<jadval>_to oralig'idagi qatorlar
+SHEETS: List[Dict[str, Any]] = [
+    {
+        "name": "Users",
+        "table": "users",
+        "columns": USER_COLUMNS,
+        "order": "user_id",
+        "delta": (
+            "(created_at > :ts_from AND created_at <= :ts_to)"
+            " OR (last_active_at > :ts_from AND last_active_at <= :ts_to)"
+            " OR (blocked_at > :ts_from AND blocked_at <= :ts_to)"
+        ),
+    },
+    {
+        "name": "Referrals",
+        "table": "referrals",
+        "columns": ["id", "referrer_id", "referred_id", "level", "created_at"],
+        "order": "id",
+        "delta": "id > :referrals_from AND id <= :referrals_to",
+    },
+    {
+        "name": "ServiceRequests",
+        "table": "service_requests",
+        "columns": [
+            "id",
+            "user_id",
+            "service_key",
+            "cost",
+            "status",
+            "created_at",
+            "approved_at",
+            "admin_id",
+            "idempotency_key",
+        ],
+        "order": "id",
+        "delta": (
+            "(id > :service_requests_from AND id <= :service_requests_to)"
+            " OR (approved_at > :ts_from AND approved_at <= :ts_to)"
+        ),
+    },
+    {
+        "name": "ManualPoints",
+        "table": "manual_points",
+        "columns": ["id", "user_id", "points", "comment", "admin_id", "created_at"],
+        "order": "id",
+        "delta": "id > :manual_points_from AND id <= :manual_points_to",
+    },
+    {
+        "name": "Balances",
+        "table": "user_balances",
+        "columns": [
+            "user_id",
+            "level1_count",
+            "level2_raw",
+            "level2_bonus",
+            "manual_total",
+            "reserved",
+            "total_points",
+            "available_points",
+        ],
+        # hisoblangan ustunlar (get_referral_stats bilan bir xil formula)
+        "select": {
+            "level2_bonus": "CAST(level2_raw * :bonus AS INTEGER)",
+            "available_points": "MAX(total_points - CAST(reserved AS INTEGER), 0)",
+        },
+        "order": "user_id",
+        # balansi o'zgargan bo'lishi mumkin bo'lgan userlar
+        "delta": """
+            user_id IN (
+                SELECT referrer_id FROM referrals
+                WHERE id > :referrals_from AND id <= :referrals_to
+                UNION
+                SELECT user_id FROM manual_points
+                WHERE id > :manual_points_from AND id <= :manual_points_to
+                UNION
+                SELECT user_id FROM service_requests
+                WHERE (id > :service_requests_from AND id <= :service_requests_to)
+                   OR (approved_at > :ts_from AND approved_at <= :ts_to)
+            )
+        """,
+    },
+]
+
+_ID_TABLES = ("referrals", "service_requests", "manual_points")
+
+
+def _sheet_select(sheet: Dict[str, Any]) -> str:
+    computed = sheet.get("select", {})
+    return ", ".join(computed.get(c, c) for c in sheet["columns"])
+
+
+def _sheet_where(sheet: Dict[str, Any], delta: bool) -> str:
+    return f"({sheet['delta']})" if delta else "1"
+
+
+def _iter_sheet(sheet: Dict[str, Any], delta: bool, params: Dict[str, Any]) -> Iterator:
+    return iter_query(
+        f"SELECT {_sheet_select(sheet)} FROM {sheet['table']} "
+        f"WHERE {_sheet_where(sheet, delta)} ORDER BY {sheet['order']}",
+        params,
+        chunk_size=EXPORT_CHUNK_SIZE,
+    )
+
+
+def _delta_params(delta: bool) -> Dict[str, Any]:
+    """
+    Joriy eksport chegaralari: id lar – aniq (max id), vaqt – biroz orqaga
+    surilgan (kechiktirib yoziladigan last_active_at uchun), shuning uchun
+    ba'zi users qatorlari ketma-ket ikki deltada takrorlanishi mumkin.
+    """
+    now = datetime.utcnow()
+    params: Dict[str, Any] = {
+        "bonus": float(REFERRAL_BONUS_LEVEL2),
+        "ts_to": now.isoformat(),
+        "ts_next": (now - timedelta(seconds=EXPORT_DELTA_OVERLAP_SECONDS)).isoformat(),
+    }
+    marks = get_export_watermarks() if delta else {}
+    params["ts_from"] = marks.get("ts", "")
+    for table in _ID_TABLES:
+        params[f"{table}_from"] = int(marks.get(f"{table}_id", 0))
+        params[f"{table}_to"] = get_max_id(table)
+    return params
+
+
+def _new_watermarks(params: Dict[str, Any]) -> Dict[str, Any]:
+    marks = {"ts": params["ts_next"]}
+    for table in _ID_TABLES:
+        marks[f"{table}_id"] = params[f"{table}_to"]
+    return marks
+
+
+def _report(progress: Optional[ProgressCallback], done: int, total: int):
+    if progress is not None:
+        progress(done, total)
+
+
+def _write_csv_rows(
+    raw: BinaryIO,
+    columns: List[str],
+    rows: Iterator,
+    progress: Optional[ProgressCallback],
+    offset: int,
+    total: int,
+) -> int:
+    # utf-8-sig – Excel kirill/emoji ni to'g'ri ochishi uchun
+    text = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+    writer = csv.writer(text)
+    writer.writerow(columns)
+
+    done = 0
+    for row in rows:
+        writer.writerow(list(row))
+        done += 1
+        if done % EXPORT_CHUNK_SIZE == 0:
+            _report(progress, offset + done, total)
+
+    text.flush()
+    text.detach()  # raw ni yopmaymiz – chaqiruvchi boshqaradi
+    return done
+
+
+# ---------------------------------------
+# Faqat users
+# ---------------------------------------
+def _iter_users():
+    return iter_query(
+        f"SELECT {', '.join(USER_COLUMNS)} FROM users ORDER BY user_id",
+        chunk_size=EXPORT_CHUNK_SIZE,
+    )
+
+
+def export_users(
+    dest: BinaryIO,
+    fmt: str = "xlsx",
+    progress: Optional[ProgressCallback] = None,
+) -> int:
+    """
+    users jadvalini dest (BytesIO / vaqtinchalik fayl) ga yozadi.
+    fmt: "xlsx" | "csv" | "csv.gz". Yozilgan qatorlar sonini qaytaradi.
+    progress(done, total) har bir bo'lakdan keyin chaqiriladi.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Noma'lum format: {fmt}")
+
+    total = count_rows("users")
+    if fmt == "xlsx":
+        import openpyxl
+
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet("Users")
+        ws.append(USER_COLUMNS)
+
+        done = 0
+        for row in _iter_users():
+            ws.append(list(row))
+            done += 1
+            if done % EXPORT_CHUNK_SIZE == 0:
+                _report(progress, done, total)
+        wb.save(dest)
+    elif fmt == "csv.gz":
+        with gzip.GzipFile(fileobj=dest, mode="wb") as raw:
+            done = _write_csv_rows(raw, USER_COLUMNS, _iter_users(), progress, 0, total)
+    else:
+        done = _write_csv_rows(dest, USER_COLUMNS, _iter_users(), progress, 0, total)
+
+    _report(progress, done, total)
+    return done
+
+
+def export_users_to_excel(path: str) -> bool:
+    """Eski API: xlsx faylni diskka yozadi. openpyxl bo'lmasa False."""
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        return False
+
+    with open(path, "wb") as f:
+        export_users(f, "xlsx")
+    return True
+
+
+# ---------------------------------------
+# Barcha jadvallar (to'liq yoki delta)
+# ---------------------------------------
+def export_tables(
+    dest: BinaryIO,
+    fmt: str = "xlsx",
+    delta: bool = False,
+    progress: Optional[ProgressCallback] = None,
+) -> Dict[str, Any]:
+    """
+    Barcha jadvallar + Balances varag'ini dest ga yozadi.
+    delta=True – faqat oxirgi saqlangan watermarkdan keyingi qatorlar.
+
+    Qaytaradi: {"rows": {varaq: soni}, "watermarks": {...}}.
+    Watermarklar saqlanMAYDI – fayl muvaffaqiyatli yetkazilgach chaqiruvchi
+    database.save_export_watermarks(result["watermarks"]) ni chaqiradi.
+    """
+    if fmt not in TABLE_EXPORT_FORMATS:
+        raise ValueError(f"Noma'lum format: {fmt}")
+
+    params = _delta_params(delta)
+    totals = {
+        s["name"]: count_rows(s["table"], _sheet_where(s, delta), params) for s in SHEETS
+    }
+    total = sum(totals.values())
+
+    counts: Dict[str, int] = {}
+    offset = 0
+
+    if fmt == "xlsx":
+        import openpyxl
+
+        wb = openpyxl.Workbook(write_only=True)
+        for sheet in SHEETS:
+            ws = wb.create_sheet(sheet["name"])
+            ws.append(sheet["columns"])
+            done = 0
+            for row in _iter_sheet(sheet, delta, params):
+                ws.append(list(row))
+                done += 1
+                if done % EXPORT_CHUNK_SIZE == 0:
+                    _report(progress, offset + done, total)
+            counts[sheet["name"]] = done
+            offset += done
+        wb.save(dest)
+    else:
+        with zipfile.ZipFile(dest, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for sheet in SHEETS:
+                with zf.open(f"{sheet['table']}.csv", "w") as raw:
+                    done = _write_csv_rows(
+                        raw,
+                        sheet["columns"],
+                        _iter_sheet(sheet, delta, params),
+                        progress,
+                        offset,
+                        total,
+                    )
+                counts[sheet["name"]] = done
+                offset += done
+
+    _report(progress, offset, total)
+    return {"rows": counts, "watermarks": _new_watermarks(params)}
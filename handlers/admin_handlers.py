@@ -1,35 +1,54 @@
 # handlers/admin_handlers.py
+import logging
+import tempfile
+import threading
+import time
 
 from telebot import TeleBot, types
 
-from config import ADMIN_IDS, SERVICES
+from config import SERVICES, EXPORT_SPOOL_MAX_BYTES
 from database import (
+    close_thread_connection,
     get_stats,
+    get_writer_metrics,
     get_leaderboard,
-    export_users_to_excel,
+    get_outbox_stats,
+    get_active_broadcast_jobs,
+    get_recent_broadcast_jobs,
     get_user,
     get_referral_stats,
     get_user_by_username,
     approve_latest_request_for_user,
+    rebuild_user_balances,
+    save_export_watermarks,
+    verify_user_balances,
 )
-from keyboards import admin_menu_keyboard, main_menu_keyboard
+from antiflood import get_flood_guard
+from background import get_background_executor
+from broadcast import get_broadcast_manager, parse_segment
+from conversations import set_state
+from exporter import EXPORT_FORMATS, TABLE_EXPORT_FORMATS, export_tables, export_users
+from keyboards import admin_menu_keyboard
+from outbox import enqueue_message
 from pending import send_pending_list_to_admin
+from router import get_message_router
 
 
-def is_admin(user_id: int) -> bool:
-    return user_id in ADMIN_IDS
+logger = logging.getLogger(__name__)
+
+# bir vaqtda faqat bitta eksport (DB va xotirani himoya qilish uchun)
+_export_lock = threading.Lock()
 
 
 def register_admin_handlers(bot: TeleBot):
+    # admin=True route / step lar faqat ADMIN_IDS uchun (router tekshiradi)
+    router = get_message_router(bot)
+
     # =========================
     #  ADMIN PANELGA KIRISH
     # =========================
-    @bot.message_handler(commands=["admin"])
+    @router.command("admin", admin=True)
     def admin_panel_entry(message: types.Message):
-        user_id = message.from_user.id
-        if not is_admin(user_id):
-            return
-
         stats = get_stats()
         text = (
             "👨‍💼 ADMIN PANEL\n\n"
@@ -43,38 +62,65 @@ def register_admin_handlers(bot: TeleBot):
     # =========================
     #  📊 STATS tugmasi
     # =========================
-    @bot.message_handler(func=lambda m: m.text == "📊 Stats")
+    @router.text("📊 Stats", admin=True)
     def admin_stats(message: types.Message):
-        if not is_admin(message.from_user.id):
-            return
-
         stats = get_stats()
         text = (
             "📊 Umumiy statistika\n\n"
             f"👥 Foydalanuvchilar: {stats['users']}\n"
+            f"🚫 Botni bloklaganlar: {stats['blocked']}\n"
             f"📋 Pending so'rovlar: {stats['pending']}\n"
             f"🎁 Tasdiqlangan so'rovlar: {stats['approved']}"
         )
+
+        writer = get_writer_metrics()
+        if writer:
+            text += (
+                "\n\n✍️ DB yozuvchi:\n"
+                f"Navbat: {writer['queue_depth']} ta\n"
+                f"Oxirgi batch: {writer['last_batch_size']} ta, "
+                f"o'rtacha: {writer['avg_batch_size']}, max: {writer['max_batch_size']}\n"
+                f"Commitlar: {writer['commits']}, xatolar: {writer['failed_commands']}"
+            )
+
+        outbox = get_outbox_stats()
+        text += (
+            "\n\n📤 Outbox:\n"
+            f"Navbatda: {outbox['pending'] + outbox['sending']} ta, "
+            f"yuborildi: {outbox['sent']}, dead: {outbox['dead']}"
+        )
+
+        background = get_background_executor().metrics()
+        text += (
+            "\n\n⚙️ Fon ishlari:\n"
+            f"Navbat: {background['queue_depth']} ta (max {background['max_queue_depth']})\n"
+            f"Bajarildi: {background['completed']}, xato: {background['failed']}, "
+            f"navbat to'la (inline): {background['inline_runs']}\n"
+            f"Kutish: o'rtacha {background['avg_wait_ms']} ms, max {background['max_wait_ms']} ms"
+        )
+
+        flood = get_flood_guard(bot).metrics()
+        text += (
+            "\n\n🛡 Anti-flood:\n"
+            f"O'tkazildi: {flood['allowed']}, dublikat: {flood['duplicate']}, "
+            f"limit: {flood['limited']}\n"
+            f"Band: {flood['busy']}, shed: {flood['shed']}, "
+            f"ishlayapti: {flood['in_flight']}, max navbat: {flood['max_depth']}"
+        )
         bot.send_message(message.chat.id, text, parse_mode=None)
 
     # =========================
     #  📋 PENDING tugmasi
     # =========================
-    @bot.message_handler(func=lambda m: m.text == "📋 Pending")
+    @router.text("📋 Pending", admin=True)
     def admin_pending(message: types.Message):
-        if not is_admin(message.from_user.id):
-            return
-
         send_pending_list_to_admin(bot, message.chat.id)
 
     # =========================
     #  👥 TOP tugmasi
     # =========================
-    @bot.message_handler(func=lambda m: m.from_user.id in ADMIN_IDS and m.text == "👥 Top")
+    @router.text("👥 Top", admin=True)
     def admin_top(message: types.Message):
-        if not is_admin(message.from_user.id):
-            return
-
         chat_id = message.chat.id
         leaders = get_leaderboard(50)
 
@@ -111,81 +157,162 @@ def register_admin_handlers(bot: TeleBot):
     # =========================
     #  📥 EXCEL tugmasi
     # =========================
-    @bot.message_handler(func=lambda m: m.text == "📥 Excel")
-    def admin_export_excel_handler(message: types.Message):
-        if not is_admin(message.from_user.id):
-            return
+    def run_export(chat_id: int, kind: str, fmt: str, delta: bool):
+        """Fon threadda: eksport + progress xabari + faylni yuborish."""
+        last_edit = [0.0]
+
+        def progress(done: int, total: int):
+            now = time.monotonic()
+            if now - last_edit[0] < 2 and done < total:
+                return
+            last_edit[0] = now
+            percent = int(done * 100 / total) if total else 100
+            try:
+                bot.edit_message_text(
+                    f"⏳ Eksport: {done}/{total} ({percent}%)",
+                    chat_id,
+                    status.message_id,
+                )
+            except Exception:
+                pass
 
-        path = "sellory_users.xlsx"
-        ok = export_users_to_excel(path)
-        if not ok:
+        try:
+            # API xatosi ham _export_lock ni bo'shatadigan try ichida
+            status = bot.send_message(chat_id, "⏳ Eksport boshlandi...", parse_mode=None)
+            with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES) as buf:
+                if kind == "users":
+                    rows = export_users(buf, fmt, progress=progress)
+                    file_name = f"sellory_users.{EXPORT_FORMATS[fmt][0]}"
+                    caption = f"📥 Eksport: {rows} ta foydalanuvchi"
+                    watermarks = None
+                else:
+                    result = export_tables(buf, fmt, delta=delta, progress=progress)
+                    mode = "delta" if delta else "full"
+                    file_name = f"sellory_{mode}_{time.strftime('%Y%m%d_%H%M')}.{fmt}"
+                    caption = f"📥 Eksport ({mode}):\n" + "\n".join(
+                        f"{name}: {n} ta" for name, n in result["rows"].items()
+                    )
+                    watermarks = result["watermarks"]
+
+                buf.seek(0)
+                bot.send_document(
+                    chat_id,
+                    buf,
+                    visible_file_name=file_name,
+                    caption=caption,
+                )
+
+            # fayl yetkazildi – keyingi delta shu nuqtadan boshlanadi
+            if watermarks:
+                save_export_watermarks(watermarks)
+        except ImportError:
             bot.send_message(
-                message.chat.id,
+                chat_id,
                 "Excel faylini yaratishda xatolik yuz berdi (openpyxl o'rnatilganligini tekshiring).",
                 parse_mode=None,
             )
+        except Exception:
+            logger.exception("Eksport xatosi")
+            try:
+                bot.send_message(chat_id, "Eksport vaqtida xatolik yuz berdi.", parse_mode=None)
+            except Exception:
+                pass
+        finally:
+            _export_lock.release()
+            close_thread_connection()
+
+    def start_export(chat_id: int, kind: str = "tables", fmt: str = "xlsx", delta: bool = False):
+        if not _export_lock.acquire(blocking=False):
+            bot.send_message(chat_id, "Eksport allaqachon ishlayapti, kuting ⏳", parse_mode=None)
             return
+        threading.Thread(
+            target=run_export,
+            args=(chat_id, kind, fmt, delta),
+            name="admin-export",
+            daemon=True,
+        ).start()
+
+    @router.text("📥 Excel", admin=True)
+    def admin_export_excel_handler(message: types.Message):
+        start_export(message.chat.id)
+
+    # /export [full|delta] [xlsx|zip]   yoki   /export users [xlsx|csv|csv.gz]
+    @router.command("export", admin=True)
+    def admin_export_cmd(message: types.Message):
+        args = [a.lower() for a in (message.text or "").split()[1:]]
+        usage = (
+            "Eksport:\n"
+            "/export – barcha jadvallar (xlsx)\n"
+            "/export delta – faqat oxirgi eksportdan keyingilar\n"
+            "/export full zip – har jadval alohida CSV (zip)\n"
+            "/export users csv.gz – faqat foydalanuvchilar (xlsx | csv | csv.gz)"
+        )
 
-        try:
-            with open(path, "rb") as f:
-                bot.send_document(
-                    message.chat.id,
-                    f,
-                    visible_file_name="sellory_users.xlsx",
-                    caption="📥 Excel export",
-                )
-        except FileNotFoundError:
-            bot.send_message(message.chat.id, "Excel faylini topib bo'lmadi.", parse_mode=None)
+        if args and args[0] == "users":
+            fmt = args[1] if len(args) > 1 else "xlsx"
+            if fmt not in EXPORT_FORMATS:
+                bot.send_message(message.chat.id, usage, parse_mode=None)
+                return
+            start_export(message.chat.id, "users", fmt)
+            return
+
+        delta = False
+        fmt = "xlsx"
+        for arg in args:
+            if arg in ("full", "delta"):
+                delta = arg == "delta"
+            elif arg in TABLE_EXPORT_FORMATS:
+                fmt = arg
+            else:
+                bot.send_message(message.chat.id, usage, parse_mode=None)
+                return
+
+        start_export(message.chat.id, "tables", fmt, delta)
+
+    # =====================================================
+    #  /check_balances, /rebuild_balances – user_balances nazorati
+    # =====================================================
+    @router.command("check_balances", "rebuild_balances", admin=True)
+    def admin_balances(message: types.Message):
+        report = verify_user_balances()
+        lines = [f"Balans tekshiruvi: {report['mismatched']} ta nomuvofiqlik"]
+        if report["histogram_mismatched"]:
+            lines.append(f"Reyting gistogrammasi: {report['histogram_mismatched']} ta nomuvofiqlik")
+        if report["user_ids"]:
+            lines.append("User ID: " + ", ".join(str(uid) for uid in report["user_ids"]))
+
+        if (message.text or "").startswith("/rebuild_balances"):
+            rows = rebuild_user_balances()
+            lines.append(f"Qayta hisoblandi: {rows} ta user ✅")
+
+        bot.send_message(message.chat.id, "\n".join(lines), parse_mode=None)
 
     # =====================================================
     #  📢 BROADCAST – TUGMA ORQALI (2 bosqichli)
     # =====================================================
-    @bot.message_handler(func=lambda m: m.text == "📢 Broadcast")
+    @router.text("📢 Broadcast", admin=True)
     def admin_broadcast_start_from_button(message: types.Message):
         """Admin menyudagi '📢 Broadcast' tugmasi."""
-        if not is_admin(message.from_user.id):
-            return
-
         msg = bot.send_message(
             message.chat.id,
             "Broadcast xabar matnini yuboring.\n"
             "Bu xabar barcha foydalanuvchilarga jo'natiladi.",
             parse_mode=None,
         )
-        bot.register_next_step_handler(msg, admin_broadcast_process)
-
-    def admin_broadcast_process(message: types.Message):
-        if not is_admin(message.from_user.id):
-            return
+        set_state(msg.chat.id, message.from_user.id, "broadcast:text")
 
+    @router.step("broadcast:text", admin=True)
+    def admin_broadcast_process(message: types.Message, data: dict):
         text_to_send = (message.text or "").strip()
         if not text_to_send:
             bot.send_message(message.chat.id, "Bo'sh xabar. Bekor qilindi.", parse_mode=None)
             return
 
-        users = get_leaderboard(limit=1000000)
-        ids = [u["user_id"] for u in users]
-
-        sent = 0
-        for uid in ids:
-            try:
-                bot.send_message(uid, text_to_send, parse_mode=None)
-                sent += 1
-            except Exception:
-                continue
-
-        bot.send_message(
-            message.chat.id,
-            f"Broadcast yuborildi: {sent} ta foydalanuvchiga ✅",
-            parse_mode=None,
-        )
+        start_broadcast(message, text_to_send)
 
     # (xohlasang ishlatadigan) /broadcast komandasi ham qoladi
-    @bot.message_handler(commands=["broadcast"])
+    @router.command("broadcast", admin=True)
     def admin_broadcast_cmd(message: types.Message):
-        if not is_admin(message.from_user.id):
-            return
-
         parts = (message.text or "").split(" ", 1)
         if len(parts) < 2 or not parts[1].strip():
             bot.send_message(
@@ -197,31 +324,81 @@ def register_admin_handlers(bot: TeleBot):
             return
 
         text_to_send = parts[1].strip()
-        users = get_leaderboard(limit=1000000)
-        ids = [u["user_id"] for u in users]
+        start_broadcast(message, text_to_send)
 
-        sent = 0
-        for uid in ids:
-            try:
-                bot.send_message(uid, text_to_send, parse_mode=None)
-                sent += 1
-            except Exception:
-                continue
+    # /broadcast_to active:7 points:10 pending never | Matn...
+    @router.command("broadcast_to", admin=True)
+    def admin_broadcast_segment_cmd(message: types.Message):
+        parts = (message.text or "").split(" ", 1)
+        spec, sep, text_to_send = (parts[1] if len(parts) > 1 else "").partition("|")
+        segment, error = parse_segment(spec)
+        if not sep or not text_to_send.strip() or error:
+            bot.send_message(
+                message.chat.id,
+                (f"{error}\n\n" if error else "")
+                + "Segment bo'yicha broadcast:\n"
+                "/broadcast_to active:7 points:10 pending never | Matn...\n\n"
+                "active:N – so'nggi N kunda faol\n"
+                "points:N – kamida N ball\n"
+                "pending – pending so'rovi borlar\n"
+                "never – hali xizmat olmaganlar",
+                parse_mode=None,
+            )
+            return
 
-        bot.send_message(
-            message.chat.id,
-            f"Broadcast yuborildi: {sent} ta foydalanuvchiga ✅",
-            parse_mode=None,
-        )
+        start_broadcast(message, text_to_send.strip(), segment)
+
+    def start_broadcast(message: types.Message, text_to_send: str, segment: dict = None):
+        """Fon vazifa sifatida boshlaymiz – handler thread bloklanmaydi."""
+        manager = get_broadcast_manager(bot)
+        job_id = manager.start(message.from_user.id, message.chat.id, text_to_send, segment)
+        if job_id is None:
+            active = get_active_broadcast_jobs()
+            active_id = active[0]["id"] if active else "?"
+            bot.send_message(
+                message.chat.id,
+                f"Broadcast #{active_id} hali tugamagan.\n"
+                "/bc_status, /bc_pause, /bc_resume yoki /bc_cancel dan foydalaning.",
+                parse_mode=None,
+            )
+
+    # /bc_status [id], /bc_pause [id], /bc_resume [id], /bc_cancel [id]
+    @router.command("bc_status", "bc_pause", "bc_resume", "bc_cancel", admin=True)
+    def admin_broadcast_control(message: types.Message):
+        parts = (message.text or "").split()
+        command = parts[0].lstrip("/").split("@", 1)[0]
+
+        if len(parts) > 1 and parts[1].isdigit():
+            job_id = int(parts[1])
+        else:
+            # id berilmasa – faol (yoki oxirgi) vazifa
+            jobs = get_active_broadcast_jobs() or get_recent_broadcast_jobs(1)
+            if not jobs:
+                bot.send_message(message.chat.id, "Broadcast vazifalari yo'q.", parse_mode=None)
+                return
+            job_id = jobs[0]["id"]
+
+        manager = get_broadcast_manager(bot)
+        if command == "bc_status":
+            text = manager.status_text(job_id) or "Bunday broadcast topilmadi."
+        else:
+            action = {
+                "bc_pause": (manager.pause, "pauza qilindi ⏸"),
+                "bc_resume": (manager.resume, "davom ettirildi ▶️"),
+                "bc_cancel": (manager.cancel, "bekor qilindi ❌"),
+            }[command]
+            if action[0](job_id):
+                text = f"Broadcast #{job_id} {action[1]}"
+            else:
+                text = f"Broadcast #{job_id} holatini o'zgartirib bo'lmadi."
+
+        bot.send_message(message.chat.id, text, parse_mode=None)
 
     # =====================================================
     #  🔍 USERS tugmasi – foydalanuvchi qidirish
     # =====================================================
-    @bot.message_handler(func=lambda m: m.text in ("🔍 Users", "👤 Users"))
+    @router.text("🔍 Users", "👤 Users", admin=True)
     def admin_users_search_start(message: types.Message):
-        if not is_admin(message.from_user.id):
-            return
-
         msg = bot.send_message(
             message.chat.id,
             "Foydalanuvchini qidirish uchun ID yoki @username yuboring.\n\n"
@@ -230,12 +407,10 @@ def register_admin_handlers(bot: TeleBot):
             "@username",
             parse_mode=None,
         )
-        bot.register_next_step_handler(msg, admin_users_search_process)
-
-    def admin_users_search_process(message: types.Message):
-        if not is_admin(message.from_user.id):
-            return
+        set_state(msg.chat.id, message.from_user.id, "users:search")
 
+    @router.step("users:search", admin=True)
+    def admin_users_search_process(message: types.Message, data: dict):
         query = (message.text or "").strip()
         if not query:
             bot.send_message(message.chat.id, "Bo'sh xabar. Qayta urinib ko'ring.", parse_mode=None)
@@ -277,27 +452,16 @@ def register_admin_handlers(bot: TeleBot):
         text = "\n".join(lines)
         bot.send_message(message.chat.id, text, parse_mode=None)
 
-    # =====================================================
-    #  🔙 ASOSIY tugmasi – admin menyudan user menyuga
-    # =====================================================
-    @bot.message_handler(func=lambda m: m.text == "🔙 Asosiy")
-    def admin_back_to_main(message: types.Message):
-        user = message.from_user
-        if not is_admin(user.id):
-            return
-
-        kb = main_menu_keyboard(is_admin=True)
-        bot.send_message(message.chat.id, "Asosiy menyu.", reply_markup=kb, parse_mode=None)
-
     # =====================================================
     #  /approve + izoh bosqichi
     # =====================================================
-    @bot.message_handler(func=lambda m: (m.text or "").startswith("/approve"))
+    # /approve 123456  yoki  /approve_123456 (router '_' li komandani shu yerga beradi)
+    @router.command("approve", admin=True)
     def admin_approve(message: types.Message):
-        if not is_admin(message.from_user.id):
-            return
-
         parts = (message.text or "").split()
+        suffix = parts[0].split("@", 1)[0].partition("_")[2]
+        if suffix:
+            parts = [parts[0], suffix]
         if len(parts) < 2 or not parts[1].isdigit():
             bot.send_message(
                 message.chat.id,
@@ -339,24 +503,22 @@ def register_admin_handlers(bot: TeleBot):
         prompt = "\n".join(lines)
 
         msg = bot.send_message(message.chat.id, prompt, parse_mode=None)
-        bot.register_next_step_handler(
-            msg,
-            admin_approve_comment_step,
-            target_id,
-            service_name,
-            total,
-            available,
+        set_state(
+            msg.chat.id,
+            message.from_user.id,
+            "approve:comment",
+            target_id=target_id,
+            service_name=service_name,
+            total=total,
+            available=available,
         )
 
-    def admin_approve_comment_step(
-        message: types.Message,
-        target_id: int,
-        service_name: str,
-        total: int,
-        available: int,
-    ):
-        if not is_admin(message.from_user.id):
-            return
+    @router.step("approve:comment", admin=True)
+    def admin_approve_comment_step(message: types.Message, data: dict):
+        target_id = data["target_id"]
+        service_name = data["service_name"]
+        total = data["total"]
+        available = data["available"]
 
         text = (message.text or "").strip()
 
@@ -370,10 +532,7 @@ def register_admin_handlers(bot: TeleBot):
             base_lines.append(f"Mavjud ball: {available} ta")
             user_text = "\n".join(base_lines)
 
-            try:
-                bot.send_message(target_id, user_text, parse_mode=None)
-            except Exception:
-                pass
+            enqueue_message(target_id, user_text)
 
             bot.send_message(
                 message.chat.id,
@@ -396,10 +555,8 @@ def register_admin_handlers(bot: TeleBot):
         user_lines.append(comment)
         user_text = "\n".join(user_lines)
 
-        try:
-            bot.send_message(target_id, user_text, parse_mode=None)
-        except Exception:
-            pass
+        # mukofot outbox orqali – vaqtinchalik xatoda yo'qolmaydi
+        enqueue_message(target_id, user_text)
 
         bot.send_message(
             message.chat.id,
@@ -0,0 +1,29 @@
+# handlers/channel_handlers.py
+from telebot import TeleBot, types
+
+from utils import find_channel_key, is_member_status, record_channel_member
+
+
+def register_channel_handlers(bot: TeleBot):
+    """
+    Bot CHANNELS dagi kanallarda admin bo'lsa, Telegram har bir
+    qo'shilish/chiqishni chat_member update sifatida yuboradi – shu orqali
+    channel_members jadvalini yangilab boramiz va is_user_subscribed
+    tarmoqqa chiqmasdan javob beradi.
+    (polling / webhook da allowed_updates ichida "chat_member" bo'lishi shart.)
+    """
+
+    @bot.chat_member_handler()
+    def on_chat_member(update: types.ChatMemberUpdated):
+        channel = find_channel_key(update.chat)
+        if channel is None:
+            return
+
+        member = update.new_chat_member
+        record_channel_member(
+            channel,
+            member.user.id,
+            member.status,
+            is_member_status(member),
+            "event",
+        )
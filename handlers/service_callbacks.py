@@ -1,72 +1,97 @@
 # handlers/service_callbacks.py
 from telebot import TeleBot, types
 
-from config import SERVICES
-from database import get_referral_stats, create_service_request
+from background import get_background_executor
+from callback_data import SERVICE
+from config import CALLBACK_FAST_ACK, SERVICES
+from database import reserve_service
 from pending import notify_admins_new_request
+from router import get_callback_router
+from views import service_accepted_text
+
+
+def service_idempotency_key(call: types.CallbackQuery, service_key: str) -> str:
+    """
+    Har bir bosish yangi callback id oladi, shuning uchun kalitni callback
+    kelgan xabardan olamiz: bitta xizmatlar xabaridagi qayta bosishlar
+    (double-tap, qayta yetkazilgan update) bitta so'rov bo'lib qoladi.
+    """
+    return f"cb:{call.message.chat.id}:{call.message.message_id}:{service_key}"
 
 
 def register_service_callbacks(bot: TeleBot):
     """
-    Xizmat tanlash uchun callback handlerlar.
-    services_inline_keyboard() dagi tugmalar callback_data: 'service:<key>' bo'lishi kerak.
+    Xizmat tanlash uchun callback handler – 'service:<key>' ning YAGONA yo'li.
+    services_inline_keyboard() dagi tugmalar callback_data.SERVICE bilan yasaladi.
     """
+    callbacks = get_callback_router(bot)
 
-    @bot.callback_query_handler(func=lambda c: c.data.startswith("service:"))
-    def handle_service_choice(call: types.CallbackQuery):
+    @callbacks.route(SERVICE)
+    def handle_service_choice(call: types.CallbackQuery, data: dict):
         user = call.from_user
         chat_id = call.message.chat.id
 
-        # callback_data: 'service:chatgpt' yoki 'service:gift' kabi
-        data = call.data or ""
-        try:
-            service_key = data.split(":", 1)[1]
-        except IndexError:
-            bot.answer_callback_query(call.id, "Xizmat topilmadi.", show_alert=True)
-            return
-
+        service_key = data["key"]
         svc = SERVICES.get(service_key)
         if not svc:
             bot.answer_callback_query(call.id, "Xizmat topilmadi.", show_alert=True)
             return
 
-        # User statistikasi va balans
-        stats = get_referral_stats(user.id)
-        available = stats["available_points"]
-        total = stats["total_points"]
-        cost = int(svc["cost"])
+        # Balans tekshiruvi + pending so'rov – bitta atomar tranzaksiyada
+        result = reserve_service(
+            user.id,
+            service_key,
+            idempotency_key=service_idempotency_key(call, service_key),
+        )
+        cost = result.get("cost", int(svc["cost"]))
+
+        if result["status"] == "duplicate":
+            bot.answer_callback_query(call.id, "So'rovingiz allaqachon yuborilgan ✅", show_alert=False)
+            return
 
-        if available < cost:
+        if result["status"] != "ok":
             bot.answer_callback_query(
                 call.id,
-                f"Balansingiz yetarli emas. Kerak: {cost}, sizda: {available}.",
+                f"Balansingiz yetarli emas. Kerak: {cost}, sizda: {result.get('available_before', 0)}.",
                 show_alert=True,
             )
             return
 
-        # DB ga pending so'rov qo'shamiz
-        create_service_request(user.id, service_key, cost)
+        total = result["total_points"]
+        available = result["available_before"]
 
-        # Adminlarga DM qilib xabar beramiz
-        notify_admins_new_request(bot, user.id, service_key)
+        def finish_request():
+            # Adminlarga DM qilib xabar beramiz (balans reserve_service natijasidan –
+            # qayta so'rov yo'q)
+            notify_admins_new_request(
+                bot,
+                user.id,
+                service_key,
+                user={
+                    "username": user.username,
+                    "first_name": user.first_name,
+                    "last_name": user.last_name,
+                },
+                stats={"total_points": total, "available_points": result["available_after"]},
+            )
 
-        # Callbackga qisqa javob (alert yoq)
-        bot.answer_callback_query(call.id, "So'rovingiz adminga yuborildi ✅", show_alert=False)
+            # Foydalanuvchiga xabar (eski xabarni o'zgartiramiz)
+            text = service_accepted_text(svc, cost, total, available - cost)
 
-        # Foydalanuvchiga xabar (eski xabarni o'zgartiramiz)
-        text = (
-            "💎 Xizmat so'rovi qabul qilindi!\n\n"
-            f"Siz tanlagan xizmat: {svc['name']} ({cost} ball)\n"
-            f"Jami ballaringiz: {total} ta, mavjud: {available - cost} ta.\n\n"
-            "Admin so'rovingizni ko'rib chiqadi va 1–12 soat ichida javob beradi."
-        )
+            try:
+                bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=call.message.message_id,
+                    text=text,
+                )
+            except Exception:
+                # Agar edit xato bersa (masalan, o'chib ketgan bo'lsa) – alohida xabar yuboramiz
+                bot.send_message(chat_id, text)
 
-        try:
-            bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=call.message.message_id,
-                text=text,
-            )
-        except Exception:
-            # Agar edit xato bersa (masalan, o'chib ketgan bo'lsa) – alohida xabar yuboramiz
-            bot.send_message(chat_id, text)
+        if CALLBACK_FAST_ACK:
+            # so'rov bazada – spinnerni darhol to'xtatamiz, HTTP ishlar fonda
+            bot.answer_callback_query(call.id, "So'rovingiz adminga yuborildi ✅", show_alert=False)
+            get_background_executor().submit(finish_request)
+        else:
+            finish_request()
+            bot.answer_callback_query(call.id, "So'rovingiz adminga yuborildi ✅", show_alert=False)
@@ -1,5 +1,6 @@
 # keyboards.py
 from telebot import types
+from callback_data import BACK_TO_BALANCE, CHECK_CHANNEL, SERVICE
 from config import SERVICES, CHANNELS
 
 
@@ -46,7 +47,7 @@ def subscription_keyboard():
         kb.add(btn)
 
     # Oxirida umumiy "Tekshirish" tugmasi
-    btn_check = types.InlineKeyboardButton("✅ Tekshirish", callback_data="check_channel")
+    btn_check = types.InlineKeyboardButton("✅ Tekshirish", callback_data=CHECK_CHANNEL.new())
     kb.add(btn_check)
 
     return kb
@@ -61,12 +62,12 @@ def services_inline_keyboard(available_points: int) -> types.InlineKeyboardMarku
         emoji = svc["emoji"]
         name = svc["name"]
         text = f"{emoji} {name} ({cost})"
-        # shu yer MUHIM:
-        callback_data = f"service:{key}"
-        btn = types.InlineKeyboardButton(text, callback_data=callback_data)
+        # shu yer MUHIM: format callback_data.SERVICE da
+        btn = types.InlineKeyboardButton(text, callback_data=SERVICE.new(key=key))
         buttons.append(btn)
 
     kb.add(*buttons)
+    kb.add(types.InlineKeyboardButton("🔙 Balans", callback_data=BACK_TO_BALANCE.new()))
     return kb
 
 
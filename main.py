@@ -1,27 +1,83 @@
 # main.py
+import argparse
 import logging
 
 from telebot import TeleBot
 
-from config import BOT_TOKEN
-from database import init_db
+from config import (
+    ALLOWED_UPDATES,
+    BOT_MODE,
+    BOT_NUM_THREADS,
+    BOT_TOKEN,
+    DB_WRITER_BATCH_WAIT_MS,
+    DB_WRITER_MAX_BATCH,
+)
+from database import (
+    close_all_connections,
+    set_database_writer,
+    start_activity_flusher,
+    stop_activity_flusher,
+)
+from db_writer import DatabaseWriter
+from background import get_background_executor
+from outbox import get_outbox_sender
+from broadcast import get_broadcast_manager
+from migrations import run_migrations
 from handlers.text_handlers import register_text_handlers
 from handlers.callbacks import register_callback_handlers
 from handlers.admin_handlers import register_admin_handlers
 from points import register_points_handlers
 from handlers.service_callbacks import register_service_callbacks
+from handlers.channel_handlers import register_channel_handlers
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-bot = TeleBot(BOT_TOKEN)   # hech qanday parse_mode bermaymiz
+bot = TeleBot(BOT_TOKEN, threaded=True, num_threads=BOT_NUM_THREADS)   # hech qanday parse_mode bermaymiz
 bot.parse_mode = None
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Selloriy bot")
+    parser.add_argument(
+        "--mode",
+        choices=("polling", "webhook", "supervisor"),
+        default=BOT_MODE,
+        help="update qabul qilish rejimi (standart: config.BOT_MODE)",
+    )
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+
+    if args.mode == "supervisor":
+        # update larni bu jarayon oladi, handlerlar worker jarayonlarda
+        from supervisor import Supervisor
+
+        Supervisor().run()
+        return
+
     # DB yaratish / migrate
-    init_db()
+    run_migrations()
+
+    # barcha yozuvlar bitta thread orqali (group commit)
+    writer = DatabaseWriter(
+        max_batch=DB_WRITER_MAX_BATCH,
+        batch_wait_ms=DB_WRITER_BATCH_WAIT_MS,
+    )
+    writer.start()
+    set_database_writer(writer)
+    start_activity_flusher()
+
+    # callbacklardan keyingi HTTP ishlar (adminlarga xabar, edit) uchun
+    background = get_background_executor()
+    background.start()
+
+    # adminlarga bildirishnoma / mukofotlar – outbox jadvali orqali
+    outbox = get_outbox_sender(bot)
+    outbox.start()
 
     # Handlers ro'yxatdan o'tkazish
     register_text_handlers(bot)
@@ -29,10 +85,28 @@ def main():
     register_admin_handlers(bot)
     register_points_handlers(bot)
     register_service_callbacks(bot)
+    register_channel_handlers(bot)
+
+    # restart oldidan tugamay qolgan broadcastlar
+    get_broadcast_manager(bot).start_watchdog()
 
+    logger.info("Selloriy bot (pyTelegramBotAPI, modular, clean) ishga tushdi (%s)...", args.mode)
+    try:
+        if args.mode == "webhook":
+            from webhook import WebhookServer
 
-    logger.info("Selloriy bot (pyTelegramBotAPI, modular, clean) ishga tushdi...")
-    bot.infinity_polling(skip_pending=True)
+            WebhookServer(bot, ALLOWED_UPDATES).serve_forever()
+        else:
+            # polling uchun webhook o'chirilgan bo'lishi shart
+            bot.remove_webhook()
+            bot.infinity_polling(skip_pending=True, allowed_updates=ALLOWED_UPDATES)
+    finally:
+        background.stop()
+        outbox.stop()
+        stop_activity_flusher()
+        writer.stop()
+        set_database_writer(None)
+        close_all_connections()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,448 @@
+# migrations.py
+# Sxema migratsiyalari: schema_version jadvali bo'yicha faqat hali qo'llanmagan
+# qadamlar bajariladi. Barcha DDL shu yerda – request yo'lida DDL yo'q.
+
+import logging
+import sqlite3
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from database import (
+    bonus_ppm,
+    configure_database,
+    get_connection,
+    rebuild_user_balances,
+    transaction,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def _columns(cur: sqlite3.Cursor, table: str) -> List[str]:
+    cur.execute(f"PRAGMA table_info({table})")
+    return [r["name"] for r in cur.fetchall()]
+
+
+# ---------------------------------------
+# 1 – asosiy jadvallar
+# ---------------------------------------
+def _m001_base_tables(cur: sqlite3.Cursor):
+    # foydalanuvchilar
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            referrer_id INTEGER,
+            created_at TEXT,
+            last_active_at TEXT
+        )
+        """
+    )
+
+    # referallar
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS referrals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            referrer_id INTEGER,
+            referred_id INTEGER,
+            level INTEGER,
+            created_at TEXT
+        )
+        """
+    )
+
+    # xizmat so'rovlari
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS service_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            service_key TEXT,
+            cost REAL,
+            status TEXT,
+            created_at TEXT,
+            approved_at TEXT,
+            admin_id INTEGER
+        )
+        """
+    )
+
+    # admin /givepoint orqali qo‘shgan qo‘lda ballar
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS manual_points (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            points REAL,
+            comment TEXT,
+            admin_id INTEGER,
+            created_at TEXT
+        )
+        """
+    )
+
+
+# ---------------------------------------
+# 2 – manual_points ning ikki xil shaklini birlashtirish
+# ---------------------------------------
+def _m002_reconcile_manual_points(cur: sqlite3.Cursor):
+    """
+    Eski points.py jadvalni (id, user_id, points, reason, created_at) shaklida
+    yaratgan bo'lishi mumkin. Yagona shakl: comment + admin_id.
+    Eski `reason` ustuni o'chirilmaydi, qiymatlari comment ga ko'chiriladi.
+    """
+    cols = _columns(cur, "manual_points")
+    if "comment" not in cols:
+        cur.execute("ALTER TABLE manual_points ADD COLUMN comment TEXT")
+    if "admin_id" not in cols:
+        cur.execute("ALTER TABLE manual_points ADD COLUMN admin_id INTEGER")
+    if "reason" in cols:
+        cur.execute("UPDATE manual_points SET comment = reason WHERE comment IS NULL")
+
+    # points.add_manual_points yangilab boradigan ustun
+    if "extra_points" not in _columns(cur, "users"):
+        cur.execute("ALTER TABLE users ADD COLUMN extra_points INTEGER DEFAULT 0")
+
+
+# ---------------------------------------
+# 3 – user_balances, reyting jadvallari va triggerlar
+# ---------------------------------------
+def _m003_user_balances(cur: sqlite3.Cursor):
+    # har bir user uchun tayyor balans (read model) – triggerlar yangilab turadi
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_balances (
+            user_id INTEGER PRIMARY KEY,
+            level1_count INTEGER NOT NULL DEFAULT 0,
+            level2_raw INTEGER NOT NULL DEFAULT 0,
+            manual_total REAL NOT NULL DEFAULT 0,
+            reserved REAL NOT NULL DEFAULT 0,
+            total_points INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    # leaderboard: total_points bo'yicha tartiblangan indeks
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_user_balances_points
+        ON user_balances (total_points DESC, user_id)
+        """
+    )
+
+    # kichik kalit/qiymat jadval (points_version, level2_bonus_ppm)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS app_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    cur.execute("INSERT OR IGNORE INTO app_meta (key, value) VALUES ('points_version', 0)")
+
+    # reyting gistogrammasi: nechta user aynan shuncha ballga ega
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS points_histogram (
+            total_points INTEGER PRIMARY KEY,
+            users INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+
+    # triggerlar + mavjud ma'lumotdan to'ldirish
+    rebuild_user_balances()
+
+
+# ---------------------------------------
+# 4 – issiq so'rovlar uchun indekslar
+# ---------------------------------------
+def _m004_hot_path_indexes(cur: sqlite3.Cursor):
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_referrals_referrer_level "
+        "ON referrals (referrer_id, level)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_referrals_referred "
+        "ON referrals (referred_id)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_service_requests_user_status "
+        "ON service_requests (user_id, status, created_at)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_service_requests_status "
+        "ON service_requests (status, created_at)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_manual_points_user "
+        "ON manual_points (user_id)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_username_nocase "
+        "ON users (username COLLATE NOCASE)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_last_active "
+        "ON users (last_active_at)"
+    )
+
+
+# ---------------------------------------
+# 5 – xizmat so'rovlari uchun idempotency kaliti
+# ---------------------------------------
+def _m005_service_request_idempotency(cur: sqlite3.Cursor):
+    if "idempotency_key" not in _columns(cur, "service_requests"):
+        cur.execute("ALTER TABLE service_requests ADD COLUMN idempotency_key TEXT")
+    cur.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_service_requests_idempotency
+        ON service_requests (idempotency_key)
+        WHERE idempotency_key IS NOT NULL
+        """
+    )
+
+
+# ---------------------------------------
+# 6 – delta eksport uchun watermarklar
+# ---------------------------------------
+def _m006_export_watermarks(cur: sqlite3.Cursor):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS export_watermarks (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at TEXT
+        )
+        """
+    )
+    # service_requests delta: tasdiqlanganlar approved_at bo'yicha
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_service_requests_approved "
+        "ON service_requests (approved_at)"
+    )
+    # users delta: yangi qo'shilganlar created_at bo'yicha
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_created "
+        "ON users (created_at)"
+    )
+
+
+# ---------------------------------------
+# 7 – fon broadcast vazifalari
+# ---------------------------------------
+def _m007_broadcast_jobs(cur: sqlite3.Cursor):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER,
+            chat_id INTEGER,
+            status_message_id INTEGER,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL,
+            cursor_user_id INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            delivered INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT,
+            started_at TEXT,
+            finished_at TEXT,
+            updated_at TEXT
+        )
+        """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status "
+        "ON broadcast_jobs (status)"
+    )
+
+
+# ---------------------------------------
+# 8 – broadcast segmenti (JSON filtrlar)
+# ---------------------------------------
+def _m008_broadcast_segment(cur: sqlite3.Cursor):
+    if "segment" not in _columns(cur, "broadcast_jobs"):
+        cur.execute("ALTER TABLE broadcast_jobs ADD COLUMN segment TEXT")
+
+
+# ---------------------------------------
+# 9 – yetkazib bo'lmaydigan userlar (botni bloklagan / chat topilmadi)
+# ---------------------------------------
+def _m009_user_deliverability(cur: sqlite3.Cursor):
+    cols = _columns(cur, "users")
+    if "deliverable" not in cols:
+        cur.execute("ALTER TABLE users ADD COLUMN deliverable INTEGER NOT NULL DEFAULT 1")
+    if "blocked_at" not in cols:
+        cur.execute("ALTER TABLE users ADD COLUMN blocked_at TEXT")
+    # broadcast keyset so'rovi faqat tirik userlar bo'ylab yuradi
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_deliverable "
+        "ON users (user_id) WHERE deliverable = 1"
+    )
+
+
+# ---------------------------------------
+# 10 – kanal a'zoligi (chat_member update lari + API natijalari)
+# ---------------------------------------
+def _m010_channel_members(cur: sqlite3.Cursor):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS channel_members (
+            channel TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            is_member INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (channel, user_id)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+# ---------------------------------------
+# 11 – outbox: yuboriladigan xabarlar navbati (outbox.py)
+# ---------------------------------------
+def _m011_outbox(cur: sqlite3.Cursor):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            method TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TEXT NOT NULL,
+            sent_at TEXT
+        )
+        """
+    )
+    # tayyor xabarlarni olish
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_outbox_ready "
+        "ON outbox (status, next_attempt_at)"
+    )
+    # har bir chat bo'yicha navbat boshi (FIFO)
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_outbox_chat_open "
+        "ON outbox (chat_id, id) WHERE status IN ('pending', 'sending')"
+    )
+
+
+# ---------------------------------------
+# 12 – ko'p bosqichli dialoglar holati (conversations.py)
+# ---------------------------------------
+def _m012_conversations(cur: sqlite3.Cursor):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS conversations (
+            chat_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            state TEXT NOT NULL,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """
+    )
+    # muddati o'tganlarni tozalash va hajm chegarasi (eng eskisi o'chadi)
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_conversations_expires "
+        "ON conversations (expires_at)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_conversations_updated "
+        "ON conversations (updated_at)"
+    )
+
+
+# ---------------------------------------
+# 13 – broadcast runner lease (bir nechta jarayon bitta vazifani yurgizmasin)
+# ---------------------------------------
+def _m013_broadcast_lease(cur: sqlite3.Cursor):
+    cols = _columns(cur, "broadcast_jobs")
+    if "runner_id" not in cols:
+        cur.execute("ALTER TABLE broadcast_jobs ADD COLUMN runner_id TEXT")
+    if "lease_until" not in cols:
+        cur.execute("ALTER TABLE broadcast_jobs ADD COLUMN lease_until REAL NOT NULL DEFAULT 0")
+
+
+# (versiya, nom, funksiya) – faqat oxiriga qo'shiladi, eski qadamlar o'zgartirilmaydi
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Cursor], None]]] = [
+    (1, "base_tables", _m001_base_tables),
+    (2, "reconcile_manual_points", _m002_reconcile_manual_points),
+    (3, "user_balances", _m003_user_balances),
+    (4, "hot_path_indexes", _m004_hot_path_indexes),
+    (5, "service_request_idempotency", _m005_service_request_idempotency),
+    (6, "export_watermarks", _m006_export_watermarks),
+    (7, "broadcast_jobs", _m007_broadcast_jobs),
+    (8, "broadcast_segment", _m008_broadcast_segment),
+    (9, "user_deliverability", _m009_user_deliverability),
+    (10, "channel_members", _m010_channel_members),
+    (11, "outbox", _m011_outbox),
+    (12, "conversations", _m012_conversations),
+    (13, "broadcast_lease", _m013_broadcast_lease),
+]
+
+
+def _current_version(cur: sqlite3.Cursor) -> int:
+    cur.execute("SELECT COALESCE(MAX(version), 0) AS v FROM schema_version")
+    return cur.fetchone()["v"]
+
+
+def run_migrations() -> int:
+    """
+    Startupda bir marta chaqiriladi. Har bir migratsiya alohida
+    BEGIN IMMEDIATE tranzaksiyada – bir nechta jarayon bir vaqtda ishga
+    tushsa ham qadam ikki marta bajarilmaydi. Joriy versiyani qaytaradi.
+    """
+    configure_database()
+
+    conn = get_connection()
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TEXT
+        )
+        """
+    )
+
+    for version, name, migrate in MIGRATIONS:
+        with transaction(immediate=True) as cur:
+            if _current_version(cur) >= version:
+                continue
+            migrate(cur)
+            cur.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, datetime.utcnow().isoformat()),
+            )
+        logger.info("DB migratsiya qo'llandi: %s (%s)", version, name)
+
+    _sync_bonus_config()
+
+    return _current_version(conn.cursor())
+
+
+def _sync_bonus_config():
+    """
+    REFERRAL_BONUS_LEVEL2 triggerlarga yozilgan qiymatdan farq qilsa –
+    triggerlar va total_points qayta hisoblanadi.
+    """
+    row = get_connection().execute(
+        "SELECT value FROM app_meta WHERE key = 'level2_bonus_ppm'"
+    ).fetchone()
+    if row is None or row["value"] != bonus_ppm():
+        logger.info("Level2 bonus o'zgargan – user_balances qayta hisoblanmoqda")
+        rebuild_user_balances()
@@ -0,0 +1,231 @@
+# outbox.py
+# Muhim xabarlar (adminlarga bildirishnoma, mukofot yetkazish) to'g'ridan-to'g'ri
+# yuborilmaydi – outbox jadvaliga yoziladi va sender workerlar yuboradi:
+#   - har bir chat ichida FIFO (claim_outbox_batch chat boshini oladi)
+#   - umumiy token bucket + bitta chatga OUTBOX_PER_CHAT_INTERVAL
+#   - 429 da retry_after kutiladi (urinish hisoblanmaydi)
+#   - 403 / chat not found – darhol dead + user undeliverable
+#   - boshqa xatolar – eksponensial kutish, OUTBOX_MAX_ATTEMPTS dan keyin dead
+# Jarayon o'lsa ham xabar yo'qolmaydi: restartda 'sending' lar qayta navbatga.
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException
+
+from config import (
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_PER_CHAT_INTERVAL,
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_RATE_PER_SEC,
+    OUTBOX_WORKERS,
+)
+from database import (
+    claim_outbox_batch,
+    enqueue_outbox,
+    finish_outbox,
+    get_next_outbox_attempt,
+    is_deliverable,
+    mark_undeliverable,
+    requeue_stuck_outbox,
+)
+from utils import TokenBucket, is_unreachable_error, retry_after_seconds
+
+
+logger = logging.getLogger(__name__)
+
+# qo'llab-quvvatlanadigan metodlar (payload – shu metodning kwargs lari)
+METHODS = ("send_message", "edit_message_text")
+
+# navbatga yangi xabar tushganda sender darhol uyg'onadi
+_wakeup = threading.Event()
+
+
+def _markup_json(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    markup = kwargs.get("reply_markup")
+    if markup is not None and hasattr(markup, "to_json"):
+        kwargs = dict(kwargs, reply_markup=markup.to_json())
+    return kwargs
+
+
+def enqueue_message(chat_id: int, text: str, **kwargs) -> Optional[int]:
+    """
+    send_message ni navbatga qo'yadi va darhol qaytadi. Botni bloklagan
+    userga yozilmaydi (None). kwargs – send_message parametrlari.
+    """
+    if not is_deliverable(chat_id):
+        return None
+    kwargs.setdefault("parse_mode", None)
+    payload = dict(_markup_json(kwargs), chat_id=chat_id, text=text)
+    outbox_id = enqueue_outbox(chat_id, "send_message", payload)
+    _wakeup.set()
+    return outbox_id
+
+
+def enqueue_edit(chat_id: int, message_id: int, text: str, **kwargs) -> int:
+    """edit_message_text ni navbatga qo'yadi (shu chatning oldingi xabarlaridan keyin)."""
+    payload = dict(_markup_json(kwargs), chat_id=chat_id, message_id=message_id, text=text)
+    outbox_id = enqueue_outbox(chat_id, "edit_message_text", payload)
+    _wakeup.set()
+    return outbox_id
+
+
+class OutboxSender:
+    """
+    Bitta dispatcher thread navbatdan xabarlarni oladi va worker pool ga
+    beradi. Bir chatning bir vaqtda faqat bitta xabari "sending" da bo'ladi,
+    shuning uchun per-chat interval worker ichida oddiy kutish bilan bajariladi.
+    """
+
+    def __init__(self, bot: TeleBot):
+        self.bot = bot
+        self.bucket = TokenBucket(OUTBOX_RATE_PER_SEC)
+        self.pool = ThreadPoolExecutor(max_workers=OUTBOX_WORKERS, thread_name_prefix="outbox")
+        self._last_sent: Dict[int, float] = {}
+        self._last_sent_lock = threading.Lock()
+        self._in_flight = threading.Semaphore(OUTBOX_WORKERS * 2)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------------------------------------
+    # Boshqaruv
+    # ---------------------------------------
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        restored = requeue_stuck_outbox()
+        if restored:
+            logger.info("Outbox: %s ta xabar qayta navbatga qo'yildi", restored)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Yangi xabar olmaydi; yuborilayotganlarini tugatadi (qolganlari bazada)."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        _wakeup.set()
+        self._thread.join(timeout)
+        self._thread = None
+        self.pool.shutdown(wait=True)
+
+    # ---------------------------------------
+    # Dispatcher
+    # ---------------------------------------
+    def _sleep_until_next(self):
+        next_at = get_next_outbox_attempt()
+        wait = OUTBOX_POLL_INTERVAL
+        if next_at is not None:
+            wait = min(wait, max(next_at - time.time(), 0.0))
+        _wakeup.wait(wait)
+        _wakeup.clear()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                batch = claim_outbox_batch(time.time(), OUTBOX_BATCH_SIZE)
+            except Exception:
+                logger.exception("Outbox: navbatni o'qib bo'lmadi")
+                batch = []
+
+            if not batch:
+                self._sleep_until_next()
+                continue
+
+            for item in batch:
+                self._in_flight.acquire()
+                self.pool.submit(self._deliver_safe, item)
+
+    # ---------------------------------------
+    # Yuborish
+    # ---------------------------------------
+    def _wait_chat_interval(self, chat_id: int):
+        with self._last_sent_lock:
+            last = self._last_sent.get(chat_id, 0.0)
+        wait = last + OUTBOX_PER_CHAT_INTERVAL - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def _mark_sent(self, chat_id: int):
+        now = time.monotonic()
+        with self._last_sent_lock:
+            self._last_sent[chat_id] = now
+            if len(self._last_sent) > 10000:
+                # interval o'tganlar endi kerak emas
+                self._last_sent = {
+                    cid: t for cid, t in self._last_sent.items()
+                    if now - t < OUTBOX_PER_CHAT_INTERVAL
+                }
+
+    def _deliver_safe(self, item: Dict[str, Any]):
+        try:
+            self._deliver(item)
+        except Exception:
+            logger.exception("Outbox #%s: kutilmagan xato", item["id"])
+            finish_outbox(item["id"], "pending", item["attempts"] + 1, time.time() + 5)
+        finally:
+            self._in_flight.release()
+            # shu chatning keyingi xabari endi olinishi mumkin
+            _wakeup.set()
+
+    def _deliver(self, item: Dict[str, Any]):
+        chat_id = item["chat_id"]
+        attempts = item["attempts"] + 1
+
+        if item["method"] not in METHODS:
+            finish_outbox(item["id"], "dead", attempts, error=f"Noma'lum metod: {item['method']}")
+            return
+
+        self._wait_chat_interval(chat_id)
+        self.bucket.acquire()
+        try:
+            getattr(self.bot, item["method"])(**item["payload"])
+        except ApiTelegramException as exc:
+            wait = retry_after_seconds(exc)
+            if wait is not None:
+                # Telegram hammani kutishni so'radi – urinish hisoblanmaydi
+                self.bucket.pause(wait)
+                finish_outbox(item["id"], "pending", item["attempts"], time.time() + wait, str(exc))
+                return
+            if "message is not modified" in str(exc):
+                finish_outbox(item["id"], "sent", attempts)
+                return
+            if is_unreachable_error(exc):
+                mark_undeliverable([chat_id])
+                finish_outbox(item["id"], "dead", attempts, error=str(exc))
+                return
+            self._fail(item, attempts, exc)
+            return
+        except Exception as exc:
+            # tarmoq xatosi
+            self._fail(item, attempts, exc)
+            return
+        finally:
+            self._mark_sent(chat_id)
+
+        finish_outbox(item["id"], "sent", attempts)
+
+    def _fail(self, item: Dict[str, Any], attempts: int, exc: Exception):
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            logger.error("Outbox #%s dead (%s ta urinish): %s", item["id"], attempts, exc)
+            finish_outbox(item["id"], "dead", attempts, error=str(exc))
+            return
+        finish_outbox(item["id"], "pending", attempts, time.time() + 2 ** attempts, str(exc))
+
+
+_sender: Optional[OutboxSender] = None
+_sender_lock = threading.Lock()
+
+
+def get_outbox_sender(bot: TeleBot) -> OutboxSender:
+    global _sender
+    with _sender_lock:
+        if _sender is None:
+            _sender = OutboxSender(bot)
+        return _sender
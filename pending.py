@@ -1,10 +1,13 @@
 # pending.py
 # Pending so'rovlar bilan ishlash: ro'yxatni ko'rsatish + yangi so'rovda adminni ogohlantirish
 
+from typing import Optional
+
 from telebot import TeleBot
 
 from config import ADMIN_IDS, SERVICES
 from database import get_pending_requests, get_user, get_referral_stats
+from outbox import enqueue_message
 
 
 def _format_single_request_plain(req: dict) -> str:
@@ -65,13 +68,22 @@ def send_pending_list_to_admin(bot: TeleBot, chat_id: int):
         bot.send_message(chat_id, text)
 
 
-def notify_admins_new_request(bot: TeleBot, user_id: int, service_key: str):
+def notify_admins_new_request(
+    bot: TeleBot,
+    user_id: int,
+    service_key: str,
+    user: Optional[dict] = None,
+    stats: Optional[dict] = None,
+):
     """
     Foydalanuvchi xizmatga ariza yuborgan zahoti barcha ADMINlarga DM qilib xabar yuborish.
-    Buni service tanlash joyidan chaqiramiz.
+    Buni service tanlash joyidan chaqiramiz. user / stats (total_points,
+    available_points) chaqiruvchida bor bo'lsa uzatiladi – DB ga qayta bormaymiz.
     """
-    user = get_user(user_id)
-    stats = get_referral_stats(user_id)
+    if user is None:
+        user = get_user(user_id) or {}
+    if stats is None:
+        stats = get_referral_stats(user_id)
 
     username = user.get("username") or "—"
     first_name = user.get("first_name") or ""
@@ -96,8 +108,6 @@ def notify_admins_new_request(bot: TeleBot, user_id: int, service_key: str):
 
     text = "\n".join(lines)
 
+    # outbox orqali – vaqtinchalik xatoda qayta uriniladi, yo'qolmaydi
     for aid in ADMIN_IDS:
-        try:
-            bot.send_message(aid, text)
-        except Exception:
-            continue
+        enqueue_message(aid, text)
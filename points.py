@@ -1,44 +1,26 @@
 # points.py
 # /givepoint komandasi: admin userga qo'lda ball berishi uchun modul
 
-import sqlite3
 from typing import Optional
 
 from telebot import TeleBot, types
 
-from config import ADMIN_IDS, DB_PATH
-from database import get_referral_stats
+from config import ADMIN_IDS
+from conversations import set_state
+from router import get_message_router
+from database import (
+    add_manual_points as db_add_manual_points,
+    get_connection,
+    get_referral_stats,
+    transaction,
+    writes,
+)
 
 
 # =========================
 # DB HELPER FUNKSIYALAR
 # =========================
 
-def _get_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-
-def _ensure_manual_points_table(cur: sqlite3.Cursor):
-    """
-    manual_points jadvali borligini kafolatlaymiz.
-    STRUKTURA:
-      id, user_id, points, reason, created_at
-    """
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS manual_points (
-            id          INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id     INTEGER NOT NULL,
-            points      INTEGER NOT NULL,
-            reason      TEXT,
-            created_at  TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """
-    )
-
-
 def find_user_by_username_or_id(identifier: str) -> Optional[dict]:
     """
     identifier: '@username', 'username' yoki '123456789' (ID) bo'lishi mumkin.
@@ -55,8 +37,7 @@ def find_user_by_username_or_id(identifier: str) -> Optional[dict]:
     if text.startswith("@"):
         text = text[1:].strip()
 
-    conn = _get_connection()
-    cur = conn.cursor()
+    cur = get_connection().cursor()
 
     user_row = None
 
@@ -74,62 +55,36 @@ def find_user_by_username_or_id(identifier: str) -> Optional[dict]:
         )
         user_row = cur.fetchone()
 
-    conn.close()
-
     if user_row is None:
         return None
     return dict(user_row)
 
 
-def add_manual_points(user_id: int, points: int, reason: str):
+@writes
+def add_manual_points(user_id: int, points: int, reason: str, admin_id: Optional[int] = None):
     """
-    userga qo'lda ball qo'shamiz:
+    userga qo'lda ball qo'shamiz (bitta tranzaksiyada):
       1) manual_points log jadvaliga yozamiz
-      2) users jadvalidagi extra_points ustuniga qo'shamiz (agar bo'lmasa, ustunni yaratamiz)
+      2) users jadvalidagi extra_points ustuniga qo'shamiz
+    Jadval/ustunlar migrations.py da yaratiladi.
     """
-    conn = _get_connection()
-    cur = conn.cursor()
+    with transaction() as cur:
+        db_add_manual_points(user_id, points, reason, admin_id)
 
-    # 1) log jadvali (yo'q bo'lsa — yaratamiz)
-    _ensure_manual_points_table(cur)
-
-    cur.execute(
-        "INSERT INTO manual_points (user_id, points, reason) VALUES (?, ?, ?)",
-        (user_id, points, reason),
-    )
-
-    # 2) users jadvalida extra_points ustuni bo'lmasa – qo'shamiz
-    try:
-        cur.execute("ALTER TABLE users ADD COLUMN extra_points INTEGER DEFAULT 0")
-    except sqlite3.OperationalError:
-        # ustun allaqachon mavjud bo'lsa, xato chiqadi – e'tibor bermaymiz
-        pass
-
-    cur.execute(
-        "UPDATE users SET extra_points = COALESCE(extra_points, 0) + ? WHERE user_id = ?",
-        (points, user_id),
-    )
-
-    conn.commit()
-    conn.close()
+        cur.execute(
+            "UPDATE users SET extra_points = COALESCE(extra_points, 0) + ? WHERE user_id = ?",
+            (points, user_id),
+        )
 
 
 def get_manual_points_sum(user_id: int) -> int:
     """
     manual_points jadvalidan user uchun jami berilgan qo'shimcha ballni qaytaradi.
-    Jadval bo'lmasa – avval yaratib olamiz.
     """
-    conn = _get_connection()
-    cur = conn.cursor()
-
-    _ensure_manual_points_table(cur)
-
-    cur.execute(
+    row = get_connection().execute(
         "SELECT COALESCE(SUM(points), 0) AS total FROM manual_points WHERE user_id = ?",
         (user_id,),
-    )
-    row = cur.fetchone()
-    conn.close()
+    ).fetchone()
 
     if row is None:
         return 0
@@ -147,9 +102,10 @@ def register_points_handlers(bot: TeleBot):
         ...
         register_points_handlers(bot)
     """
+    router = get_message_router(bot)
 
     # 1-QADAM: /givepoint komandasi
-    @bot.message_handler(commands=["givepoint"])
+    @router.command("givepoint")
     def givepoint_start(message: types.Message):
         admin = message.from_user
         chat_id = message.chat.id
@@ -158,31 +114,28 @@ def register_points_handlers(bot: TeleBot):
             bot.reply_to(message, "Bu komanda faqat adminlar uchun.")
             return
 
-        msg = bot.send_message(
+        bot.send_message(
             chat_id,
             "Kimga ball yuborasiz?\n"
             "Username yoki ID ni kiriting (masalan: @username yoki 123456789).",
             parse_mode="HTML",
         )
-        bot.register_next_step_handler(msg, givepoint_get_user)
+        set_state(chat_id, admin.id, "givepoint:user")
 
-    # 2-QADAM: Userni tanlash
-    def givepoint_get_user(message: types.Message):
+    # 2-QADAM: Userni tanlash (qadamlar admin=True – boshqalarga umuman kelmaydi)
+    @router.step("givepoint:user", admin=True)
+    def givepoint_get_user(message: types.Message, data: dict):
         admin = message.from_user
         chat_id = message.chat.id
         text = (message.text or "").strip()
 
-        if admin.id not in ADMIN_IDS:
-            bot.reply_to(message, "Siz admin emassiz.")
-            return
-
         if not text:
-            msg = bot.send_message(
+            bot.send_message(
                 chat_id,
                 "Matn topilmadi. Qaytadan kiriting: @username yoki ID.",
                 parse_mode="HTML",
             )
-            bot.register_next_step_handler(msg, givepoint_get_user)
+            set_state(chat_id, admin.id, "givepoint:user")
             return
 
         user_data = find_user_by_username_or_id(text)
@@ -216,60 +169,57 @@ def register_points_handlers(bot: TeleBot):
             "Necha ball yubormoqchisiz? (faqat son yozing, masalan: 7)"
         )
 
-        msg = bot.send_message(
+        bot.send_message(
             chat_id,
             text_info,
             parse_mode="HTML",
         )
-        bot.register_next_step_handler(msg, givepoint_get_points, user_data)
+        set_state(chat_id, admin.id, "givepoint:points", user=user_data)
 
     # 3-QADAM: Ball miqdori
-    def givepoint_get_points(message: types.Message, user_data: dict):
+    @router.step("givepoint:points", admin=True)
+    def givepoint_get_points(message: types.Message, data: dict):
         admin = message.from_user
         chat_id = message.chat.id
         text = (message.text or "").strip()
-
-        if admin.id not in ADMIN_IDS:
-            bot.reply_to(message, "Siz admin emassiz.")
-            return
+        user_data = data["user"]
 
         if not text.lstrip("-").isdigit():
-            msg = bot.send_message(
+            bot.send_message(
                 chat_id,
                 "Noto'g'ri format. Faqat butun son kiriting (masalan: 7).\n"
                 "Qaytadan miqdor kiriting:",
                 parse_mode="HTML",
             )
-            bot.register_next_step_handler(msg, givepoint_get_points, user_data)
+            set_state(chat_id, admin.id, "givepoint:points", user=user_data)
             return
 
         points = int(text)
         if points == 0:
-            msg = bot.send_message(
+            bot.send_message(
                 chat_id,
                 "Ball miqdori 0 bo'lishi mumkin emas.\n"
                 "Qaytadan miqdor kiriting:",
                 parse_mode="HTML",
             )
-            bot.register_next_step_handler(msg, givepoint_get_points, user_data)
+            set_state(chat_id, admin.id, "givepoint:points", user=user_data)
             return
 
-        msg = bot.send_message(
+        bot.send_message(
             chat_id,
             "Izoh yozing (masalan: \"Konkurs g'olibi\" yoki \"Faol ishtirokchi\").",
             parse_mode="HTML",
         )
-        bot.register_next_step_handler(msg, givepoint_get_reason, user_data, points)
+        set_state(chat_id, admin.id, "givepoint:reason", user=user_data, points=points)
 
     # 4-QADAM: Izoh + DBga yozish
-    def givepoint_get_reason(message: types.Message, user_data: dict, points: int):
+    @router.step("givepoint:reason", admin=True)
+    def givepoint_get_reason(message: types.Message, data: dict):
         admin = message.from_user
         chat_id = message.chat.id
         reason = (message.text or "").strip()
-
-        if admin.id not in ADMIN_IDS:
-            bot.reply_to(message, "Siz admin emassiz.")
-            return
+        user_data = data["user"]
+        points = data["points"]
 
         if not reason:
             reason = "Admin bonus ball"
@@ -277,7 +227,7 @@ def register_points_handlers(bot: TeleBot):
         target_id = user_data["user_id"]
         username = user_data.get("username") or "-"
 
-        add_manual_points(target_id, points, reason)
+        add_manual_points(target_id, points, reason, admin.id)
 
         manual_sum = get_manual_points_sum(target_id)
         stats = get_referral_stats(target_id)
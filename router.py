@@ -0,0 +1,440 @@
+# router.py
+# Xabarlarni bitta TeleBot handler orqali dict bo'yicha yo'naltirish:
+# tugma matni / komanda -> handler. Har bir update uchun narx tugmalar
+# soniga bog'liq emas (lambda zanjiri o'rniga bitta dict lookup).
+#
+# Ishlatish:
+#     router = get_message_router(bot)
+#
+#     @router.text("📊 Balans")
+#     def handle_balance(message): ...
+#
+#     @router.command("export", admin=True)
+#     def admin_export_cmd(message): ...
+#
+#     @router.text("🏆 Top", expensive=True)   # navbat chuqur bo'lsa birinchi rad etiladi
+#     def handle_top(message): ...
+#
+# Har bir update handlerdan oldin antiflood.FloodGuard dan o'tadi
+# (dublikat, per-user limit, global slotlar) – adminlar ozod.
+#
+# Ko'p bosqichli dialoglar – @router.step(state): chat conversations.set_state
+# bilan shu holatga o'tkazilgan bo'lsa, keyingi matn (komanda bo'lsa ham)
+# tugma / komanda route laridan OLDIN shu handlerga boradi.
+#
+# Inline tugmalar uchun CallbackRouter – callback_data.CallbackData yo'llari
+# bo'yicha prefiks daraxti; har bir callback bitta parse + bitta handler:
+#
+#     callbacks = get_callback_router(bot)
+#
+#     @callbacks.route(SERVICE)
+#     def handle_service_choice(call, data): ...   # data == {"key": "canva"}
+#
+# AsyncTeleBot uchun ham xuddi shu routerlar ishlatiladi – handlerlar
+# "async def" bo'ladi, o'rnatish install_async orqali (getterlar botning
+# turiga qarab o'zi tanlaydi).
+
+import inspect
+import threading
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple
+
+from telebot import TeleBot, types
+
+import callback_data
+from async_db import run_db
+from antiflood import ALLOWED, EXEMPT, REJECTIONS, FloodGuard, get_flood_guard
+from callback_data import CallbackData
+from config import ADMIN_IDS
+from conversations import clear_state, get_state
+
+
+Handler = Callable[[types.Message], None]
+StepHandler = Callable[[types.Message, Dict[str, Any]], None]
+CallbackHandler = Callable[[types.CallbackQuery, Dict[str, Any]], None]
+
+
+def is_async_bot(bot) -> bool:
+    """AsyncTeleBot (yoki uning o'rnini bosuvchi) – API metodlari coroutine."""
+    return inspect.iscoroutinefunction(getattr(bot, "send_message", None))
+
+
+# _matches() topgan handler shu atribut orqali route handlerga uzatiladi
+_ROUTE_ATTR = "_sellory_route"
+
+
+def parse_command(text: str) -> Optional[str]:
+    """'/export@SelloriyBot delta' -> 'export'. Komanda bo'lmasa None."""
+    if not text.startswith("/"):
+        return None
+    parts = text[1:].split(maxsplit=1)
+    if not parts:
+        return None
+    return parts[0].split("@", 1)[0].lower()
+
+
+class MessageRouter:
+    """
+    Ikki jadval: umumiy va admin. Admin yozganda avval admin jadvali,
+    keyin umumiy jadval; oddiy user admin jadvalini umuman ko'rmaydi.
+    Bitta kalitni bir jadvalga ikki marta qo'shish – xato (registratsiya
+    tartibiga bog'liq "kim yutadi" holati bo'lmasin).
+    """
+
+    def __init__(self, admin_ids: Iterable[int] = ADMIN_IDS):
+        self.admin_ids = frozenset(admin_ids)
+        self._texts: Dict[str, Handler] = {}
+        self._commands: Dict[str, Handler] = {}
+        self._admin_texts: Dict[str, Handler] = {}
+        self._admin_commands: Dict[str, Handler] = {}
+        self._steps: Dict[str, StepHandler] = {}
+        self._admin_steps: Dict[str, StepHandler] = {}
+        # og'ir tugma matnlari / komandalar (load shedding uchun)
+        self._expensive_texts: Set[str] = set()
+        self._expensive_commands: Set[str] = set()
+        self.guard: Optional[FloodGuard] = None
+        # AsyncTeleBot: dialog qadamlari boshqa (sinxron) routerda bo'lsa –
+        # (o'sha router, xabarni unga uzatuvchi coroutine), delegate_steps()
+        self._step_delegate: Optional[Tuple["MessageRouter", Callable[[types.Message], Awaitable[None]]]] = None
+
+    # ---------------------------------------
+    # Ro'yxatdan o'tkazish
+    # ---------------------------------------
+    def _add(self, table: Dict[str, Handler], keys: Iterable[str], handler: Handler):
+        for key in keys:
+            if key in table:
+                raise ValueError(f"Route allaqachon bor: {key!r} ({table[key].__name__})")
+            table[key] = handler
+
+    def text(self, *texts: str, admin: bool = False, expensive: bool = False):
+        """Reply-keyboard tugmasi (xabar matni aynan teng bo'lishi kerak)."""
+        def decorator(handler: Handler) -> Handler:
+            self._add(self._admin_texts if admin else self._texts, texts, handler)
+            if expensive:
+                self._expensive_texts.update(texts)
+            return handler
+        return decorator
+
+    def command(self, *commands: str, admin: bool = False, expensive: bool = False):
+        """
+        /komanda. '/approve_123' ko'rinishidagi komandalar ham 'approve'
+        ga tushadi (agar 'approve_123' alohida ro'yxatdan o'tmagan bo'lsa) –
+        handler '_' dan keyingi qismni argument sifatida o'qishi kerak.
+        """
+        def decorator(handler: Handler) -> Handler:
+            self._add(
+                self._admin_commands if admin else self._commands,
+                [c.lower() for c in commands],
+                handler,
+            )
+            if expensive:
+                self._expensive_commands.update(c.lower() for c in commands)
+            return handler
+        return decorator
+
+    def step(self, *states: str, admin: bool = False):
+        """Dialog qadami: handler(message, data) – data set_state ga berilgan kwargs."""
+        def decorator(handler: StepHandler) -> StepHandler:
+            self._add(self._admin_steps if admin else self._steps, states, handler)
+            return handler
+        return decorator
+
+    def delegate_steps(self, router: "MessageRouter", forward: Callable[[types.Message], Awaitable[None]]):
+        """
+        install_async uchun: chatda ochiq dialog bo'lsa (router da shu user
+        uchun qadamlar bor bo'lsa), xabar tugma / komandaga mos kelsa ham
+        forward(message) orqali o'sha routerga uzatiladi.
+        """
+        self._step_delegate = (router, forward)
+
+    # ---------------------------------------
+    # Yo'naltirish
+    # ---------------------------------------
+    def is_admin(self, message: types.Message) -> bool:
+        return message.from_user is not None and message.from_user.id in self.admin_ids
+
+    def has_steps(self, is_admin: bool) -> bool:
+        return bool(self._steps) or (is_admin and bool(self._admin_steps))
+
+    def _resolve_step(self, message: types.Message, is_admin: bool) -> Optional[Handler]:
+        # dialog qadamlari bo'lmasa (yoki faqat admin qadamlari bo'lib, yozgan
+        # admin bo'lmasa) bazaga umuman murojaat qilinmaydi
+        if not self.has_steps(is_admin):
+            return None
+
+        conversation = get_state(message.chat.id)
+        if conversation is None:
+            return None
+
+        handler = self._admin_steps.get(conversation["state"]) if is_admin else None
+        if handler is None:
+            handler = self._steps.get(conversation["state"])
+        if handler is None:
+            return None
+
+        data = conversation["data"]
+
+        def run_step(msg: types.Message):
+            clear_state(msg.chat.id)
+            return handler(msg, data)
+
+        run_step.__name__ = handler.__name__
+        return run_step
+
+    def _lookup_command(self, table: Dict[str, Handler], command: str) -> Optional[Handler]:
+        handler = table.get(command)
+        if handler is None and "_" in command:
+            handler = table.get(command.split("_", 1)[0])
+        return handler
+
+    def resolve(self, message: types.Message) -> Optional[Handler]:
+        text = message.text
+        if not text:
+            return None
+
+        is_admin = self.is_admin(message)
+
+        handler = self._resolve_step(message, is_admin)
+        if handler is not None:
+            return handler
+
+        command = parse_command(text)
+
+        if command is not None:
+            if is_admin:
+                handler = self._lookup_command(self._admin_commands, command)
+                if handler is not None:
+                    return handler
+            return self._lookup_command(self._commands, command)
+
+        if is_admin:
+            handler = self._admin_texts.get(text)
+            if handler is not None:
+                return handler
+        return self._texts.get(text)
+
+    def dispatch(self, message: types.Message) -> bool:
+        """Guard siz to'g'ridan-to'g'ri chaqirish."""
+        handler = self.resolve(message)
+        if handler is None:
+            return False
+        handler(message)
+        return True
+
+    def is_expensive(self, text: str) -> bool:
+        if text in self._expensive_texts:
+            return True
+        command = parse_command(text)
+        return command is not None and command in self._expensive_commands
+
+    def admit(self, message: types.Message, wait: bool = True) -> str:
+        """FloodGuard qarori (guard yo'q bo'lsa – EXEMPT)."""
+        if self.guard is None or message.from_user is None:
+            return EXEMPT
+        return self.guard.admit(
+            message.from_user.id, message.text, self.is_expensive(message.text), wait
+        )
+
+    def _matches(self, message: types.Message) -> bool:
+        """
+        Handler filtri. Natija xabarga yozib qo'yiladi – route handler
+        resolve() ni (admin uchun conversations so'rovini) qayta chaqirmaydi.
+        Catch-all emas: mos kelmagan xabar keyingi handlerlarga (masalan,
+        async_main dagi sinxron botga ko'prik) o'tadi.
+        """
+        handler = self.resolve(message)
+        setattr(message, _ROUTE_ATTR, handler)
+        return handler is not None
+
+    def install(self, bot: TeleBot):
+        """Botga bitta message handler qo'shadi – routega mos kelmagan xabarlar e'tiborsiz qoladi."""
+
+        @bot.message_handler(func=self._matches, content_types=["text"])
+        def route_message(message: types.Message):
+            handler = getattr(message, _ROUTE_ATTR, None)
+            if handler is None:
+                return
+            verdict = self.admit(message)
+            if verdict in REJECTIONS:
+                text = self.guard.reply_text(message.from_user.id, verdict)
+                if text:
+                    bot.send_message(message.chat.id, text, parse_mode=None)
+                return
+            try:
+                handler(message)
+            finally:
+                if verdict == ALLOWED:
+                    self.guard.release()
+
+    async def _step_open(self, message: types.Message) -> bool:
+        """Xabar delegate_steps() dagi routerning ochiq dialogiga tegishlimi."""
+        if self._step_delegate is None:
+            return False
+        if not self._step_delegate[0].has_steps(self.is_admin(message)):
+            return False
+        return await run_db(get_state, message.chat.id) is not None
+
+    def install_async(self, bot):
+        """install() ning AsyncTeleBot varianti: handlerlar coroutine, await qilinadi."""
+
+        @bot.message_handler(func=self._matches, content_types=["text"])
+        async def route_message(message: types.Message):
+            handler = getattr(message, _ROUTE_ATTR, None)
+            if handler is None:
+                return
+            if await self._step_open(message):
+                await self._step_delegate[1](message)
+                return
+            # event loop ni bloklamaslik uchun slot kutilmaydi
+            verdict = self.admit(message, wait=False)
+            if verdict in REJECTIONS:
+                text = self.guard.reply_text(message.from_user.id, verdict)
+                if text:
+                    await bot.send_message(message.chat.id, text, parse_mode=None)
+                return
+            try:
+                await handler(message)
+            finally:
+                if verdict == ALLOWED:
+                    self.guard.release()
+
+
+_routers: Dict[int, MessageRouter] = {}
+_routers_lock = threading.Lock()
+
+
+def get_message_router(bot: TeleBot) -> MessageRouter:
+    """Har bir bot uchun bitta router; birinchi chaqiruvda botga o'rnatiladi."""
+    with _routers_lock:
+        router = _routers.get(id(bot))
+        if router is None:
+            router = MessageRouter()
+            router.guard = get_flood_guard(bot, asynchronous=is_async_bot(bot))
+            if is_async_bot(bot):
+                router.install_async(bot)
+            else:
+                router.install(bot)
+            _routers[id(bot)] = router
+        return router
+
+
+# ---------------------------------------
+# Inline callback lar
+# ---------------------------------------
+class _Node:
+    __slots__ = ("children", "spec", "handler")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.spec: Optional[CallbackData] = None
+        self.handler: Optional[CallbackHandler] = None
+
+
+class CallbackRouter:
+    """
+    Prefiks daraxti: har bir tugun – callback yo'lining bitta qismi
+    ("service", keyin maydonlar). Eng uzun mos yo'l tanlanadi; maydonlar
+    soni yoki turi mos kelmasa – route topilmadi. Bitta yo'lni ikki marta
+    ro'yxatdan o'tkazish – xato.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._expensive: Set[CallbackHandler] = set()
+        self.guard: Optional[FloodGuard] = None
+
+    def route(self, spec: CallbackData, expensive: bool = False):
+        def decorator(handler: CallbackHandler) -> CallbackHandler:
+            node = self._root
+            for part in spec.path:
+                node = node.children.setdefault(part, _Node())
+            if node.handler is not None:
+                raise ValueError(f"Callback route allaqachon bor: {spec!r} ({node.handler.__name__})")
+            node.spec = spec
+            node.handler = handler
+            if expensive:
+                self._expensive.add(handler)
+            return handler
+        return decorator
+
+    def resolve(self, data: str) -> Optional[Tuple[CallbackHandler, Dict[str, Any]]]:
+        parts = callback_data.split(data or "")
+        node = self._root
+        found = None
+        for depth, part in enumerate(parts, start=1):
+            node = node.children.get(part)
+            if node is None:
+                break
+            if node.handler is not None and len(parts) - depth == len(node.spec.fields):
+                found = (node, parts[depth:])
+
+        if found is None:
+            return None
+        node, args = found
+        try:
+            return node.handler, node.spec.parse_args(args)
+        except ValueError:
+            return None
+
+    def admit(self, call: types.CallbackQuery, handler: CallbackHandler, wait: bool = True) -> str:
+        if self.guard is None or call.from_user is None:
+            return EXEMPT
+        return self.guard.admit(call.from_user.id, call.data, handler in self._expensive, wait)
+
+    def install(self, bot: TeleBot):
+        """Botga bitta callback handler – noma'lum callback faqat "soat" belgisini o'chiradi."""
+
+        @bot.callback_query_handler(func=lambda c: True)
+        def route_callback(call: types.CallbackQuery):
+            resolved = self.resolve(call.data)
+            if resolved is None:
+                bot.answer_callback_query(call.id)
+                return
+            handler, data = resolved
+            verdict = self.admit(call, handler)
+            if verdict in REJECTIONS:
+                # spinner to'xtashi uchun har doim javob beramiz
+                bot.answer_callback_query(call.id, self.guard.reply_text(call.from_user.id, verdict))
+                return
+            try:
+                handler(call, data)
+            finally:
+                if verdict == ALLOWED:
+                    self.guard.release()
+
+    def install_async(self, bot):
+        """install() ning AsyncTeleBot varianti."""
+
+        @bot.callback_query_handler(func=lambda c: True)
+        async def route_callback(call: types.CallbackQuery):
+            resolved = self.resolve(call.data)
+            if resolved is None:
+                await bot.answer_callback_query(call.id)
+                return
+            handler, data = resolved
+            verdict = self.admit(call, handler, wait=False)
+            if verdict in REJECTIONS:
+                await bot.answer_callback_query(call.id, self.guard.reply_text(call.from_user.id, verdict))
+                return
+            try:
+                await handler(call, data)
+            finally:
+                if verdict == ALLOWED:
+                    self.guard.release()
+
+
+_callback_routers: Dict[int, CallbackRouter] = {}
+
+
+def get_callback_router(bot: TeleBot) -> CallbackRouter:
+    """Har bir bot uchun bitta callback router; birinchi chaqiruvda botga o'rnatiladi."""
+    with _routers_lock:
+        router = _callback_routers.get(id(bot))
+        if router is None:
+            router = CallbackRouter()
+            router.guard = get_flood_guard(bot, asynchronous=is_async_bot(bot))
+            if is_async_bot(bot):
+                router.install_async(bot)
+            else:
+                router.install(bot)
+            _callback_routers[id(bot)] = router
+        return router
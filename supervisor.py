@@ -0,0 +1,420 @@
+# supervisor.py
+# Ko'p jarayonli rejim: supervisor update larni long polling bilan oladi va
+# har birini user_id % N bo'yicha tanlangan worker jarayonga beradi. Bitta
+# userning barcha update lari doim bitta workerga, u yerda esa ketma-ket
+# bajariladi – shuning uchun bitta userning xabarlari (jumladan dialog
+# qadamlari: /givepoint, broadcast matni va h.k.) kelgan tartibda bajariladi.
+# Dialog holati SQLite da (conversations.py) – worker qayta tug'ilsa ham davom etadi.
+#
+#     python main.py --mode supervisor      # yoki: python supervisor.py
+#
+# Workerlar sellory.db ni WAL orqali bo'lishadi (har birida o'z
+# DatabaseWriter i; yozuvlar busy_timeout bilan navbatlashadi). Outbox
+# sender faqat worker 0 da – ikki jarayon bitta outbox qatorini qayta
+# navbatga qo'ymasligi uchun. Broadcast vazifasini esa DB dagi lease egasi
+# yurgizadi: har bir worker watchdog i egasi o'lgan vazifani davom ettiradi.
+#
+# Supervisor va worker orasida Pipe: supervisor bitta update yuboradi,
+# worker uni bajarib metrikalari bilan javob qaytaradi, keyin navbatdagisi.
+# Navbatlar supervisor xotirasida – qulagan worker qayta ishga tushirilganda
+# kutayotgan update lar yo'qolmaydi. Qulash paytida bajarilayotgan update
+# qayta yuborilmaydi (workerni aynan u yiqitgan bo'lishi mumkin).
+# multiprocessing.Queue ishlatilmaydi: o'ldirilgan jarayon uning umumiy
+# lock ini ushlab qolsa, yangi worker navbatdan o'qiy olmay qoladi.
+
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from telebot import apihelper
+
+from config import (
+    ALLOWED_UPDATES,
+    BOT_TOKEN,
+    DB_WRITER_BATCH_WAIT_MS,
+    DB_WRITER_MAX_BATCH,
+    SUPERVISOR_METRICS_INTERVAL,
+    SUPERVISOR_QUEUE_SIZE,
+    SUPERVISOR_RESTART_BACKOFF_MAX,
+    SUPERVISOR_WORKERS,
+)
+from webhook import update_user_id
+
+
+logger = logging.getLogger(__name__)
+
+# fork emas: supervisorda ishlayotgan threadlar / SQLite ulanishlari
+# bolaga nusxalanmasin
+_mp = multiprocessing.get_context("spawn")
+
+_POLL_TIMEOUT = 20
+
+# supervisor -> worker: update yo'q, faqat metrikalarni so'rash
+_PING = "ping"
+
+
+# ---------------------------------------
+# Worker jarayon
+# ---------------------------------------
+def _worker_main(index: int, conn):
+    """Bitta worker: o'z botida barcha handlerlar, pipe dan kelgan update larni ketma-ket bajaradi."""
+    # Ctrl+C ni supervisor boshqaradi – worker o'zi to'xtash buyrug'ini kutadi
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s worker-{index} %(levelname)s %(name)s: %(message)s",
+    )
+
+    from telebot import TeleBot, types
+
+    from database import (
+        close_all_connections,
+        set_database_writer,
+        start_activity_flusher,
+        stop_activity_flusher,
+    )
+    from db_writer import DatabaseWriter
+    from background import get_background_executor
+    from outbox import get_outbox_sender
+    from broadcast import get_broadcast_manager
+    from handlers.text_handlers import register_text_handlers
+    from handlers.callbacks import register_callback_handlers
+    from handlers.admin_handlers import register_admin_handlers
+    from points import register_points_handlers
+    from handlers.service_callbacks import register_service_callbacks
+    from handlers.channel_handlers import register_channel_handlers
+
+    # update lar shu threadda ketma-ket – per-user tartib shunga bog'liq
+    bot = TeleBot(BOT_TOKEN, threaded=False)
+    bot.parse_mode = None
+
+    writer = DatabaseWriter(
+        max_batch=DB_WRITER_MAX_BATCH,
+        batch_wait_ms=DB_WRITER_BATCH_WAIT_MS,
+    )
+    writer.start()
+    set_database_writer(writer)
+    start_activity_flusher()
+
+    background = get_background_executor()
+    background.start()
+
+    outbox = get_outbox_sender(bot) if index == 0 else None
+    if outbox is not None:
+        outbox.start()
+
+    register_text_handlers(bot)
+    register_callback_handlers(bot)
+    register_admin_handlers(bot)
+    register_points_handlers(bot)
+    register_service_callbacks(bot)
+    register_channel_handlers(bot)
+
+    # lease tufayli bir vazifani faqat bitta worker yurgizadi
+    get_broadcast_manager(bot).start_watchdog()
+
+    metrics = {"processed": 0, "errors": 0, "total_handle_ms": 0.0, "max_handle_ms": 0.0}
+
+    def snapshot() -> Dict[str, Any]:
+        data = dict(metrics)
+        bg = background.metrics()
+        data["background_queue_depth"] = bg["queue_depth"]
+        data["background_inline_runs"] = bg["inline_runs"]
+        return data
+
+    try:
+        while True:
+            try:
+                raw = conn.recv()
+            except EOFError:
+                # supervisor o'ldi
+                break
+            if raw is None:
+                break
+
+            if raw != _PING:
+                started = time.monotonic()
+                try:
+                    bot.process_new_updates([types.Update.de_json(raw)])
+                    metrics["processed"] += 1
+                except Exception:
+                    logger.exception("Update %s ni qayta ishlashda xato", raw.get("update_id"))
+                    metrics["errors"] += 1
+                elapsed_ms = (time.monotonic() - started) * 1000
+                metrics["total_handle_ms"] += elapsed_ms
+                metrics["max_handle_ms"] = max(metrics["max_handle_ms"], elapsed_ms)
+
+            # javob = "tayyorman" + metrikalar
+            conn.send(snapshot())
+    finally:
+        background.stop()
+        if outbox is not None:
+            outbox.stop()
+        stop_activity_flusher()
+        writer.stop()
+        set_database_writer(None)
+        close_all_connections()
+
+
+# ---------------------------------------
+# Supervisor
+# ---------------------------------------
+class Supervisor:
+    """
+    Ishlatish:
+        Supervisor(workers=4).run()   # Ctrl+C gacha
+
+    Navbat to'lsa polling to'xtab turadi (backpressure) – Telegram update
+    larni o'zida saqlaydi, offset esa faqat navbatga qo'yilganlar uchun oshadi.
+    """
+
+    def __init__(self, workers: int = SUPERVISOR_WORKERS):
+        self.workers = workers
+        self._queues: List["queue.Queue[Any]"] = [
+            queue.Queue(maxsize=SUPERVISOR_QUEUE_SIZE) for _ in range(workers)
+        ]
+        self._procs: List[Any] = [None] * workers
+        self._conns: List[Any] = [None] * workers
+        # har bir qayta ishga tushirishda oshadi – feeder yangi pipe ni kutadi
+        self._generation = [0] * workers
+        self._cond = threading.Condition()
+        self._restarts = [0] * workers
+        self._restart_at = [0.0] * workers
+        self._worker_metrics: Dict[int, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._offset: Optional[int] = None
+
+    # ---------------------------------------
+    # Workerlar
+    # ---------------------------------------
+    def _spawn(self, index: int):
+        parent_conn, child_conn = _mp.Pipe()
+        proc = _mp.Process(
+            target=_worker_main,
+            args=(index, child_conn),
+            name=f"worker-{index}",
+        )
+        proc.start()
+        # bolaning uchini yopamiz – worker o'lsa recv() EOFError beradi
+        child_conn.close()
+        with self._cond:
+            old = self._conns[index]
+            self._procs[index] = proc
+            self._conns[index] = parent_conn
+            self._generation[index] += 1
+            self._cond.notify_all()
+        if old is not None:
+            old.close()
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for index, proc in enumerate(self._procs):
+            if proc is None or proc.is_alive() or self._stop.is_set():
+                continue
+            if self._restart_at[index] == 0.0:
+                self._restarts[index] += 1
+                # ketma-ket qulashlarda kutish oshib boradi
+                delay = min(2 ** (self._restarts[index] - 1), SUPERVISOR_RESTART_BACKOFF_MAX)
+                self._restart_at[index] = now + delay
+                logger.error(
+                    "worker-%s to'xtadi (exitcode=%s), %s soniyadan keyin qayta ishga tushadi",
+                    index, proc.exitcode, delay,
+                )
+            if now >= self._restart_at[index]:
+                self._restart_at[index] = 0.0
+                self._spawn(index)
+
+    def _wait_respawn(self, index: int, generation: int):
+        with self._cond:
+            while self._generation[index] == generation and not self._stop.is_set():
+                self._cond.wait(1.0)
+
+    def _feed(self, index: int):
+        """Bitta workerning navbatini pipe orqali birma-bir uzatadi."""
+        q = self._queues[index]
+        item: Any = None
+        retry = False
+        while True:
+            if not retry:
+                try:
+                    item = q.get(timeout=SUPERVISOR_METRICS_INTERVAL)
+                except queue.Empty:
+                    item = _PING
+            retry = False
+
+            with self._cond:
+                conn, generation = self._conns[index], self._generation[index]
+
+            try:
+                conn.send(item)
+            except (OSError, ValueError):
+                if item is None:
+                    return
+                # worker allaqachon o'lgan – update yetib bormadi, yangisiga yuboramiz
+                self._wait_respawn(index, generation)
+                if self._stop.is_set():
+                    return
+                retry = True
+                continue
+            if item is None:
+                return
+
+            try:
+                reply = conn.recv()
+            except (EOFError, OSError):
+                if item != _PING:
+                    logger.error(
+                        "worker-%s update %s ni bajarayotganda qulagan – update tashlandi",
+                        index, item.get("update_id"),
+                    )
+                self._wait_respawn(index, generation)
+                if self._stop.is_set():
+                    return
+                continue
+
+            with self._lock:
+                self._worker_metrics[index] = reply
+
+    def metrics(self) -> Dict[str, Any]:
+        """Workerlar yuborgan oxirgi metrikalar yig'indisi + supervisor holati."""
+        with self._lock:
+            per_worker = [dict(m) for m in self._worker_metrics.values()]
+
+        total: Dict[str, Any] = {}
+        for data in per_worker:
+            for key, value in data.items():
+                if key.startswith("max_"):
+                    total[key] = max(total.get(key, 0), value)
+                else:
+                    total[key] = total.get(key, 0) + value
+
+        finished = total.get("processed", 0) + total.get("errors", 0)
+        total["avg_handle_ms"] = round(total.pop("total_handle_ms", 0.0) / finished, 1) if finished else 0
+        total["max_handle_ms"] = round(total.get("max_handle_ms", 0.0), 1)
+        total["workers"] = self.workers
+        total["workers_alive"] = sum(1 for p in self._procs if p is not None and p.is_alive())
+        total["restarts"] = sum(self._restarts)
+        total["queue_depths"] = [q.qsize() for q in self._queues]
+        return total
+
+    def _watch(self):
+        next_log = time.monotonic() + SUPERVISOR_METRICS_INTERVAL
+        while not self._stop.wait(1.0):
+            self._check_workers()
+            if time.monotonic() >= next_log:
+                logger.info("Supervisor metrikalari: %s", self.metrics())
+                next_log = time.monotonic() + SUPERVISOR_METRICS_INTERVAL
+
+    # ---------------------------------------
+    # Update lar
+    # ---------------------------------------
+    def dispatch(self, update: Dict[str, Any]) -> bool:
+        """Update ni egasi bo'lgan workerga beradi. To'xtatilayotgan bo'lsa False."""
+        user_id = update_user_id(update) or 0
+        target = self._queues[user_id % self.workers]
+        while not self._stop.is_set():
+            try:
+                target.put(update, timeout=1.0)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _skip_pending(self):
+        # main.py dagi skip_pending=True bilan bir xil: eski update lar tashlanadi
+        updates = apihelper.get_updates(BOT_TOKEN, offset=-1, timeout=0)
+        if updates:
+            self._offset = updates[-1]["update_id"] + 1
+
+    def _poll_once(self):
+        updates = apihelper.get_updates(
+            BOT_TOKEN,
+            offset=self._offset,
+            timeout=_POLL_TIMEOUT,
+            allowed_updates=ALLOWED_UPDATES,
+            long_polling_timeout=_POLL_TIMEOUT,
+        )
+        for update in updates:
+            if not self.dispatch(update):
+                return
+            self._offset = update["update_id"] + 1
+
+    # ---------------------------------------
+    # Boshqaruv
+    # ---------------------------------------
+    def start(self):
+        from database import close_all_connections
+        from migrations import run_migrations
+
+        # sxema bir marta, workerlardan oldin
+        run_migrations()
+        close_all_connections()
+
+        self._stop.clear()
+        for index in range(self.workers):
+            self._spawn(index)
+
+        self._threads = [
+            threading.Thread(target=self._feed, args=(i,), name=f"supervisor-feed-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        self._threads.append(
+            threading.Thread(target=self._watch, name="supervisor-watch", daemon=True)
+        )
+        for thread in self._threads:
+            thread.start()
+        logger.info("Supervisor: %s ta worker ishga tushdi", self.workers)
+
+    def run(self):
+        self.start()
+        try:
+            apihelper.delete_webhook(BOT_TOKEN)
+            self._skip_pending()
+            while not self._stop.is_set():
+                try:
+                    self._poll_once()
+                except Exception:
+                    logger.exception("Supervisor: get_updates xatosi")
+                    time.sleep(3)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self, timeout: float = 30.0):
+        """Workerlar navbatdagi update larni tugatib chiqadi; ulgurmaganlari o'ldiriladi."""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        # navbat oxiriga "to'xta" – feeder undan oldingilarni yetkazib bo'ladi
+        for q in self._queues:
+            try:
+                q.put(None, timeout=1.0)
+            except queue.Full:
+                # feeder ishlamayapti – worker pastda terminate qilinadi
+                pass
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        self._threads = []
+
+        for proc in self._procs:
+            if proc is None:
+                continue
+            proc.join(max(deadline - time.monotonic(), 0))
+            if proc.is_alive():
+                logger.warning("%s o'z vaqtida to'xtamadi – terminate", proc.name)
+                proc.terminate()
+                proc.join()
+        logger.info("Supervisor to'xtadi: %s", self.metrics())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    Supervisor().run()
@@ -1,50 +1,333 @@
 # utils.py
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Optional, Tuple
+
 from telebot import TeleBot
-from config import CHANNELS
+from telebot.apihelper import ApiTelegramException
+
+from config import (
+    CHANNELS,
+    SUBSCRIPTION_CACHE_MAX_ENTRIES,
+    SUBSCRIPTION_CHECK_TIMEOUT,
+    SUBSCRIPTION_CHECK_WORKERS,
+    SUBSCRIPTION_STALE_MAX_AGE,
+    SUBSCRIPTION_TTL_NEGATIVE,
+    SUBSCRIPTION_TTL_POSITIVE,
+)
+from database import (
+    get_channel_member,
+    is_deliverable,
+    mark_undeliverable,
+    save_channel_member,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# 400 xatolari ichida "bu chatga endi yozib bo'lmaydi" degan tavsiflar
+_UNREACHABLE_DESCRIPTIONS = (
+    "chat not found",
+    "user is deactivated",
+    "peer_id_invalid",
+    "bot can't initiate conversation",
+)
+
+
+class TokenBucket:
+    """
+    Oddiy token bucket: sekundiga `rate` ta, eng ko'pi bilan `capacity` ta
+    to'planadi. acquire() token bo'lguncha kutadi. pause(sec) – hamma
+    chaqiruvchilarni shuncha vaqt to'xtatadi (masalan 429 retry_after).
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return False
+            self._refill(now)
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1.0):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._refill(now)
+                    if self._tokens >= tokens:
+                        self._tokens -= tokens
+                        return
+                    wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+
+def is_unreachable_error(exc: Exception) -> bool:
+    """
+    403 (bot bloklangan / user o'chirilgan) yoki "chat not found" – qayta
+    urinish foydasiz. Tarmoq xatolari, 429, 5xx – vaqtinchalik, False.
+    """
+    if not isinstance(exc, ApiTelegramException):
+        return False
+    if exc.error_code == 403:
+        return True
+    description = str(getattr(exc, "description", "") or exc).lower()
+    return exc.error_code == 400 and any(d in description for d in _UNREACHABLE_DESCRIPTIONS)
+
+
+def retry_after_seconds(exc: Exception) -> Optional[float]:
+    """429 bo'lsa Telegram so'ragan kutish vaqti (soniya), aks holda None."""
+    if not isinstance(exc, ApiTelegramException) or exc.error_code != 429:
+        return None
+    params = (exc.result_json or {}).get("parameters") or {}
+    return float(params.get("retry_after", 1))
+
+
+def send_to_user(bot: TeleBot, user_id: int, text: str, **kwargs) -> bool:
+    """
+    Bitta userga xabar. Botni bloklagan userga umuman so'rov yubormaymiz;
+    403 / chat not found bo'lsa userni deliverable=0 qilib belgilaymiz
+    (keyingi /start da qayta yoqiladi). Yetkazilgan bo'lsa True.
+    """
+    if not is_deliverable(user_id):
+        return False
+    try:
+        bot.send_message(user_id, text, **kwargs)
+        return True
+    except Exception as exc:
+        if is_unreachable_error(exc):
+            mark_undeliverable([user_id])
+        else:
+            logger.warning("Xabar yuborilmadi (user_id=%s): %s", user_id, exc)
+        return False
+
+
+# ---------------------------------------
+# Kanal obunasi: xotira keshi -> channel_members jadvali -> API
+# ---------------------------------------
+_MEMBER_STATUSES = ("member", "administrator", "creator")
+
+# (kanal, user_id) -> (a'zomi, tekshirilgan vaqt – time.time(), ishonchlimi); LRU tartibida.
+# "ishonchli" – chat_member update dan kelgan, TTL qo'llanmaydi.
+_subscription_cache: "OrderedDict[Tuple[str, int], Tuple[bool, float, bool]]" = OrderedDict()
+_subscription_lock = threading.Lock()
+_subscription_pool = ThreadPoolExecutor(
+    max_workers=SUBSCRIPTION_CHECK_WORKERS, thread_name_prefix="subcheck"
+)
+
+
+def channel_key(ch: dict) -> Optional[str]:
+    """Kanalning tekshiruv kaliti: chat_id (bo'lsa) yoki @username. Faqat link bo'lsa None."""
+    if ch.get("chat_id"):
+        return str(ch["chat_id"])
+    return ch.get("username")
+
+
+def find_channel_key(chat) -> Optional[str]:
+    """Update dagi chat CHANNELS dan qaysi biri ekanini topadi (chat_id yoki username bo'yicha)."""
+    username = f"@{chat.username}".lower() if getattr(chat, "username", None) else None
+    for ch in CHANNELS:
+        if ch.get("chat_id") and int(ch["chat_id"]) == chat.id:
+            return channel_key(ch)
+        if username and (ch.get("username") or "").lower() == username:
+            return channel_key(ch)
+    return None
+
+
+def is_member_status(member) -> bool:
+    # restricted a'zo ham kanalda qoladi (is_member=True)
+    return member.status in _MEMBER_STATUSES or bool(
+        member.status == "restricted" and getattr(member, "is_member", False)
+    )
+
 
+def _cache_put(channel: str, user_id: int, entry: Tuple[bool, float, bool]):
+    with _subscription_lock:
+        _subscription_cache[(channel, user_id)] = entry
+        _subscription_cache.move_to_end((channel, user_id))
+        while len(_subscription_cache) > SUBSCRIPTION_CACHE_MAX_ENTRIES:
+            _subscription_cache.popitem(last=False)
 
-def is_user_subscribed(bot: TeleBot, user_id: int) -> bool:
+
+def _lookup_membership(channel: str, user_id: int) -> Optional[Tuple[bool, float, bool]]:
+    """Avval xotira, keyin channel_members (topilsa xotiraga ko'chiriladi)."""
+    with _subscription_lock:
+        entry = _subscription_cache.get((channel, user_id))
+        if entry is not None:
+            _subscription_cache.move_to_end((channel, user_id))
+            return entry
+
+    row = get_channel_member(channel, user_id)
+    if row is None:
+        return None
+    checked_at = (
+        datetime.fromisoformat(row["updated_at"]).replace(tzinfo=timezone.utc).timestamp()
+    )
+    entry = (bool(row["is_member"]), checked_at, row["source"] == "event")
+    _cache_put(channel, user_id, entry)
+    return entry
+
+
+def _is_fresh(entry: Tuple[bool, float, bool]) -> bool:
+    is_member, checked_at, authoritative = entry
+    if authoritative:
+        # update lar bot o'chiq paytida yo'qolishi mumkin (skip_pending) –
+        # shuning uchun ularga ham cheksiz ishonmaymiz
+        ttl = SUBSCRIPTION_STALE_MAX_AGE
+    else:
+        ttl = SUBSCRIPTION_TTL_POSITIVE if is_member else SUBSCRIPTION_TTL_NEGATIVE
+    return time.time() - checked_at < ttl
+
+
+def record_channel_member(channel: str, user_id: int, status: str, is_member: bool, source: str):
+    """Natijani xotira keshi va channel_members ga yozadi (source: "event" | "api")."""
+    _cache_put(channel, user_id, (is_member, time.time(), source == "event"))
+    save_channel_member(channel, user_id, status, is_member, source)
+
+
+def forget_subscription(user_id: int):
+    """Userning barcha kanallar bo'yicha xotira keshini o'chiradi."""
+    with _subscription_lock:
+        for key in [k for k in _subscription_cache if k[1] == user_id]:
+            del _subscription_cache[key]
+
+
+def channel_target(channel: str):
+    """channel_members kaliti -> get_chat_member chat_id si ("-100..." -> int)."""
+    return int(channel) if channel.lstrip("-").isdigit() else channel
+
+
+def _fetch_membership(bot: TeleBot, channel: str, user_id: int) -> bool:
+    """
+    Pool threadida ishlaydi. Natija shu yerda saqlanadi – timeoutdan keyin
+    kelgan javob ham keyingi tekshiruvga foyda beradi.
+    Telegram aniq javob bergan xatolar (user topilmadi, bot admin emas va h.k.)
+    – "a'zo emas"; tarmoq xatolari esa yuqoriga ko'tariladi (saqlanmaydi).
+    """
+    try:
+        member = bot.get_chat_member(channel_target(channel), user_id)
+        status, is_member = member.status, is_member_status(member)
+    except ApiTelegramException:
+        status, is_member = "error", False
+    record_channel_member(channel, user_id, status, is_member, "api")
+    return is_member
+
+
+def plan_subscription_check(user_id: int, force_refresh: bool = False) -> Tuple[Optional[bool], List[str]]:
+    """
+    is_user_subscribed ning API siz qismi (kesh / channel_members):
+    (True | False, []) – javob tayyor; (None, kanallar) – shu kanallarni
+    get_chat_member bilan tekshirish kerak. Async runtime ham shuni ishlatadi.
+    """
+    if not CHANNELS:
+        # Kanallar configda bo'lmasa, tekshiruv yo'q
+        return True, []
+
+    # faqat link berilgan (private kanal / invite link) kanallar tekshirilmaydi
+    channels = [key for key in map(channel_key, CHANNELS) if key]
+
+    # Agar birorta ham tekshiriladigan kanal bo'lmasa, faqat linklar bo'lsa -> obuna tekshiruvini o'tdi deb hisoblaymiz
+    if not channels:
+        return True, []
+
+    to_check = []
+    for channel in channels:
+        if force_refresh:
+            to_check.append(channel)
+            continue
+        entry = _lookup_membership(channel, user_id)
+        if entry is not None and _is_fresh(entry):
+            if entry[0]:
+                continue
+            # Shu kanalga obuna emas -> darrov False
+            return False, []
+        to_check.append(channel)
+
+    if not to_check:
+        return True, []
+    return None, to_check
+
+
+def stale_membership_ok(channel: str, user_id: int) -> bool:
+    """API javob bermadi – STALE_MAX_AGE dan yangi ijobiy natija bo'lsa o'tkazamiz."""
+    entry = _lookup_membership(channel, user_id)
+    return (
+        entry is not None
+        and entry[0]
+        and time.time() - entry[1] < SUBSCRIPTION_STALE_MAX_AGE
+    )
+
+
+def is_user_subscribed(bot: TeleBot, user_id: int, force_refresh: bool = False) -> bool:
     """
     Bir nechta kanal bo'yicha obuna tekshirish.
 
-    - Agar kanal uchun `username` berilgan bo'lsa (@kanal),
-      get_chat_member orqali HAQIQIY tekshiruv qilinadi.
+    - Agar kanal uchun `username` yoki `chat_id` berilgan bo'lsa,
+      HAQIQIY tekshiruv qilinadi.
     - Agar faqat `url` (invite link) bo'lsa, tekshiruv SKIP qilinadi
       (Telegram API linkdan obuna tekshirishga ruxsat bermaydi).
 
     Natija:
-      - Agar hech bo'lmaganda bitta `username`-li kanalga obuna bo'lmasa -> False.
-      - Agar barcha `username`-li kanallar bo'yicha "member/admin/creator" bo'lsa -> True.
-      - Agar umuman `username`-li kanal bo'lmasa, faqat linklar bo'lsa -> True
+      - Agar hech bo'lmaganda bitta tekshiriladigan kanalga obuna bo'lmasa -> False.
+      - Agar barcha tekshiriladigan kanallar bo'yicha a'zo bo'lsa -> True.
+      - Agar tekshiriladigan kanal bo'lmasa, faqat linklar bo'lsa -> True
         (faqat "bosib kir" darajasida ishlaydi).
+
+    Manba tartibi: xotira keshi -> channel_members (chat_member update lari
+    bilan yangilanadi) -> get_chat_member. API faqat noma'lum yoki TTL i
+    o'tgan userlar uchun, kanallar bo'yicha parallel chaqiriladi. API
+    SUBSCRIPTION_CHECK_TIMEOUT ichida javob bermasa yoki tarmoq xatosi bo'lsa,
+    eskirgan bo'lsa ham ijobiy natija qabul qilinadi.
+    chat_member update idan kelgan natija SUBSCRIPTION_STALE_MAX_AGE gacha
+    ishonchli. force_refresh=True – manbasidan qat'i nazar hamma kanal API
+    dan qayta so'raladi ("✅ Tekshirish" tugmasi uchun).
     """
-    if not CHANNELS:
-        # Kanallar configda bo'lmasa, tekshiruv yo'q
-        return True
+    verdict, to_check = plan_subscription_check(user_id, force_refresh)
+    if verdict is not None:
+        return verdict
 
-    # Hech bo'lmaganda bitta real check bo'ldimi yoki yo'q
-    any_username_channel = False
+    futures = {
+        _subscription_pool.submit(_fetch_membership, bot, channel, user_id): channel
+        for channel in to_check
+    }
+    done, _ = wait(futures, timeout=SUBSCRIPTION_CHECK_TIMEOUT)
 
-    for ch in CHANNELS:
-        username = ch.get("username")
-        if not username:
-            # faqat link berilgan (private kanal / invite link) -> tekshiruvni o'tkazib yuboramiz
+    for future, channel in futures.items():
+        if future in done and future.exception() is None:
+            if not future.result():
+                return False
             continue
 
-        any_username_channel = True
-
-        try:
-            member = bot.get_chat_member(username, user_id)
-            if member.status not in ["member", "administrator", "creator"]:
-                # Shu kanalga obuna emas -> darrov False
-                return False
-        except Exception:
-            # Chat topilmadi, bot admin emas, user yo'q va hokazo -> obuna emas deb hisoblaymiz
+        # timeout / tarmoq xatosi – yaqinda a'zo bo'lgan bo'lsa o'tkazamiz
+        if not stale_membership_ok(channel, user_id):
             return False
+        logger.warning("Obuna tekshiruvi javob bermadi (%s), eski natija ishlatildi", channel)
 
-    # Agar birorta ham username kanal bo'lmasa, faqat linklar bo'lsa -> obuna tekshiruvini o'tdi deb hisoblaymiz
-    if not any_username_channel:
-        return True
-
-    # Barcha username-kanallarda member bo'lsa
+    # Barcha kanallarda a'zo bo'lsa
     return True
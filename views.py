@@ -0,0 +1,353 @@
+# views.py
+# Ekranlar: (matn, klaviatura) quruvchilar. Sinxron (handlers/) va async
+# (async_handlers/) handlerlar bir xil matn va DB o'qishlarini shu yerdan
+# oladi – handler faqat yuborish bilan shug'ullanadi.
+# Funksiyalar DB dan o'qiydi, lekin Telegram API ga murojaat qilmaydi.
+
+from telebot import types
+
+from config import ADMIN_IDS, SERVICES, RETENTION_DAYS
+from database import (
+    get_referral_stats,
+    get_level1_users_with_stats,
+    get_active_referral_stats,
+    get_leaderboard,
+    get_user_rank,
+    get_rank_neighbours,
+    get_user_services,
+)
+from keyboards import (
+    main_menu_keyboard,
+    help_menu_keyboard,
+    subscription_keyboard,
+    services_inline_keyboard,
+)
+
+
+def is_admin(user_id: int) -> bool:
+    return user_id in ADMIN_IDS
+
+
+def ref_link_for(bot_username: str, user_id: int) -> str:
+    """User uchun referal link: https://t.me/YourBot?start=ref_USERID"""
+    return f"https://t.me/{bot_username}?start=ref_{user_id}"
+
+
+def main_menu(user_id: int):
+    text = (
+        "💎 PREMIUM XIZMATLAR — BEPUL! 💥\n\n"
+        "👥 Do'stlarni taklif qiling va referal orqali ball to'plang:\n"
+        "1 ta odam taklifi = ➕1 ball 🎯\n\n"
+        "🎁 Mukofotlar ro‘yxati:\n\n"
+        "✨ Telegram Gift = 7 ta referral\n"
+        "🎨 Canva Pro = 10 ta referral\n"
+        "🧠 Perplexity = 19 ta referral\n"
+        "🔮 Gemini AI = 18 ta referral\n"
+        "🤖 ChatGPT Plus = 20 ta referral\n"
+        "⭐ Telegram Premium = 29 ta referral\n"
+        "🐉 SuperGrok = 55 ta referral\n\n"
+        "🔥 Do‘stlaringizni taklif qiling — mukofotlar sizni kutmoqda!"
+    )
+
+    return text, main_menu_keyboard(is_admin=is_admin(user_id))
+
+
+def subscription_prompt():
+    text = (
+        "✅ Botni ishlatish uchun Selloriy kanaliga obuna bo'ling!\n\n"
+        "📢 Kanalga o'ting va obuna bo'ling, so'ngra '✅ Tekshirish' tugmasini bosing."
+    )
+
+    return text, subscription_keyboard()
+
+
+def new_referral_text(first_name, username) -> str:
+    """Taklif qilgan odamga: yangi foydalanuvchi keldi."""
+    return (
+        "🎉 Siz yangi foydalanuvchini taklif qildingiz!\n\n"
+        f"👤 Yangi foydalanuvchi: {first_name or ''} "
+        f"{'@' + username if username else ''}\n"
+        "✅ Sizga +1 ball qo'shildi.\n\n"
+        "🔥 Do'stingiz ham odam taklif qilsa, sizga ham bonus ball keladi!"
+    )
+
+
+def referral_dashboard(user_id: int, ref_link: str):
+    """🚀 Boshlash – referal link va balans."""
+    stats = get_referral_stats(user_id)
+
+    l1 = stats["level1_count"]
+    l2 = stats["level2_bonus"]
+    total = stats["total_points"]
+
+    costs_sorted = sorted(SERVICES.values(), key=lambda s: s["cost"])
+    next_service_text = "Mukofotlarga yaqinlashish uchun do'stlarni taklif qiling!"
+    for svc in costs_sorted:
+        if total < svc["cost"]:
+            next_service_text = (
+                f"🎯 Eng yaqin sovg'a: {svc['emoji']} {svc['name']} "
+                f"({svc['cost']} ball)"
+            )
+            break
+    else:
+        if costs_sorted:
+            next_service_text = (
+                "🎯 Eng qimmat mukofotga ham yetdingiz yoki juda yaqin turibsiz!"
+            )
+
+    text = (
+        "🔗 Sizning maxsus linkingiz:\n\n"
+        f"{ref_link}\n\n"
+        "📊 Hozirgi balans:\n"
+        f"👥 Level 1: {l1} ta\n"
+        f"🔥 Level 2: {l2} ta (25%)\n"
+        "━━━━━━━━━━\n"
+        f"💎 JAMI: {total} ta\n\n"
+        f"{next_service_text}"
+    )
+
+    return text, main_menu_keyboard(is_admin=is_admin(user_id))
+
+
+def share_screen(user_id: int, ref_link: str):
+    """📱 Share."""
+    text = (
+        "🔥 Share qiling:\n\n"
+        "📱 Instagram Story\n"
+        "📱 WhatsApp Status\n"
+        "📱 Copy Link\n\n"
+        f"{ref_link}\n\n"
+        "Taklif matni:\n"
+        "💎 ChatGPT Plus BEPUL!\n"
+        "15 ta do'st = 1 oy TEKIN! ⚡\n"
+        f"{ref_link}"
+    )
+
+    return text, main_menu_keyboard(is_admin=is_admin(user_id))
+
+
+def balance_dashboard(user_id: int):
+    """📊 Balans matni + klaviatura (📊 Balans tugmasi va back_to_balance callback uchun)."""
+    stats = get_referral_stats(user_id)
+    services = get_user_services(user_id)
+
+    approved = [s for s in services if s["status"] == "approved"]
+    pending = [s for s in services if s["status"] == "pending"]
+
+    l1 = stats["level1_count"]
+    l2 = stats["level2_bonus"]
+    total = stats["total_points"]
+    available = stats["available_points"]
+
+    if approved:
+        taken_lines = []
+        for s in approved:
+            key = s["service_key"]
+            svc = SERVICES.get(key)
+            name = svc["name"] if svc else key
+            taken_lines.append(f"• {name}")
+        taken_text = "\n".join(taken_lines)
+    else:
+        taken_text = "—"
+
+    possible_lines = []
+    for key, svc in SERVICES.items():
+        emoji = svc["emoji"]
+        name = svc["name"]
+        cost = svc["cost"]
+        mark = "✅" if available >= cost else "❌"
+        possible_lines.append(f"{emoji} {name} ({cost}) {mark}")
+    possible_text = "\n".join(possible_lines)
+
+    if pending:
+        pending_lines = []
+        for s in pending:
+            key = s["service_key"]
+            svc = SERVICES.get(key)
+            name = svc["name"] if svc else key
+            pending_lines.append(f"• {name} — ⏳ pending")
+        pending_text = "\n".join(pending_lines)
+    else:
+        pending_text = "—"
+
+    text = (
+        "💎 BALANS DASHBOARD\n\n"
+        f"👥 Level 1: {l1} ta ✅\n"
+        f"🔥 Level 2: {l2} ta (25%) 🔥\n"
+        "━━━━━━━━━━\n"
+        f"💎 JAMI: {total} ta\n"
+        f"💎 Mavjud: {available} ta\n\n"
+        "✅ Olingan sovg'alar:\n"
+        f"{taken_text}\n\n"
+        "⏳ PENDING:\n"
+        f"{pending_text}\n\n"
+        "🎯 Olish mumkin bo'lganlar:\n"
+        f"{possible_text}"
+    )
+
+    kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    kb.row(types.KeyboardButton("🎁 Xizmat olish"))
+    kb.row(types.KeyboardButton("🔙 Asosiy"))
+
+    return text, kb
+
+
+def services_screen(user_id: int):
+    """🎁 Xizmat olish – inline tugmalar bilan."""
+    stats = get_referral_stats(user_id)
+    available = stats["available_points"]
+
+    text = (
+        "🎁 XIZMAT TANLANG\n\n"
+        f"Balans: {available} ta 💎\n"
+        "Quyidagi xizmatlardan birini tanlang:"
+    )
+
+    return text, services_inline_keyboard(available)
+
+
+def service_accepted_text(svc: dict, cost: int, total: int, remaining: int) -> str:
+    """Xizmat so'rovi bazaga yozilgandan keyin userga ko'rsatiladigan matn."""
+    return (
+        "💎 Xizmat so'rovi qabul qilindi!\n\n"
+        f"Siz tanlagan xizmat: {svc['name']} ({cost} ball)\n"
+        f"Jami ballaringiz: {total} ta, mavjud: {remaining} ta.\n\n"
+        "Admin so'rovingizni ko'rib chiqadi va 1–12 soat ichida javob beradi."
+    )
+
+
+def network_screen(user_id: int):
+    """🌐 Network – Level 1 daraxti."""
+    stats = get_referral_stats(user_id)
+    level1_users = get_level1_users_with_stats(user_id)
+
+    l1 = stats["level1_count"]
+    l2_raw = stats["level2_raw"]
+    l2_bonus = stats["level2_bonus"]
+
+    lines = ["🌐 SIZNING NETWORK\n"]
+    lines.append("👤 Siz")
+    if level1_users:
+        lines.append(f"├─ 👥 Level 1 ({l1} ta):")
+        for child in level1_users[:10]:
+            uname = child["username"]
+            display = f"@{uname}" if uname else f"ID: {child['user_id']}"
+            bonus = int(child["level1_count"] * 0.25)
+            lines.append(
+                f"│  ├─ {display} → {child['level1_count']} ta (+{bonus} bonus)"
+            )
+    else:
+        lines.append("├─ 👥 Level 1: 0 ta")
+
+    lines.append(f"└─ 🔥 Level 2: {l2_raw} ta → {l2_bonus} ta bonus\n")
+
+    text = "\n".join(lines)
+
+    return text, main_menu_keyboard(is_admin=is_admin(user_id))
+
+
+def top_screen(user_id: int):
+    """🏆 Top – leaderboard + userning o'rni va qo'shnilari."""
+    leaderboard = get_leaderboard()
+
+    legend_lines = []
+    master_lines = []
+
+    for idx, u in enumerate(leaderboard, start=1):
+        total = u["total_points"]
+        uname = u["username"]
+        display = f"@{uname}" if uname else f"ID: {u['user_id']}"
+
+        if total >= 50:
+            legend_lines.append(f"{idx}. {display} — {total} ta 👑")
+        elif total >= 30:
+            master_lines.append(f"{idx}. {display} — {total} ta 💎")
+
+    if not legend_lines:
+        legend_lines.append("—")
+    if not master_lines:
+        master_lines.append("—")
+
+    me = get_user_rank(user_id)
+    if me is None:
+        user_line = "📍 Siz hali reytingga kira olmadingiz."
+    else:
+        neighbours = get_rank_neighbours(user_id)
+        near_lines = []
+        for u in neighbours["above"]:
+            display = f"@{u['username']}" if u["username"] else f"ID: {u['user_id']}"
+            near_lines.append(f"⬆️ #{u['rank']} {display} — {u['total_points']} ta")
+        near_lines.append(f"📍 Siz: #{me['rank']} — {me['total_points']} ta")
+        for u in neighbours["below"]:
+            display = f"@{u['username']}" if u["username"] else f"ID: {u['user_id']}"
+            near_lines.append(f"⬇️ #{u['rank']} {display} — {u['total_points']} ta")
+        user_line = "\n".join(near_lines)
+
+    text = (
+        "🏆 TOP USERS\n\n"
+        "👑 LEGENDS (50+):\n"
+        f"{chr(10).join(legend_lines)}\n\n"
+        "💎 MASTERS (30+):\n"
+        f"{chr(10).join(master_lines)}\n\n"
+        f"{user_line}"
+    )
+
+    return text, main_menu_keyboard(is_admin=is_admin(user_id))
+
+
+def help_screen():
+    """❓ Yordam menyusi."""
+    text = (
+        "❓ YORDAM / FAQ\n\n"
+        "Savollardan birini tanlang yoki to'g'ridan-to'g'ri admin bilan bog'laning."
+    )
+
+    return text, help_menu_keyboard()
+
+
+def retention_text(user_id: int) -> str:
+    """⏰ Retention check."""
+    total_stats = get_referral_stats(user_id)
+    active_stats = get_active_referral_stats(user_id, days=RETENTION_DAYS)
+
+    old_total = total_stats["total_points"]
+    new_total = active_stats["total_points"]
+    diff = old_total - new_total
+
+    return (
+        "⏰ RETENTION CHECK\n\n"
+        f"Oldingi (umumiy) ballar: {old_total} ta\n"
+        f"So'nggi {RETENTION_DAYS} kunda faol: {new_total} ta\n"
+        f"Minus (noaktivlar): {diff if diff > 0 else 0} ta"
+    )
+
+
+def rewards_text() -> str:
+    """💎 Mukofot olish?"""
+    lines = ["💎 MUKOFOTLAR"]
+    for svc in SERVICES.values():
+        lines.append(f"{svc['emoji']} {svc['name']} — {svc['cost']} ball")
+    return "\n".join(lines)
+
+
+# statik FAQ javoblari (tugma matni -> javob)
+HELP_HOW_TEXT = (
+    "📖 QANDAY ISHLAYDI?\n\n"
+    "1. /start ni bosing va kanalga obuna bo'ling.\n"
+    "2. \"🚀 Boshlash\" orqali o'zingizning referal linkingizni oling.\n"
+    "3. Linkni do'stlaringizga ulashing. Ular botga kirsa — sizga ball qo'shiladi.\n"
+    "4. Ballarni to'plab, \"🎁 Xizmat olish\" orqali mukofot tanlaysiz."
+)
+
+HELP_BONUS_TEXT = (
+    "🔥 2-LEVEL BONUS\n\n"
+    "👥 Level 1 — siz bevosita taklif qilgan foydalanuvchilar.\n"
+    "🔥 Level 2 — sizning Level 1 foydalanuvchilaringiz taklif qilganlar.\n\n"
+    "Har bir Level 2 foydalanuvchi sizga 25% bonus ball beradi (to'planib boradi)."
+)
+
+HELP_FRIENDS_TEXT = (
+    "👥 DO'STLAR FAOLLIGI\n\n"
+    "Retention tekshiruvi sizning referallaringiz botdan qay darajada foydalanayotganini ko'rsatadi.\n"
+    "Do'stlaringiz qancha ko'p faol bo'lsa, shuncha yaxshiroq statistikaga ega bo'lasiz."
+)
@@ -0,0 +1,264 @@
+# webhook.py
+# Webhook rejimi: ichki HTTP server Telegram update larini qabul qiladi,
+# secret token ni tekshiradi, update_id bo'yicha dublikatlarni tashlaydi va
+# update ni user_id bo'yicha tanlangan worker navbatiga qo'yadi (bitta
+# userning update lari doim bitta workerda – tartib saqlanadi).
+#
+#   POST <WEBHOOK_PATH>  – Telegram update (JSON)
+#   GET  /healthz        – holat va metrikalar (JSON)
+#
+# Lokal sinash (WEBHOOK_URL bo'sh – set_webhook chaqirilmaydi):
+#   python main.py --mode webhook
+#   curl -X POST localhost:8443/telegram \
+#        -H "X-Telegram-Bot-Api-Secret-Token: <WEBHOOK_SECRET>" \
+#        -H "Content-Type: application/json" -d @update.json
+
+import hmac
+import json
+import logging
+import queue
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from telebot import TeleBot, types
+
+from antiflood import get_flood_guard
+from config import (
+    WEBHOOK_DEDUP_SIZE,
+    WEBHOOK_HOST,
+    WEBHOOK_MAX_BODY_BYTES,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+    WEBHOOK_WORKERS,
+)
+
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+# update ichida foydalanuvchi qayerda bo'lishi mumkin
+_USER_FIELDS = (
+    "message",
+    "edited_message",
+    "callback_query",
+    "inline_query",
+    "chat_member",
+    "my_chat_member",
+    "pre_checkout_query",
+    "shipping_query",
+)
+
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """Xom update JSON dan user_id (yo'q bo'lsa chat id, u ham yo'q bo'lsa None)."""
+    for field in _USER_FIELDS:
+        obj = update.get(field)
+        if not obj:
+            continue
+        user = obj.get("from") or obj.get("user")
+        if user:
+            return user.get("id")
+        chat = obj.get("chat")
+        if chat:
+            return chat.get("id")
+    return None
+
+
+class WebhookServer:
+    """
+    Ishlatish:
+        server = WebhookServer(bot, allowed_updates)
+        server.serve_forever()   # Ctrl+C / stop() gacha
+
+    Navbat to'lsa 503 qaytaramiz – Telegram update ni keyinroq qayta yuboradi.
+    """
+
+    def __init__(self, bot: TeleBot, allowed_updates: Optional[List[str]] = None):
+        self.bot = bot
+        # handlerlar shu moduldagi workerlarda bajariladi – TeleBot ning
+        # o'z thread pool i orqali ikkinchi marta navbatga qo'ymaymiz
+        self.bot.threaded = False
+        self.allowed_updates = allowed_updates
+
+        per_worker = max(WEBHOOK_QUEUE_SIZE // WEBHOOK_WORKERS, 1)
+        self._queues: List["queue.Queue[Any]"] = [
+            queue.Queue(maxsize=per_worker) for _ in range(WEBHOOK_WORKERS)
+        ]
+        self._workers: List[threading.Thread] = []
+        # navbatda turgan update lar ham anti-flood "navbat chuqurligi" ga kiradi
+        get_flood_guard(bot).add_backlog(lambda: sum(q.qsize() for q in self._queues))
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = {
+            "received": 0,
+            "processed": 0,
+            "duplicates": 0,
+            "rejected": 0,
+            "errors": 0,
+        }
+        self._httpd: Optional[ThreadingHTTPServer] = None
+
+    # ---------------------------------------
+    # Qabul qilish
+    # ---------------------------------------
+    def _is_duplicate(self, update_id: int) -> bool:
+        with self._lock:
+            if update_id in self._seen:
+                self._seen.move_to_end(update_id)
+                self._metrics["duplicates"] += 1
+                return True
+            self._seen[update_id] = None
+            while len(self._seen) > WEBHOOK_DEDUP_SIZE:
+                self._seen.popitem(last=False)
+            return False
+
+    def _forget(self, update_id: int):
+        with self._lock:
+            self._seen.pop(update_id, None)
+
+    def accept(self, update: Dict[str, Any]) -> int:
+        """Bitta update ni navbatga qo'yadi. HTTP status kodini qaytaradi."""
+        update_id = update.get("update_id")
+        if not isinstance(update_id, int):
+            return 400
+
+        with self._lock:
+            self._metrics["received"] += 1
+        if self._is_duplicate(update_id):
+            return 200
+
+        user_id = update_user_id(update) or 0
+        try:
+            self._queues[user_id % len(self._queues)].put_nowait(update)
+        except queue.Full:
+            # qabul qilinmadi – Telegram qayta yuborganda dublikat deb tashlamaslik uchun
+            self._forget(update_id)
+            with self._lock:
+                self._metrics["rejected"] += 1
+            return 503
+        return 200
+
+    def health(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self._metrics)
+        data["queue_depth"] = sum(q.qsize() for q in self._queues)
+        data["workers_alive"] = sum(t.is_alive() for t in self._workers)
+        data["workers"] = len(self._queues)
+        data["status"] = "ok" if data["workers_alive"] == data["workers"] else "degraded"
+        return data
+
+    # ---------------------------------------
+    # Workerlar
+    # ---------------------------------------
+    def _run_worker(self, q: "queue.Queue[Any]"):
+        while True:
+            raw = q.get()
+            if raw is _STOP:
+                return
+            try:
+                update = types.Update.de_json(raw)
+                self.bot.process_new_updates([update])
+                ok = True
+            except Exception:
+                logger.exception("Update %s ni qayta ishlashda xato", raw.get("update_id"))
+                ok = False
+            with self._lock:
+                self._metrics["processed" if ok else "errors"] += 1
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status: int, body: Optional[Dict[str, Any]] = None):
+                payload = json.dumps(body or {}).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path == "/healthz":
+                    health = server.health()
+                    self._reply(200 if health["status"] == "ok" else 503, health)
+                    return
+                self._reply(404)
+
+            def do_POST(self):
+                if self.path != WEBHOOK_PATH:
+                    self._reply(404)
+                    return
+
+                token = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+                if not WEBHOOK_SECRET or not hmac.compare_digest(token, WEBHOOK_SECRET):
+                    self._reply(403)
+                    return
+
+                length = int(self.headers.get("Content-Length") or 0)
+                if length <= 0 or length > WEBHOOK_MAX_BODY_BYTES:
+                    self._reply(413 if length > 0 else 400)
+                    return
+
+                try:
+                    update = json.loads(self.rfile.read(length))
+                except ValueError:
+                    self._reply(400)
+                    return
+                if not isinstance(update, dict):
+                    self._reply(400)
+                    return
+
+                self._reply(server.accept(update))
+
+            def log_message(self, format, *args):
+                # har bir so'rovni INFO ga yozmaymiz
+                logger.debug("webhook: " + format, *args)
+
+        return Handler
+
+    # ---------------------------------------
+    # Boshqaruv
+    # ---------------------------------------
+    def start(self):
+        self._workers = [
+            threading.Thread(target=self._run_worker, args=(q,), name=f"webhook-{i}", daemon=True)
+            for i, q in enumerate(self._queues)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+        self._httpd = ThreadingHTTPServer((WEBHOOK_HOST, WEBHOOK_PORT), self._make_handler())
+
+        if WEBHOOK_URL:
+            # restart paytida to'plangan update lar saqlanadi (drop_pending_updates=False)
+            self.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=self.allowed_updates,
+                max_connections=WEBHOOK_WORKERS,
+            )
+        logger.info("Webhook server %s:%s%s da tinglayapti", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+
+    def serve_forever(self):
+        self.start()
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self.stop()
+
+    def stop(self, timeout: float = 10.0):
+        """HTTP ni yopadi, navbatdagi update larni tugatib workerlarni to'xtatadi."""
+        if self._httpd is not None:
+            self._httpd.server_close()
+            self._httpd = None
+        for q in self._queues:
+            q.put(_STOP)
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []